@@ -12,6 +12,48 @@ var engine = require("binary-engine"),
     B_DECODE_DEFAULT = engine.B_DECODE_DEFAULT,
     B_ENCODE_DEFAULT = engine.B_ENCODE_DEFAULT,
     B_TRANSCODE = engine.B_TRANSCODE;
+
+// engines whose byte storage is slow to reach one byte at a time can
+// move whole ranges to and from arrays of numbers
+var B_TO_ARRAY = engine.B_TO_ARRAY || function(bytes, offset, length) {
+    var array = new Array(length);
+    for (var i = 0; i < length; i++)
+        array[i] = B_GET(bytes, offset + i);
+    return array;
+};
+
+// the number of bytes that the iteration methods read at once on
+// engines with a bulk B_TO_ARRAY, which bounds the copy they make
+var ITERATION_CHUNK = 4096;
+
+// calls visit(value, index) with each of the first 'length' bytes of
+// a binary.  engines with a bulk B_TO_ARRAY read them a chunk at a
+// time, so a callback's writes to later bytes of the same chunk
+// aren't seen; others read them one at a time.  only for methods
+// whose callbacks can't stop the iteration early.
+var iterate = function(binary, length, visit) {
+    if (!engine.B_TO_ARRAY) {
+        for (var i = 0; i < length; i++)
+            visit(binary.get(i), i);
+        return;
+    }
+    for (var start = 0; start < length; start += ITERATION_CHUNK) {
+        var count = Math.min(ITERATION_CHUNK, length - start,
+            binary._length - start);
+        if (count <= 0)
+            return;
+        var chunk = B_TO_ARRAY(binary._bytes, binary._offset + start, count);
+        for (var j = 0; j < chunk.length; j++)
+            visit(chunk[j], start + j);
+    }
+};
+
+var B_FROM_ARRAY = engine.B_FROM_ARRAY || function(array) {
+    var bytes = B_ALLOC(array.length);
+    for (var i = 0; i < array.length; i++)
+        B_SET(bytes, i, array[i]);
+    return bytes;
+};
     
 var Binary = exports.Binary = function() {
     // this._bytes
@@ -31,12 +73,7 @@ Binary.prototype.__defineSetter__("length", function(length) {
 // toArray(charset) - an array of the code points, decoded
 Binary.prototype.toArray = function(charset) {
     if (arguments.length === 0) {
-        var array = new Array(this._length);
-        
-        for (var i = 0; i < this._length; i++)
-            array[i] = this.get(i);
-        
-        return array;
+        return B_TO_ARRAY(this._bytes, this._offset, this._length);
     }
     else if (arguments.length === 1) {
         var string = B_DECODE(this._bytes, this._offset, this._length, charset),
@@ -156,7 +193,6 @@ var ByteString = exports.ByteString = function() {
     // ByteString(arrayOfNumbers) - Use the numbers in arrayOfNumbers as the bytes.
     else if (arguments.length === 1 && Array.isArray(arguments[0])) {
         var array = arguments[0];
-        this._bytes = B_ALLOC(array.length);
         for (var i = 0; i < array.length; i++) {
             var b = array[i];
             // If any element is outside the range 0...255, an exception (TODO) is thrown.
@@ -164,8 +200,8 @@ var ByteString = exports.ByteString = function() {
                 throw new Error("ByteString constructor argument Array of integers must be -128 - 255 ("+b+")");
             // Java "bytes" are interpreted as 2's complement
             //this._bytes[i] = (b < 128) ? b : -1 * ((b ^ 0xFF) + 1);
-            B_SET(this._bytes, i, b);
         }
+        this._bytes = B_FROM_ARRAY(array);
         this._offset = 0;
         this._length = B_LENGTH(this._bytes);
     }
@@ -406,7 +442,6 @@ var ByteArray = exports.ByteArray = function() {
     // Throws an exception if any element is outside the range 0...255 (TODO).
     else if (arguments.length === 1 && Array.isArray(arguments[0])) {
         var array = arguments[0];
-        this._bytes = B_ALLOC(array.length);
         for (var i = 0; i < array.length; i++) {
             var b = array[i];
             // If any element is outside the range 0...255, an exception (TODO) is thrown.
@@ -414,8 +449,8 @@ var ByteArray = exports.ByteArray = function() {
                 throw new Error("ByteString constructor argument Array of integers must be 0 - 255 ("+b+")");
             // Java "bytes" are interpreted as 2's complement
             //this._bytes[i] = (b < 128) ? b : -1 * ((b ^ 0xFF) + 1);
-            B_SET(this._bytes, i, b);
         }
+        this._bytes = B_FROM_ARRAY(array);
         this._offset = 0;
         this._length = B_LENGTH(this._bytes);
     }
@@ -671,8 +706,10 @@ ByteArray.prototype.filter = function(callback, thisObject) {
 
 // forEach(callback[, thisObject]);
 ByteArray.prototype.forEach = function(callback, thisObject) {
-    for (var i = 0, length = this._length; i < length; i++)
-        callback.apply(thisObject, [this.get(i), i, this]);
+    var self = this;
+    iterate(this, this._length, function(value, i) {
+        callback.apply(thisObject, [value, i, self]);
+    });
 };
 
 // every(callback[, thisObject])
@@ -693,17 +730,29 @@ ByteArray.prototype.some = function(callback, thisObject) {
 
 // map(callback[, thisObject]);
 ByteArray.prototype.map = function(callback, thisObject) {
-    var result = new ByteArray(this._length);
-    for (var i = 0, length = this._length; i < length; i++)
-        result.set(i, callback.apply(thisObject, [this.get(i), i, this]));
-    return result;
+    var self = this,
+        length = this._length;
+    if (!engine.B_FROM_ARRAY) {
+        var result = new ByteArray(length);
+        iterate(this, length, function(value, i) {
+            result.set(i, callback.apply(thisObject, [value, i, self]));
+        });
+        return result;
+    }
+    var array = new Array(length);
+    iterate(this, length, function(value, i) {
+        array[i] = callback.apply(thisObject, [value, i, self]);
+    });
+    return new ByteArray(array);
 };
 
 // reduce(callback[, initialValue])
 ByteArray.prototype.reduce = function(callback, initialValue) {
-    var value = initialValue;
-    for (var i = 0, length = this._length; i < length; i++)
-        value = callback(value, this.get(i), i, this);
+    var self = this,
+        value = initialValue;
+    iterate(this, this._length, function(byte, i) {
+        value = callback(value, byte, i, self);
+    });
     return value;
 };
 
@@ -19,13 +19,35 @@
          return pyder.isFile.apply(pyder, arguments);
        }
      },
+     // the module loader's view of the file system, which also sees
+     // inside module archives (see archive.py)
+     moduleFs: {
+       isFile: function isFile(path) {
+         return pyder.loaderIsFile(path);
+       },
+       read: function read(path, options) {
+         return pyder.loaderRead(path, options);
+       },
+       mtime: function mtime(path) {
+         return pyder.loaderMtime(path);
+       }
+     },
+     // finds modules in an index of the files on the search path,
+     // kept by resolver.py, instead of trying each directory in turn
+     moduleIndex: {
+       setPaths: function setPaths(paths, extensions) {
+         return pyder.setModulePaths(paths, extensions);
+       },
+       resolve: function resolve(id, searchPath) {
+         return pyder.resolve(id, null, searchPath);
+       }
+     },
      prefix: "",
      prefixes: [""],
      evaluate: function evaluate(code, filename, lineno) {
-       code = ("function(require,exports,module,system,print){" +
-               code +
-               "\n// */\n}");
-       return pyder.evaluate(code, filename, lineno);
+       var prefix = "function(require,exports,module,system,print){";
+       code = prefix + code + "\n// */\n}";
+       return pyder.evaluate(code, filename, lineno, prefix);
      },
      debug: false,
      verbose: false
@@ -0,0 +1,72 @@
+// byte storage is a Python bytearray, see ByteBuffer in narwhal.py
+
+exports.B_LENGTH = function(bytes) {
+    return bytes.length;
+}
+
+exports.B_ALLOC = function(length) {
+    return pyder.allocBytes(length);
+}
+
+exports.B_FILL = function(bytes, from, to, value) {
+    bytes.fill(from, to, value);
+}
+
+exports.B_COPY = function(src, srcOffset, dst, dstOffset, length) {
+    dst.copyFrom(src, srcOffset, dstOffset, length);
+}
+
+exports.B_GET = function(bytes, index) {
+    return bytes.get(index);
+}   
+
+exports.B_SET = function(bytes, index, value) {
+    return bytes.set(index, value);
+}
+
+// whole ranges cross between JS and Python as a string of one
+// character per byte, since a call per byte costs far more than
+// reading a JS array
+
+exports.B_TO_ARRAY = function(bytes, offset, length) {
+    var string = bytes.decode(offset, length, "latin-1"),
+        array = new Array(length);
+    for (var i = 0; i < length; i++)
+        array[i] = string.charCodeAt(i);
+    return array;
+}
+
+// how many bytes are passed to String.fromCharCode at a time, which
+// takes them as arguments
+var CHUNK_SIZE = 4096;
+
+exports.B_FROM_ARRAY = function(array) {
+    var chunks = [];
+    for (var i = 0; i < array.length; i += CHUNK_SIZE) {
+        var chunk = array.slice(i, i + CHUNK_SIZE);
+        for (var j = 0; j < chunk.length; j++)
+            chunk[j] &= 0xFF;
+        chunks.push(String.fromCharCode.apply(String, chunk));
+    }
+    return pyder.encodeBytes(chunks.join(""), "latin-1");
+}
+
+exports.B_DECODE = function(bytes, offset, length, codec) {
+    return bytes.decode(offset, length, codec);
+}
+
+exports.B_DECODE_DEFAULT = function(bytes, offset, length) {
+    return bytes.decode(offset, length);
+}
+
+exports.B_ENCODE = function(string, codec) {
+    return pyder.encodeBytes(string, codec);
+}
+
+exports.B_ENCODE_DEFAULT = function(string) {
+    return pyder.encodeBytes(string);
+}
+
+exports.B_TRANSCODE = function(bytes, offset, length, sourceCodec, targetCodec) {
+    return bytes.transcode(offset, length, sourceCodec, targetCodec);
+}
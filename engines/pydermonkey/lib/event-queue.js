@@ -0,0 +1,30 @@
+// event queue: tasks enqueued by this process run on the engine's
+// reactor (see reactor.py), along with timers, I/O callbacks, and
+// events from the worker processes it started and from its parent,
+// if it's a worker.  the reactor is the only consumer of tasks;
+// nextEvent just turns its loop once.
+
+var reactor = pyder.reactor;
+
+exports.enqueue = function (task, priority) {
+    reactor.enqueue(task); // priority is ignored for now
+};
+
+exports.isEmpty = function () {
+    return !reactor.hasTasks();
+};
+
+// called with each [source, type, data] event from another process;
+// the "worker" module replaces this to deliver them
+exports.dispatchExternal = function (event) {
+};
+
+var runOnce = function () {
+    reactor.runOnce();
+};
+
+exports.nextEvent = function () {
+    if (reactor.isIdle())
+        throw new Error("The event queue is empty and there is nothing left to fill it.");
+    return runOnce;
+};
@@ -11,6 +11,55 @@ exports.list = function (path) {
   return pyder.listDirectory(path);
 };
 
+// walks the tree with one scan per directory, since each scan also
+// reports which entries are directories
+exports.listTree = function (path) {
+    path = String(path || '');
+    if (!path)
+        path = ".";
+    var paths = [""];
+    pyder.scanDirectory(path).forEach(function (entry) {
+        if (entry.isDirectory) {
+            paths.push.apply(paths, exports.listTree(exports.join(path, entry.name)).map(function (p) {
+                return exports.join(entry.name, p);
+            }));
+        } else {
+            paths.push(entry.name);
+        }
+    });
+    return paths;
+};
+
+exports.listDirectoryTree = function (path) {
+    path = String(path || '');
+    if (!path)
+        path = ".";
+    var paths = [""];
+    pyder.scanDirectory(path).forEach(function (entry) {
+        if (entry.isDirectory) {
+            paths.push.apply(paths, exports.listDirectoryTree(exports.join(path, entry.name)).map(function (p) {
+                return exports.join(entry.name, p);
+            }));
+        }
+    });
+    return paths;
+};
+
+// reads whole text files with a single call, which also lets a
+// frozen module bundle serve them without touching the filesystem
+var openAndRead = exports.read;
+exports.read = function (path, options) {
+    if (typeof path != "object" && (
+        options === undefined ||
+        typeof options == "object" && options !== null &&
+        Object.keys(options).every(function (key) {
+            return key == "charset";
+        })
+    ))
+        return pyder.read(String(path), options);
+    return openAndRead.apply(this, arguments);
+};
+
 exports.canonical = function (path) {
   return pyder.canonical(path);
 };
@@ -76,8 +125,37 @@ exports.touch = function (path, mtime) {
     throw Error("touch not yet implemented.");
 };
 
-// FIXME temporary hack
-var readfile = system.fs.read; // from bootstrap system object
+// a raw byte stream over a Python file handle, which reads into and
+// writes from the Python-backed storage of ByteStrings and ByteArrays
+var BinaryIO = function (handle) {
+    this._handle = handle;
+};
+
+BinaryIO.prototype.read = function (length) {
+    var ByteString = require("binary").ByteString;
+    var bytes = this._handle.readBytes(length);
+    return new ByteString(bytes, 0, bytes.length);
+};
+
+BinaryIO.prototype.readInto = function (buffer, length, from) {
+    return this._handle.readInto(buffer, length, from);
+};
+
+BinaryIO.prototype.write = function (object, charset) {
+    var binary = object.toByteString(charset);
+    this._handle.writeInto(binary, 0, binary.length);
+    return this;
+};
+
+BinaryIO.prototype.writeInto = function (buffer, from, to) {
+    this._handle.writeInto(buffer, from, to);
+};
+
+["seek", "tell", "flush", "isatty", "close"].forEach(function (name) {
+    BinaryIO.prototype[name] = function () {
+        return this._handle[name].apply(this._handle, arguments);
+    };
+});
 
 exports.FileIO = function (path, mode, permissions) {
     mode = exports.mode(mode);
@@ -86,21 +164,20 @@ exports.FileIO = function (path, mode, permissions) {
         append = mode.append,
         update = mode.update;
 
+    var pyMode;
     if (update) {
-        throw new Error("Updating IO not yet implemented.");
-    } else if (write || append) {
-        throw new Error("Writing IO not yet implemented.");
+        pyMode = "r+b";
+    } else if (append) {
+        pyMode = "ab";
+    } else if (write) {
+        pyMode = "wb";
     } else if (read) {
-        // FIXME temporary hack
-        return {
-            'read': function () {
-                return readfile(path);
-            },
-            'close': function () {
-            }
-        };
+        pyMode = "rb";
     } else {
         throw new Error("Files must be opened either for read, write, or update mode.");
     }
+    if (mode.binary)
+        return new BinaryIO(pyder.open(path, pyMode, null));
+    return pyder.open(path, pyMode, "utf-8");
 };
 
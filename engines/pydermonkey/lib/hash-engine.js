@@ -0,0 +1,79 @@
+// streaming hashes computed by Python's hashlib and zlib (see
+// hashes.py); strings are hashed by the low byte of each character, like
+// the pure-JS hash modules do, and ByteStrings and ByteArrays are hashed
+// in place without being copied
+
+var algorithms = pyder.hashAlgorithms();
+
+var isBinary = function (data) {
+    return data instanceof require("binary").Binary;
+};
+
+exports.supports = function (name) {
+    return algorithms.indexOf(name) >= 0;
+};
+
+var Hash = exports.Hash = function (name) {
+    if (!(this instanceof Hash))
+        return new Hash(name);
+    this._raw = pyder.newHash(name);
+    this.name = name;
+};
+
+Hash.prototype.update = function (data) {
+    if (isBinary(data))
+        this._raw.updateBytes(data, 0, data.length);
+    else
+        this._raw.update(String(data));
+    return this;
+};
+
+Hash.prototype.digest = function () {
+    var ByteString = require("binary").ByteString;
+    var bytes = this._raw.digest();
+    return new ByteString(bytes, 0, bytes.length);
+};
+
+Hash.prototype.hexDigest = function () {
+    return this._raw.hexDigest();
+};
+
+Hash.prototype.copy = function () {
+    var copy = Object.create(Hash.prototype);
+    copy._raw = this._raw.copy();
+    copy.name = this.name;
+    return copy;
+};
+
+exports.hash = function (name, data) {
+    return new Hash(name).update(data).digest();
+};
+
+var Crc32 = exports.Crc32 = function () {
+    if (!(this instanceof Crc32))
+        return new Crc32();
+    this._raw = pyder.newCrc32();
+};
+
+Crc32.prototype.update = function (data) {
+    if (isBinary(data))
+        this._raw.updateBytes(data, 0, data.length);
+    else
+        this._raw.update(String(data));
+    return this;
+};
+
+// the checksum as a signed 32-bit integer, like crc32.hash() returns
+Crc32.prototype.digest = function () {
+    return this._raw.digest();
+};
+
+Crc32.prototype.copy = function () {
+    var copy = Object.create(Crc32.prototype);
+    copy._raw = this._raw.copy();
+    return copy;
+};
+
+exports.crc32 = function (data) {
+    return new Crc32().update(data).digest();
+};
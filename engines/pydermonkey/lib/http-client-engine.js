@@ -0,0 +1,87 @@
+// HTTP client over the engine's pool of keep-alive connections (see
+// httpclient.py); request bodies are streamed to the server piece by
+// piece and response bodies are read from it in chunks
+
+var HashP = require("hashp").HashP;
+
+var engine = exports;
+
+// number of bytes read from the response body at a time
+engine.CHUNK_SIZE = 8192;
+
+// sets the number of idle connections kept per host and the number of
+// seconds they're kept for
+engine.configure = function (maxPerHost, idleTimeout) {
+    pyder.configureHttp(maxPerHost, idleTimeout);
+};
+
+engine.connect = function HttpClient_engine_connect (tx) {
+    if (tx._isConnected) return tx._response;
+    if (!tx.headers) tx.headers = {};
+
+    // a body that's all there up front gets an exact Content-Length,
+    // since the one HttpClient adds up counts characters; any other
+    // body is streamed raw under the caller's Content-Length, or with
+    // chunked transfer encoding when its length isn't known
+    var pieces = null;
+    if (Array.isArray(tx.body)) {
+        pieces = tx.body.map(function (piece) {
+            return piece.toByteString("utf-8");
+        });
+        var length = pieces.reduce(function (total, piece) {
+            return total + piece.length;
+        }, 0);
+        if (length || HashP.includes(tx.headers, "Content-Length"))
+            HashP.set(tx.headers, "Content-Length", length);
+    }
+
+    var headers = [];
+    HashP.forEach(tx.headers, function (name, value) {
+        headers.push([name, String(value)]);
+    });
+    var request = pyder.httpRequest(tx.method || "GET", String(tx.url), headers);
+    var write = function (piece) {
+        var binary = piece.toByteString("utf-8");
+        if (binary.length)
+            request.writeInto(binary, 0, binary.length);
+    };
+    if (pieces)
+        pieces.forEach(write);
+    else if (tx.body)
+        tx.body.forEach(write);
+
+    var response = request.finish();
+    tx._isConnected = true;
+    var resp = tx._response = {
+        status: response.status,
+        statusText: response.statusText,
+        headers: {},
+        body: null
+    };
+    response.headers.forEach(function (header) {
+        var name = header[0], value = header[1];
+        var previous = HashP.get(resp.headers, name);
+        HashP.set(resp.headers, name,
+            previous === undefined ? value : previous + ", " + value);
+    });
+
+    // the body can only be read once; the connection goes back to the
+    // pool as soon as it's been read to the end.  chunks end on UTF-8
+    // character boundaries, since HttpClient.decode decodes each one
+    // on its own
+    resp.body = {forEach: function (block) {
+        var ByteString = require("binary").ByteString;
+        try {
+            for (
+                var bytes = response.readChunk(engine.CHUNK_SIZE);
+                bytes.length > 0;
+                bytes = response.readChunk(engine.CHUNK_SIZE)
+            ) block(new ByteString(bytes, 0, bytes.length));
+        } finally {
+            response.close();
+        }
+    }};
+
+    return resp;
+};
+
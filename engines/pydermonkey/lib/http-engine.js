@@ -0,0 +1,30 @@
+// a raw byte stream over the body of a GET request, made through the
+// engine's pool of keep-alive HTTP connections
+
+var ResponseIO = function (response) {
+    this._response = response;
+};
+
+ResponseIO.prototype.read = function (length) {
+    var ByteString = require("binary").ByteString;
+    var bytes = this._response.readBytes(length);
+    return new ByteString(bytes, 0, bytes.length);
+};
+
+ResponseIO.prototype.readInto = function (buffer, length, from) {
+    return this._response.readInto(buffer, length, from);
+};
+
+ResponseIO.prototype.close = function () {
+    this._response.close();
+};
+
+exports.IO = function (url) {
+    var response = pyder.httpRequest("GET", String(url), []).finish();
+    if (response.status >= 400) {
+        response.close();
+        throw new Error("Could not open " + url + ": " + response.statusText);
+    }
+    return new ResponseIO(response);
+};
+
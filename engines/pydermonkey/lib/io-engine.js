@@ -0,0 +1,230 @@
+// IO: pydermonkey
+
+// number of characters copied between streams at a time
+var CHUNK_SIZE = 64 * 1024;
+
+var IO = exports.IO = function(inputStream, outputStream) {
+    this.inputStream = inputStream;
+    this.outputStream = outputStream;
+}
+
+IO.prototype.read = function(length) {
+    return this.inputStream(length);
+}
+
+IO.prototype.write = function(object) {
+    this.outputStream(object);
+    return this;
+}
+
+IO.prototype.flush = function() {
+    return this;
+}
+
+IO.prototype.close = function() {
+}
+
+exports.TextIOWrapper = function (raw, mode, lineBuffering, buffering, charset, options) {
+    return raw;
+}
+
+// text streams over the buffered Python streams in narwhal.py and
+// process.py
+
+var TextOutputStream = exports.TextOutputStream = function (raw) {
+    this.raw = raw;
+};
+
+TextOutputStream.prototype.write = function (object) {
+    if (object && object._bytes !== undefined) {
+        // hand binary data straight to Python, unencoded
+        this.raw.writeInto(object, 0, object.length);
+    } else {
+        this.raw.write(String(object));
+    }
+    return this;
+};
+
+TextOutputStream.prototype.writeLine = function (line) {
+    return this.write(line + "\n");
+};
+
+TextOutputStream.prototype.writeLines = function (lines) {
+    this.write(lines.join("\n") + "\n");
+    return this;
+};
+
+TextOutputStream.prototype.print = function () {
+    return this.write(Array.prototype.join.call(arguments, " ") + "\n");
+};
+
+TextOutputStream.prototype.flush = function () {
+    this.raw.flush();
+    return this;
+};
+
+TextOutputStream.prototype.setBuffering = function (buffering) {
+    this.raw.setBuffering(buffering);
+    return this;
+};
+
+TextOutputStream.prototype.isatty = function () {
+    return this.raw.isatty();
+};
+
+TextOutputStream.prototype.close = function () {
+    // only pipes can be closed; the standard streams are just flushed
+    if (typeof this.raw.close == "function")
+        this.raw.close();
+    else
+        this.raw.flush();
+    return this;
+};
+
+var TextInputStream = exports.TextInputStream = function (raw) {
+    this.raw = raw;
+};
+
+TextInputStream.prototype.read = function (length) {
+    return this.raw.read(length);
+};
+
+TextInputStream.prototype.readLine = function () {
+    return this.raw.readLine();
+};
+
+TextInputStream.prototype.readLines = function () {
+    var lines = [];
+    var line;
+    while ((line = this.raw.readLine()).length)
+        lines.push(line);
+    return lines;
+};
+
+TextInputStream.prototype.readInto = function (buffer, length, from) {
+    return this.raw.readInto(buffer, length, from);
+};
+
+TextInputStream.prototype.next = function () {
+    var line = this.raw.readLine();
+    if (!line.length)
+        throw StopIteration;
+    return line.replace(/\n$/, "");
+};
+
+TextInputStream.prototype.iterator = function () {
+    return this;
+};
+
+TextInputStream.prototype.forEach = function (block, context) {
+    var line;
+    while ((line = this.raw.readLine()).length)
+        block.call(context, line.replace(/\n$/, ""));
+};
+
+TextInputStream.prototype.isatty = function () {
+    return this.raw.isatty();
+};
+
+TextInputStream.prototype.copy = function (output) {
+    var chunk;
+    while ((chunk = this.raw.read(CHUNK_SIZE)).length)
+        output.write(chunk);
+    output.flush();
+    return this;
+};
+
+TextInputStream.prototype.close = function () {
+    if (typeof this.raw.close == "function")
+        this.raw.close();
+};
+
+// an in-memory text stream
+var StringIO = exports.StringIO = function (initial, delimiter) {
+    if (!(this instanceof StringIO))
+        return new StringIO(initial, delimiter);
+    this._buffer = initial ? String(initial) : "";
+    this._delimiter = delimiter || "\n";
+};
+
+StringIO.prototype = {
+    get length() {
+        return this._buffer.length;
+    }
+};
+
+StringIO.prototype.read = function (length) {
+    var result;
+    if (arguments.length == 0) {
+        result = this._buffer;
+        this._buffer = "";
+        return result;
+    }
+    if (!length || length < 1)
+        length = 1024;
+    result = this._buffer.substring(0, length);
+    this._buffer = this._buffer.substring(length);
+    return result;
+};
+
+StringIO.prototype.write = function (text) {
+    this._buffer += text;
+    return this;
+};
+
+StringIO.prototype.copy = function (output) {
+    output.write(this.read()).flush();
+    return this;
+};
+
+StringIO.prototype.readLine = function () {
+    var pos = this._buffer.indexOf(this._delimiter);
+    if (pos == -1)
+        return this.read();
+    return this.read(pos + this._delimiter.length);
+};
+
+StringIO.prototype.readLines = function () {
+    var lines = [];
+    var line;
+    while ((line = this.readLine()).length)
+        lines.push(line);
+    return lines;
+};
+
+StringIO.prototype.next = function () {
+    if (!this._buffer.length)
+        throw StopIteration;
+    var pos = this._buffer.indexOf(this._delimiter);
+    if (pos == -1)
+        pos = this._buffer.length;
+    var result = this._buffer.substring(0, pos);
+    this._buffer = this._buffer.substring(pos + this._delimiter.length);
+    return result;
+};
+
+StringIO.prototype.iterator = function () {
+    return this;
+};
+
+StringIO.prototype.forEach = function (block, context) {
+    while (this._buffer.length)
+        block.call(context, this.next());
+};
+
+StringIO.prototype.print = function (line) {
+    return this.write(line + this._delimiter).flush();
+};
+
+StringIO.prototype.flush = function () {
+    return this;
+};
+
+StringIO.prototype.close = function () {
+    return this;
+};
+
+StringIO.prototype.toString = function () {
+    return this._buffer;
+};
+
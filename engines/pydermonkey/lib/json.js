@@ -0,0 +1,141 @@
+// JSON: pydermonkey
+//
+// The runtime's own JSON object is used, and left as the global JSON,
+// since going through Python only adds work to it (see the json_*
+// benchmarks in benchmark.py).
+//
+// With NARWHAL_PYDER_JSON=python, text is instead parsed by Python's
+// json module and serialized by the runtime's native JSON object, with
+// Python doing any indenting and key selection (see jsoncodec.py), so
+// values cross between Python and JS as a single string. Reviver and
+// replacer functions are applied in JS, just as by the default engine.
+
+var JSON = exports;
+
+var native = pyder.nativeJson();
+
+// calls the reviver on every member of holder[key], innermost first
+function walk(holder, key, reviver) {
+    var k, v, value = holder[key];
+    if (value && typeof value === 'object') {
+        for (k in value) {
+            if (Object.hasOwnProperty.call(value, k)) {
+                v = walk(value, k, reviver);
+                if (v !== undefined) {
+                    value[k] = v;
+                } else {
+                    delete value[k];
+                }
+            }
+        }
+    }
+    return reviver.call(holder, key, value);
+}
+
+// returns a plain copy of holder[key], after calling toJSON() methods
+// and the replacer, if there is one, leaving out functions and
+// undefined members
+function prepare(holder, key, replacer) {
+    var i, k, v, length, copy, value = holder[key];
+
+    if (value && typeof value === 'object' &&
+            typeof value.toJSON === 'function') {
+        value = value.toJSON(key);
+    }
+    if (replacer) {
+        value = replacer.call(holder, key, value);
+    }
+
+    if (typeof value === 'function') {
+        return undefined;
+    }
+    if (typeof value === 'number' && !isFinite(value)) {
+        return null;
+    }
+    if (!value || typeof value !== 'object') {
+        return value;
+    }
+    if (Object.prototype.toString.apply(value) === '[object Array]') {
+        copy = [];
+        length = value.length;
+        for (i = 0; i < length; i += 1) {
+            v = prepare(value, i, replacer);
+            copy[i] = v === undefined ? null : v;
+        }
+        return copy;
+    }
+    copy = {};
+    for (k in value) {
+        if (Object.hasOwnProperty.call(value, k)) {
+            v = prepare(value, k, replacer);
+            if (v !== undefined) {
+                copy[k] = v;
+            }
+        }
+    }
+    return copy;
+}
+
+var parse = function (text, reviver) {
+    var value;
+    try {
+        value = pyder.parseJson(String(text));
+    } catch (exception) {
+        throw new SyntaxError(String(exception));
+    }
+    return typeof reviver === 'function' ?
+        walk({'': value}, '', reviver) : value;
+};
+
+var stringify = function (value, replacer, space) {
+    var keys = null;
+    if (typeof replacer === 'function') {
+        value = prepare({'': value}, '', replacer);
+    } else if (replacer) {
+        if (typeof replacer !== 'object' ||
+                typeof replacer.length !== 'number') {
+            throw new Error('JSON.stringify');
+        }
+        keys = Array.prototype.filter.call(replacer, function (key) {
+            return typeof key === 'string';
+        });
+    }
+
+    var text = pyder.stringifyJson(value, keys, space);
+    if (text === null) {
+        // it isn't plain data
+        value = prepare({'': value}, '', null);
+        if (value === undefined) {
+            return undefined;
+        }
+        text = pyder.stringifyJson(value, keys, space);
+    }
+    return text;
+};
+
+if (native) {
+    exports.parse = function (text, reviver) {
+        return native.parse(text, reviver);
+    };
+    exports.stringify = function (value, replacer, space) {
+        return native.stringify(value, replacer, space);
+    };
+    // narwhal code also uses the global JSON's encode and decode
+    native.encode = native.stringify;
+    native.decode = native.parse;
+} else {
+    this.JSON = exports;
+    exports.parse = parse;
+    exports.stringify = stringify;
+}
+
+/**
+ * Serialize an object to a JSON string.
+ */
+JSON.encode = JSON.stringify;
+
+/**
+ * Deserialize an object from a JSON string.
+ */
+JSON.decode = JSON.parse;
+
@@ -1,3 +1,104 @@
+var io = require("io-engine");
+
 exports.exit = function(status) {
   pyder.exit(status);
 };
+
+// child processes are run by process.py; their output is read in
+// chunks, either from their streams or by communicate(), which passes
+// it on to the given streams as it arrives instead of collecting it
+
+var Process = function (raw) {
+    this._raw = raw;
+    this.pid = raw.pid;
+    this.stdin = new io.TextOutputStream(raw.stdin);
+    this.stdout = new io.TextInputStream(raw.stdout);
+    this.stderr = new io.TextInputStream(raw.stderr);
+};
+
+Process.prototype.wait = function () {
+    return this._raw.wait();
+};
+
+Process.prototype.poll = function () {
+    return this._raw.poll();
+};
+
+Process.prototype.kill = function (signal) {
+    this._raw.kill(signal);
+    return this;
+};
+
+Process.prototype.communicate = function (input, output, errput) {
+    return exports.communicateAll([{
+        process: this,
+        input: input,
+        output: output,
+        errput: errput
+    }])[0];
+};
+
+exports.popen = function (command, options) {
+    // options: {cwd, env, charset}
+    if (typeof command == "string")
+        command = ["sh", "-c", command];
+    return new Process(pyder.popen(command.map(String), options || {}));
+};
+
+// the child shares this process' standard streams, rather than having
+// its output pumped through JS
+exports.system = function (command, options) {
+    // options: {cwd, env}
+    if (typeof command == "string")
+        command = ["sh", "-c", command];
+    return pyder.system(command.map(String), options || {});
+};
+
+// runs several processes at once, each given either as a process or
+// as {process, input, output, errput}, and returns the result of
+// communicate() for each once all of them have finished.  a process
+// given no input has its stdin closed straight away
+exports.communicateAll = function (jobs) {
+    jobs = jobs.map(function (job) {
+        if (job instanceof Process)
+            job = {process: job};
+        var input = job.input, output = job.output, errput = job.errput;
+        if (typeof input == "string")
+            input = new io.StringIO(input);
+        if (!output)
+            output = new io.StringIO();
+        if (!errput)
+            errput = new io.StringIO();
+        return {
+            process: job.process,
+            input: input,
+            output: output,
+            errput: errput
+        };
+    });
+    var statuses = pyder.communicate(jobs.map(function (job) {
+        return [
+            job.process._raw,
+            job.input ? function (length) {
+                return job.input.read(length);
+            } : null,
+            function (text) {
+                job.output.write(text);
+            },
+            function (text) {
+                job.errput.write(text);
+            }
+        ];
+    }));
+    return jobs.map(function (job, i) {
+        job.output.flush();
+        job.errput.flush();
+        return {
+            status: statuses[i],
+            stdin: job.input || new io.StringIO(),
+            stdout: job.output,
+            stderr: job.errput
+        };
+    });
+};
+
@@ -0,0 +1,6 @@
+// tasks run on the engine's event loop (see reactor.py), which runs
+// once the main module has finished
+
+exports.enqueue = function (task) {
+    pyder.reactor.enqueue(task);
+};
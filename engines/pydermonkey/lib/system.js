@@ -1,26 +1,23 @@
 exports.args = pyder.info.argv;
 exports.env = {};
 
-exports.stdout = (function() {
-    var buffer = [];
-    return {
-        write: function(text) {
-            buffer.push(text.toString());
-            return this;
-        },
-        flush: function() {
-            pyder.printString(buffer.join(""));
-            buffer = [];
-        }
-    };
-})();
-
-exports.stderr = exports.stdout;
+// The standard streams are buffered on the Python side (see
+// OutputStream and InputStream in narwhal.py), so writes don't each
+// cost a system call.
+var io = require("io-engine");
+
+exports.stdin = new io.TextInputStream(pyder.stdin);
+exports.stdout = new io.TextOutputStream(pyder.stdout);
+exports.stderr = new io.TextOutputStream(pyder.stderr);
+
+exports.print = function () {
+    exports.stdout.print.apply(exports.stdout, arguments);
+};
 
 var Logger = require("./logger").Logger;
 exports.log = new Logger(
   {write: function(message) {
-     pyder.printString(message + '\n');
+     exports.stderr.write(message + '\n');
    }
   });
 
@@ -36,6 +33,12 @@ exports.log = new Logger(
 
 exports.fs = require('./file');
 
+// timers, run once the main module has finished
+var timer = require("./timer");
+["setTimeout", "setInterval", "clearTimeout", "clearInterval"].forEach(function (name) {
+    global[name] = timer[name];
+});
+
 exports.env = {
   get PWD() {
     return pyder.cwd();
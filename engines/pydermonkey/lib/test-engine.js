@@ -0,0 +1,16 @@
+// runs the modules of a test suite in parallel worker processes, each
+// with its own sandbox, handing out the slowest first and stopping
+// any test that runs for longer than options.timeout (see
+// testrunner.py)
+
+exports.runParallel = function (id, modules, options) {
+    var totals = pyder.runTests(id, modules, {
+        jobs: options.jobs,
+        timeout: options.timeout,
+        timings: options.timings || null,
+        color: options.color !== false,
+        showStacktraces: !!options.showStacktraces
+    });
+    print("Passed "+totals.passed+"; Failed "+totals.failed+"; Error "+totals.error+";");
+    return totals.failed + totals.error;
+};
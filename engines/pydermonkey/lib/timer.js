@@ -0,0 +1,27 @@
+// timers run on the engine's event loop (see reactor.py)
+
+var reactor = pyder.reactor;
+
+var schedule = function (callback, delay, args, repeat) {
+    if (typeof callback != "function")
+        throw new Error("timer callback must be a function");
+    return reactor.setTimer(function () {
+        callback.apply(global, args);
+    }, Number(delay) || 0, repeat);
+};
+
+exports.setTimeout = function (callback, delay) {
+    var args = Array.prototype.slice.call(arguments, 2);
+    return schedule(callback, delay, args, false);
+};
+
+exports.setInterval = function (callback, delay) {
+    var args = Array.prototype.slice.call(arguments, 2);
+    return schedule(callback, delay, args, true);
+};
+
+exports.clearTimeout = function (id) {
+    reactor.clearTimer(id);
+};
+
+exports.clearInterval = exports.clearTimeout;
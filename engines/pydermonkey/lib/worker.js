@@ -0,0 +1,91 @@
+// Worker: pydermonkey
+// each worker runs in a separate process with its own sandbox, and
+// messages are passed as strings over a pipe
+
+var queue = require("event-queue");
+
+var workers = {};
+
+var Worker = exports.Worker = function (scriptName) {
+    if (!(this instanceof Worker))
+        return new Worker(scriptName);
+    this.onmessage = true; // give it something to feature detect off of
+    this._id = pyder.spawnWorker(String(scriptName));
+    workers[this._id] = this;
+};
+
+Worker.prototype.postMessage = function (message) {
+    pyder.postToWorker(this._id, String(message));
+};
+
+Worker.prototype.terminate = function () {
+    pyder.terminateWorker(this._id);
+    delete workers[this._id];
+};
+
+exports.SharedWorker = function (scriptName, workerName) {
+    throw new Error("SharedWorker is not supported on pydermonkey.");
+};
+
+queue.dispatchExternal = function (event) {
+    var source = event[0],
+        type = event[1],
+        data = event[2];
+
+    // a message from the parent, if we're a worker
+    if (source === null) {
+        queue.enqueue(function () {
+            if (typeof global.onmessage === "function")
+                global.onmessage({data: data});
+        });
+        return;
+    }
+
+    var worker = workers[source];
+    if (!worker)
+        return;
+    if (type === "close") {
+        delete workers[source];
+    } else if (type === "message") {
+        queue.enqueue(function () {
+            if (typeof worker.onmessage === "function")
+                worker.onmessage({target: worker, ports: [worker], data: data});
+        });
+    } else if (type === "error") {
+        queue.enqueue(function () {
+            if (typeof worker.onerror === "function")
+                worker.onerror({target: worker, message: data, data: data});
+            else
+                print("Worker error: " + data);
+        });
+    }
+};
+
+// runs a worker script in this process on behalf of the parent
+// process; called by the engine, and only returns once the worker
+// is terminated.
+exports.runWorker = function (scriptName) {
+    global.postMessage = function (message) {
+        pyder.postToParent("message", String(message));
+    };
+    global.close = function () {
+        pyder.closeWorker();
+    };
+    require(scriptName);
+    // enter the event loop
+    while (true) {
+        try {
+            queue.nextEvent()();
+        } catch (e) {
+            if (typeof global.onerror === "function") {
+                try {
+                    global.onerror(e);
+                    continue;
+                } catch (e) {
+                    // don't let an error here go into an infinite loop
+                }
+            }
+            pyder.postToParent("error", String(e));
+        }
+    }
+};
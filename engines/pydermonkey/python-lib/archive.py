@@ -0,0 +1,172 @@
+import os
+import re
+import stat
+import mmap
+import zlib
+import struct
+import zipfile
+
+# Matches a module archive's path, or a path inside one such as
+# /packages/foo.zip/lib/foo.js, giving the archive's path and the
+# member's name within it.
+ARCHIVE_PATH = re.compile(r'^(.+?\.(?:zip|jar))(?:/(.*))?$')
+
+# Size and format of the fixed part of a zip local file header, which
+# is followed by the member's name and extra field, then its data.
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_LENGTHS = struct.Struct('<HH')
+LOCAL_HEADER_LENGTHS_OFFSET = 26
+
+class ModuleArchive(object):
+    """
+    A zip archive of modules, whose central directory is read once
+    and kept in memory, and whose members are read straight out of a
+    memory map of the file: stored members are sliced out of it and
+    deflated ones inflated from it, without seeking or reading the
+    file.
+
+    Every member has the archive's mtime, so that replacing the
+    archive makes the loader fetch its modules again.
+    """
+
+    def __init__(self, path, info=None):
+        if info is None:
+            info = os.stat(path)
+        self.path = path
+        self.mtime = info.st_mtime
+        self.size = info.st_size
+        # Maps the name of every file in the archive to its ZipInfo,
+        # and the name of every directory, without its trailing
+        # slash, to the set of names of its children.
+        self._files = {}
+        self._directories = {'': set()}
+        self._map = None
+
+        stream = open(path, 'rb')
+        try:
+            index = zipfile.ZipFile(stream)
+            try:
+                for member in index.infolist():
+                    self._add(member)
+            finally:
+                index.close()
+            self._map = mmap.mmap(stream.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        finally:
+            stream.close()
+
+    def _add(self, member):
+        name = member.filename.strip('/')
+        if not name:
+            return
+        if not member.filename.endswith('/'):
+            self._files[name] = member
+        while name:
+            parent, _, child = name.rpartition('/')
+            children = self._directories.setdefault(parent, set())
+            if child in children:
+                break
+            children.add(child)
+            name = parent
+
+    def changed(self, info):
+        """
+        Returns whether the given os.stat() result for the archive's
+        path shows that it has been replaced since it was read.
+        """
+
+        return info.st_mtime != self.mtime or info.st_size != self.size
+
+    def is_file(self, name):
+        return name in self._files
+
+    def is_directory(self, name):
+        return name.rstrip('/') in self._directories
+
+    def list_directory(self, name):
+        return sorted(self._directories.get(name.rstrip('/'), ()))
+
+    def walk(self, name):
+        """
+        Returns the names of all the files under the given directory,
+        relative to it.
+        """
+
+        prefix = name.strip('/')
+        if prefix:
+            prefix += '/'
+        return [path[len(prefix):] for path in self._files
+                if path.startswith(prefix)]
+
+    def file_size(self, name):
+        return self._files[name].file_size
+
+    def read(self, name):
+        """
+        Returns the contents of the given member as a byte string.
+        Raises a KeyError if there's no such member.
+        """
+
+        member = self._files[name]
+        if member.flag_bits & 0x1:
+            raise IOError("%s is encrypted in %s" % (name, self.path))
+        offset = member.header_offset + LOCAL_HEADER_SIZE
+        name_length, extra_length = LOCAL_HEADER_LENGTHS.unpack(
+            self._map[member.header_offset + LOCAL_HEADER_LENGTHS_OFFSET:
+                      offset]
+            )
+        start = offset + name_length + extra_length
+        data = self._map[start:start + member.compress_size]
+        if member.compress_type == zipfile.ZIP_STORED:
+            return data
+        if member.compress_type == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+        raise IOError("%s is compressed with an unsupported method in %s" %
+                      (name, self.path))
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+class ArchiveSet(object):
+    """
+    The module archives that paths have been looked up in, which are
+    each opened once and kept open until they change.
+    """
+
+    def __init__(self):
+        self._archives = {}
+
+    def lookup(self, path, stat_path):
+        """
+        Returns an (archive, name) pair for the given real path if it's
+        a module archive or inside one, using 'stat_path' to check that
+        the archive exists and hasn't changed, or None otherwise. The
+        name of the archive's root directory is ''.
+        """
+
+        match = ARCHIVE_PATH.match(path)
+        if match is None:
+            return None
+        archive_path, name = match.groups()
+        name = name or ''
+        info = stat_path(archive_path)
+        if info is None or not stat.S_ISREG(info.st_mode):
+            return None
+        archive = self._archives.get(archive_path)
+        if archive is None or archive.changed(info):
+            if archive is not None:
+                archive.close()
+                del self._archives[archive_path]
+            try:
+                archive = ModuleArchive(archive_path, info)
+            except (EnvironmentError, zipfile.BadZipfile):
+                return None
+            self._archives[archive_path] = archive
+        return archive, name
+
+    def close(self):
+        for archive in self._archives.itervalues():
+            archive.close()
+        self._archives.clear()
@@ -0,0 +1,634 @@
+import os
+import sys
+import gc
+import math
+import time
+import shutil
+import tempfile
+import subprocess
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import pydermonkey
+from pydershell import JsSandbox, ScriptCache, jsexposed, memory_usage
+from narwhal import NarwhalRunner
+
+# Version of the JSON results format.
+RESULTS_VERSION = 1
+
+# Welch's t statistic above which a difference from the baseline is
+# considered significant; roughly a 95% confidence level.
+T_CRITICAL = 2.0
+
+# Default minimum relative change in the median, as a fraction, for a
+# significant difference to be reported.
+DEFAULT_THRESHOLD = 0.1
+
+# The main module run by the startup benchmarks; it prints a line as
+# soon as it starts.
+STARTUP_CODE = "print('ready')"
+
+# Makes the functions timed by the binary benchmarks, given the
+# ByteArray constructor and the number of bytes to work on.
+BINARY_FUNCTIONS_JS = """
+(function (ByteArray, n) {
+  var array = [];
+  for (var i = 0; i < n; i++)
+    array.push(i & 0xFF);
+  var bytes = new ByteArray(array);
+  return {
+    get: function () {
+      var sum = 0;
+      for (var i = 0; i < n; i++)
+        sum += bytes.get(i);
+      return sum;
+    },
+    getArray: function () {
+      var sum = 0;
+      for (var i = 0; i < n; i++)
+        sum += array[i];
+      return sum;
+    },
+    toArray: function () {
+      return bytes.toArray().length;
+    },
+    fromArray: function () {
+      return new ByteArray(array).length;
+    },
+    forEach: function () {
+      var sum = 0;
+      bytes.forEach(function (b) { sum += b; });
+      return sum;
+    }
+  };
+})
+"""
+
+_benchmarks = []
+
+class BenchmarkSkipped(Exception):
+    """
+    Raised by a benchmark that can't run in this build; the message
+    says why.
+    """
+
+    pass
+
+def benchmark(name, unit='s'):
+    """
+    Decorator that registers a method of BenchmarkRunner as a
+    benchmark. The method is called once per sample and returns the
+    sample's value in the given unit; lower values are better.
+    """
+
+    def register(func):
+        _benchmarks.append((name, unit, func))
+        return func
+    return register
+
+def benchmark_names():
+    return [name for name, unit, func in _benchmarks]
+
+@jsexposed
+def _identity(value):
+    return value
+
+def summarize(samples):
+    """
+    Returns a dictionary of summary statistics of the given samples.
+    """
+
+    n = len(samples)
+    ordered = sorted(samples)
+    mean = sum(samples) / n
+    if n % 2:
+        median = ordered[n // 2]
+    else:
+        median = (ordered[n // 2 - 1] + ordered[n // 2]) / 2.0
+    if n > 1:
+        variance = sum([(x - mean) ** 2 for x in samples]) / (n - 1)
+    else:
+        variance = 0.0
+    return dict(samples = samples,
+                n = n,
+                mean = mean,
+                median = median,
+                stdev = math.sqrt(variance),
+                min = ordered[0],
+                max = ordered[-1])
+
+class BenchmarkRunner(object):
+    """
+    Runs the registered benchmarks against the pydermonkey engine in
+    'engine_home_dir', taking 'repeat' samples of each after a single
+    untimed warm-up run.
+    """
+
+    # Number of calls timed per sample by the call benchmarks.
+    CALLS = 10000
+
+    # Number of reads timed per sample by the read benchmarks.
+    READS = 100
+
+    # Number of sandboxes created per sample by the sandbox benchmarks.
+    SANDBOXES = 20
+
+    # Number of packages in the catalog used by the JSON benchmarks.
+    CATALOG_PACKAGES = 2000
+
+    # Number of bytes in the ByteArray used by the binary benchmarks.
+    BINARY_BYTES = 4096
+
+    # Number of seconds to wait for the fork server to start listening.
+    FORK_SERVER_TIMEOUT = 60
+
+    def __init__(self, home_dir, engine_home_dir, repeat=10):
+        self.home_dir = home_dir
+        self.engine_home_dir = engine_home_dir
+        self.repeat = repeat
+        self.runtime = pydermonkey.Runtime()
+        self._temp_dirs = []
+        self._state = {}
+
+    def _temp_dir(self):
+        path = tempfile.mkdtemp(prefix='narwhal-bench-')
+        self._temp_dirs.append(path)
+        return path
+
+    def close(self):
+        for value in self._state.values():
+            if isinstance(value, subprocess.Popen):
+                if value.poll() is None:
+                    value.terminate()
+                value.wait()
+            elif isinstance(value, NarwhalRunner):
+                value.sandbox.finish()
+            elif isinstance(value, JsSandbox):
+                value.finish()
+        self._state.clear()
+        for path in self._temp_dirs:
+            shutil.rmtree(path, True)
+        self._temp_dirs = []
+
+    def _narwhal_env(self, cache_dir):
+        env = dict(os.environ)
+        for name in ('NARWHAL_PYDER_SOCKET', 'NARWHAL_PYDER_STATS',
+                     'NARWHAL_PYDER_PROFILE', 'NARWHAL_PYDER_PROFILE_RATE',
+                     'NARWHAL_PYDER_MEMORY_LIMIT'):
+            env.pop(name, None)
+        env['NARWHAL_HOME'] = self.home_dir
+        env['NARWHAL_ENGINE_HOME'] = self.engine_home_dir
+        env['NARWHAL_ENGINE'] = 'pydermonkey'
+        env['NARWHAL_PYDER_CACHE_DIR'] = cache_dir
+        return env
+
+    def _time_startup(self, cache_dir, socket_path=None):
+        """
+        Starts narwhal in a new process, through the fork server
+        listening on 'socket_path' if it's given, and returns the
+        number of seconds until its main module prints its first line.
+        """
+
+        script = os.path.join(self.engine_home_dir, 'bin',
+                              'narwhal-pydermonkey')
+        env = self._narwhal_env(cache_dir)
+        if socket_path is not None:
+            env['NARWHAL_PYDER_SOCKET'] = socket_path
+        start = time.time()
+        process = subprocess.Popen([sys.executable, script,
+                                    '-e', STARTUP_CODE],
+                                   stdout = subprocess.PIPE,
+                                   env = env)
+        line = process.stdout.readline()
+        elapsed = time.time() - start
+        process.stdout.read()
+        if process.wait() != 0 or not line:
+            raise RuntimeError('narwhal exited with status %d' %
+                               process.returncode)
+        return elapsed
+
+    @benchmark('startup_cold')
+    def startup_cold(self):
+        # Every sample gets an empty script cache.
+        return self._time_startup(self._temp_dir())
+
+    @benchmark('startup_cached')
+    def startup_cached(self):
+        # The script cache only persists on disk if scripts can be
+        # serialized; otherwise this would just repeat startup_cold.
+        if not ScriptCache.can_serialize(self.runtime.new_context()):
+            raise BenchmarkSkipped("this pydermonkey can't serialize "
+                                   "scripts")
+        if 'cached_dir' not in self._state:
+            self._state['cached_dir'] = self._temp_dir()
+            self._time_startup(self._state['cached_dir'])
+        return self._time_startup(self._state['cached_dir'])
+
+    def _fork_server(self):
+        """
+        Starts a fork server, if one isn't running yet, and returns
+        the path of its socket once it's listening.
+        """
+
+        if 'fork_server' not in self._state:
+            socket_path = os.path.join(self._temp_dir(), 'socket')
+            script = os.path.join(self.engine_home_dir, 'bin',
+                                  'narwhal-pydermonkey-daemon')
+            self._state['fork_server_socket'] = socket_path
+            self._state['fork_server'] = subprocess.Popen(
+                [sys.executable, script, '--socket', socket_path],
+                env = self._narwhal_env(self._temp_dir())
+                )
+        socket_path = self._state['fork_server_socket']
+        deadline = time.time() + self.FORK_SERVER_TIMEOUT
+        while not os.path.exists(socket_path):
+            if self._state['fork_server'].poll() is not None:
+                raise RuntimeError('the fork server exited with status %d'
+                                   % self._state['fork_server'].returncode)
+            if time.time() > deadline:
+                raise RuntimeError('the fork server never started')
+            time.sleep(0.05)
+        return socket_path
+
+    @benchmark('startup_warm')
+    def startup_warm(self):
+        # Served by a process forked from an already bootstrapped one.
+        return self._time_startup(self._temp_dir(), self._fork_server())
+
+    def _lib_module_ids(self):
+        lib_dir = os.path.join(self.home_dir, 'lib')
+        ids = []
+        for dirpath, dirnames, filenames in os.walk(lib_dir):
+            for filename in filenames:
+                if filename.endswith('.js'):
+                    path = os.path.join(dirpath, filename)
+                    ids.append(path[len(lib_dir) + 1:-len('.js')])
+        ids.sort()
+        return ids
+
+    @benchmark('require_lib')
+    def require_lib(self):
+        # Modules are compiled once, as they would be by a warm fork
+        # server, but every sample loads them into a new sandbox.
+        script_cache = self._state.setdefault('require_cache', ScriptCache())
+        runner = NarwhalRunner(argv = ['narwhal', '-e', ''],
+                               home_dir = self.home_dir,
+                               engine_home_dir = self.engine_home_dir,
+                               runtime = self.runtime,
+                               script_cache = script_cache)
+        try:
+            if runner.run() != 0:
+                raise RuntimeError('narwhal failed to bootstrap')
+            require = runner.sandbox.root.require
+            failures = []
+            start = time.time()
+            for id in self._lib_module_ids():
+                try:
+                    require(id)
+                except pydermonkey.error:
+                    failures.append(id)
+            elapsed = time.time() - start
+        finally:
+            runner.close()
+            runner.sandbox.finish()
+        self._state['require_failures'] = failures
+        return elapsed
+
+    def _call_sandbox(self):
+        if 'call_sandbox' not in self._state:
+            sandbox = JsSandbox(runtime=self.runtime)
+            self._state['call_sandbox'] = sandbox
+            self._state['js_identity'] = sandbox.evaluate(
+                "(function (value) { return value; })"
+                )
+            self._state['js_loop'] = sandbox.evaluate(
+                "(function (f, n) { for (var i = 0; i < n; i++) f(i); })"
+                )
+        return self._state['call_sandbox']
+
+    @benchmark('call_py_to_js')
+    def call_py_to_js(self):
+        self._call_sandbox()
+        identity = self._state['js_identity']
+        calls = self.CALLS
+        start = time.time()
+        for i in xrange(calls):
+            identity(i)
+        return (time.time() - start) / calls
+
+    @benchmark('call_js_to_py')
+    def call_js_to_py(self):
+        self._call_sandbox()
+        loop = self._state['js_loop']
+        calls = self.CALLS
+        start = time.time()
+        loop(_identity, calls)
+        return (time.time() - start) / calls
+
+    def _time_reads(self, size):
+        if 'read_runner' not in self._state:
+            root_dir = self._temp_dir()
+            runner = NarwhalRunner(argv = [],
+                                   home_dir = root_dir,
+                                   engine_home_dir = self.engine_home_dir,
+                                   runtime = self.runtime)
+            self._state['read_runner'] = runner
+            self._state['read_loop'] = runner.sandbox.evaluate(
+                "(function (name, n) {"
+                "  for (var i = 0; i < n; i++) pyder.read(name);"
+                "})"
+                )
+        runner = self._state['read_runner']
+        name = '/read-%d' % size
+        path = runner.home_dir + name
+        if not os.path.exists(path):
+            line = 'x' * 63 + '\n'
+            stream = open(path, 'w')
+            try:
+                stream.write(line * (size // len(line)))
+                stream.write('x' * (size % len(line)))
+            finally:
+                stream.close()
+        reads = self.READS
+        start = time.time()
+        self._state['read_loop'](name, reads)
+        return (time.time() - start) / reads
+
+    @benchmark('read_1k')
+    def read_1k(self):
+        return self._time_reads(1024)
+
+    @benchmark('read_64k')
+    def read_64k(self):
+        return self._time_reads(64 * 1024)
+
+    @benchmark('read_1m')
+    def read_1m(self):
+        return self._time_reads(1024 * 1024)
+
+    def _load_json_module(self, sandbox, filename, pyder='pyder'):
+        # Loaded into an object of its own, so that it doesn't replace
+        # the global JSON object, with 'pyder' in place of the engine's.
+        code = open(filename).read()
+        return sandbox.evaluate(
+            "(function (pyder) { var exports = {};"
+            "(function (exports, pyder) {" + code + "\n})"
+            ".call({}, exports, pyder);"
+            "return exports; })(" + pyder + ")"
+            )
+
+    def _json_runner(self):
+        """
+        Returns a bootstrapped runner, along with the runtime's own
+        JSON object, this engine's JSON module forced to go through
+        Python, and the default engine's pure-JS one.
+        """
+
+        if 'json_runner' not in self._state:
+            runner = NarwhalRunner(argv = ['narwhal', '-e', ''],
+                                   home_dir = self.home_dir,
+                                   engine_home_dir = self.engine_home_dir,
+                                   runtime = self.runtime)
+            self._state['json_runner'] = runner
+            if runner.run() != 0:
+                raise RuntimeError('narwhal failed to bootstrap')
+            sandbox = runner.sandbox
+            self._state['json_modules'] = dict(
+                builtin = sandbox.native_json,
+                python = self._load_json_module(
+                    sandbox,
+                    os.path.join(self.engine_home_dir, 'lib', 'json.js'),
+                    "{nativeJson: function () { return null; },"
+                    " parseJson: function (text) {"
+                    "   return pyder.parseJson(text); },"
+                    " stringifyJson: function (value, keys, space) {"
+                    "   return pyder.stringifyJson(value, keys, space); }}"
+                    ),
+                js = self._load_json_module(
+                    sandbox,
+                    os.path.join(self.home_dir, 'engines', 'default',
+                                 'lib', 'json.js')
+                    ),
+                )
+            self._state['json_text'] = json.dumps(self._catalog())
+            self._state['json_value'] = self._state['json_modules'][
+                'builtin'].parse(self._state['json_text'])
+        return self._state['json_runner']
+
+    def _catalog(self):
+        # Shaped like the package catalogs that tusk reads.
+        packages = {}
+        for i in xrange(self.CATALOG_PACKAGES):
+            name = 'package-%d' % i
+            packages[name] = dict(
+                name = name,
+                version = [0, i % 10, i % 7],
+                description = 'Package number %d of the catalog.' % i,
+                keywords = ['test', 'catalog', name],
+                author = dict(name = 'Author %d' % i,
+                              email = 'author%d@example.com' % i),
+                dependencies = ['package-%d' % j
+                                for j in range(max(0, i - 3), i)],
+                stable = i % 2 == 0,
+                )
+        return dict(version = 1, packages = packages)
+
+    def _time_json(self, module, name):
+        self._json_runner()
+        if name == 'parse':
+            value = self._state['json_text']
+        else:
+            value = self._state['json_value']
+        function = self._state['json_modules'][module][name]
+        start = time.time()
+        function(value)
+        return time.time() - start
+
+    @benchmark('json_parse_builtin')
+    def json_parse_builtin(self):
+        return self._time_json('builtin', 'parse')
+
+    @benchmark('json_parse_python')
+    def json_parse_python(self):
+        return self._time_json('python', 'parse')
+
+    @benchmark('json_parse_js')
+    def json_parse_js(self):
+        return self._time_json('js', 'parse')
+
+    @benchmark('json_stringify_builtin')
+    def json_stringify_builtin(self):
+        return self._time_json('builtin', 'stringify')
+
+    @benchmark('json_stringify_python')
+    def json_stringify_python(self):
+        return self._time_json('python', 'stringify')
+
+    @benchmark('json_stringify_js')
+    def json_stringify_js(self):
+        return self._time_json('js', 'stringify')
+
+    def _time_binary(self, name):
+        """
+        Returns the seconds per byte taken by the named function of
+        BINARY_FUNCTIONS_JS, on a ByteArray of BINARY_BYTES bytes.
+        """
+
+        if 'binary_runner' not in self._state:
+            runner = NarwhalRunner(argv = ['narwhal', '-e', ''],
+                                   home_dir = self.home_dir,
+                                   engine_home_dir = self.engine_home_dir,
+                                   runtime = self.runtime)
+            self._state['binary_runner'] = runner
+            if runner.run() != 0:
+                raise RuntimeError('narwhal failed to bootstrap')
+            make_functions = runner.sandbox.evaluate(BINARY_FUNCTIONS_JS)
+            self._state['binary_functions'] = make_functions(
+                runner.sandbox.root.require('binary').ByteArray,
+                self.BINARY_BYTES
+                )
+        function = self._state['binary_functions'][name]
+        start = time.time()
+        function()
+        return (time.time() - start) / self.BINARY_BYTES
+
+    @benchmark('binary_get')
+    def binary_get(self):
+        return self._time_binary('get')
+
+    @benchmark('binary_get_js_array')
+    def binary_get_js_array(self):
+        # The baseline of reading each byte out of a plain JS array.
+        return self._time_binary('getArray')
+
+    @benchmark('binary_to_array')
+    def binary_to_array(self):
+        return self._time_binary('toArray')
+
+    @benchmark('binary_from_array')
+    def binary_from_array(self):
+        return self._time_binary('fromArray')
+
+    @benchmark('binary_for_each')
+    def binary_for_each(self):
+        return self._time_binary('forEach')
+
+    @benchmark('sandbox_lifecycle')
+    def sandbox_lifecycle(self):
+        count = self.SANDBOXES
+        start = time.time()
+        for i in xrange(count):
+            JsSandbox(runtime=self.runtime).finish()
+        return (time.time() - start) / count
+
+    @benchmark('sandbox_memory', unit='KB')
+    def sandbox_memory(self):
+        # Memory retained per sandbox once it's finished; anything but
+        # noise around zero is a leak.
+        count = self.SANDBOXES * 5
+        gc.collect()
+        before = memory_usage()
+        for i in xrange(count):
+            sandbox = JsSandbox(runtime=self.runtime)
+            sandbox.evaluate("var x = []; for (var i = 0; i < 1000; i++) "
+                             "x.push({i: i});")
+            sandbox.finish()
+            del sandbox
+        gc.collect()
+        return float(memory_usage() - before) / 1024 / count
+
+    def run(self, names=None):
+        """
+        Runs the named benchmarks, or all of them, and returns the
+        results as a JSON-serializable dictionary.
+        """
+
+        results = {}
+        skipped = {}
+        for name, unit, func in _benchmarks:
+            if names and name not in names:
+                continue
+            try:
+                func(self)
+            except BenchmarkSkipped, e:
+                skipped[name] = str(e)
+                continue
+            samples = [func(self) for i in range(self.repeat)]
+            results[name] = summarize(samples)
+            results[name]['unit'] = unit
+        if 'require_failures' in self._state:
+            results['require_lib']['failures'] = \
+                self._state['require_failures']
+        return dict(version = RESULTS_VERSION,
+                    python = sys.version.split()[0],
+                    platform = sys.platform,
+                    time = time.time(),
+                    benchmarks = results,
+                    skipped = skipped)
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares the given results to baseline results, returning a list
+    of dictionaries describing each benchmark, whose 'status' is one
+    of 'regression', 'improvement', 'unchanged', 'new', 'missing', or
+    'skipped'.
+
+    A difference is only reported if Welch's t-test finds it
+    significant and the median changed by more than 'threshold'.
+    """
+
+    current = results['benchmarks']
+    previous = baseline['benchmarks']
+    comparisons = []
+    for name in sorted(set(current) | set(previous)):
+        if name not in previous:
+            comparisons.append(dict(name = name, status = 'new'))
+            continue
+        if name not in current:
+            if name in results.get('skipped', {}):
+                status = 'skipped'
+            else:
+                status = 'missing'
+            comparisons.append(dict(name = name, status = status))
+            continue
+        new = current[name]
+        old = previous[name]
+        diff = new['mean'] - old['mean']
+        error = math.sqrt(new['stdev'] ** 2 / new['n'] +
+                          old['stdev'] ** 2 / old['n'])
+        if error:
+            t = diff / error
+        elif diff:
+            t = math.copysign(float('inf'), diff)
+        else:
+            t = 0.0
+        if old['median']:
+            change = (new['median'] - old['median']) / old['median']
+        else:
+            change = 0.0
+        status = 'unchanged'
+        if t > T_CRITICAL and change > threshold:
+            status = 'regression'
+        elif t < -T_CRITICAL and change < -threshold:
+            status = 'improvement'
+        comparisons.append(dict(name = name,
+                                status = status,
+                                unit = new['unit'],
+                                baseline = old['median'],
+                                median = new['median'],
+                                change = change,
+                                t = t))
+    return comparisons
+
+def write_comparison(comparisons, stream):
+    for info in comparisons:
+        if info['status'] in ('new', 'missing', 'skipped'):
+            stream.write('%-20s %s\n' % (info['name'], info['status']))
+            continue
+        stream.write('%-20s %12.6g %12.6g %-2s %+7.1f%%  %s\n' %
+                     (info['name'], info['baseline'], info['median'],
+                      info['unit'], info['change'] * 100,
+                      info['status']))
@@ -0,0 +1,120 @@
+import os
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+class ModuleBundle(object):
+    """
+    A frozen record of the files a program read while it started up,
+    and of the module search paths that turned out not to exist, so
+    that later runs can answer those questions without searching the
+    filesystem.
+
+    Paths are the sandboxed paths seen by JS. A bundled file is only
+    trusted while its mtime is unchanged, and a missing path only
+    while the mtime of its directory is, so that adding, removing or
+    editing files falls back to the normal loader.
+    """
+
+    # Version of the bundle file format.
+    VERSION = 1
+
+    def __init__(self):
+        # Maps a path to a (mtime, size, source) tuple.
+        self.files = {}
+        # Maps a directory to its mtime, or None if it didn't exist,
+        # and the set of paths in it that weren't files.
+        self.missing = {}
+
+    def add_file(self, path, mtime, size, source):
+        self.files[path] = (mtime, size, source)
+
+    def add_missing(self, path, mtime):
+        """
+        Records that the given path wasn't a file while its directory
+        had the given mtime.
+        """
+
+        directory = os.path.dirname(path)
+        if directory not in self.missing:
+            self.missing[directory] = (mtime, set())
+        self.missing[directory][1].add(path)
+
+    def get_file(self, path):
+        """
+        Returns the (mtime, size, source) tuple of the given bundled
+        file, or None if it isn't bundled.
+        """
+
+        return self.files.get(path)
+
+    def is_missing(self, path):
+        entry = self.missing.get(os.path.dirname(path))
+        return entry is not None and path in entry[1]
+
+    def __len__(self):
+        return len(self.files)
+
+    def write(self, filename):
+        missing = {}
+        for directory, (mtime, paths) in self.missing.iteritems():
+            missing[directory] = dict(mtime = mtime,
+                                      paths = sorted(paths))
+        files = {}
+        for path, (mtime, size, source) in self.files.iteritems():
+            files[path] = dict(mtime = mtime, size = size, source = source)
+        data = dict(version = self.VERSION,
+                    files = files,
+                    missing = missing)
+        stream = open(filename, 'w')
+        try:
+            json.dump(data, stream)
+        finally:
+            stream.close()
+
+    @classmethod
+    def load(cls, filename, root_dir):
+        """
+        Reads the bundle in the given file, keeping only the entries
+        that are still valid for the filesystem under 'root_dir'.
+        Returns None if the bundle can't be read.
+        """
+
+        try:
+            stream = open(filename)
+            try:
+                data = json.load(stream)
+            finally:
+                stream.close()
+        except (IOError, ValueError):
+            return None
+        if data.get('version') != cls.VERSION:
+            return None
+
+        bundle = cls()
+        for path, info in data['files'].iteritems():
+            try:
+                mtime = os.stat(root_dir + path).st_mtime
+            except OSError:
+                continue
+            if mtime == info['mtime']:
+                bundle.add_file(path, mtime, info['size'], info['source'])
+        for directory, info in data['missing'].iteritems():
+            if dir_mtime(root_dir + directory) != info['mtime']:
+                continue
+            for path in info['paths']:
+                bundle.add_missing(path, info['mtime'])
+        return bundle
+
+def dir_mtime(path):
+    """
+    Returns the mtime of the given directory, or None if there's no
+    such directory.
+    """
+
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
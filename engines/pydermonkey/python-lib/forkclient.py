@@ -0,0 +1,62 @@
+import os
+import sys
+import socket
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from _multiprocessing import sendfd
+
+# The client side of the fork server, which is kept apart from
+# forkserver.py so that connecting doesn't import pydermonkey or
+# narwhal, and start the watchdog, only to hand the program over.
+
+class ServerUnavailable(Exception):
+    """
+    Raised when the fork server can't be reached, before anything has
+    been sent to it, so the program can safely be run in-process
+    instead.
+    """
+
+    pass
+
+def connect(socket_path, argv, cwd=None, env=None):
+    """
+    Asks the fork server listening at 'socket_path' to run a Narwhal
+    program with the given argv, passing it this process' stdio, and
+    returns the program's exit code.
+
+    Raises ServerUnavailable if the server can't be reached. Once the
+    connection is made, the program may have started, so errors after
+    that point are reported and give an exit code of 1 instead.
+    """
+
+    if cwd is None:
+        cwd = os.getcwd()
+    if env is None:
+        env = dict(os.environ)
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+    except socket.error, e:
+        conn.close()
+        raise ServerUnavailable(e)
+    try:
+        try:
+            for fd in range(3):
+                sendfd(conn.fileno(), fd)
+            conn.sendall(json.dumps(dict(argv = argv,
+                                         cwd = cwd,
+                                         env = env)) + '\n')
+            response = conn.makefile('rb').readline()
+        except socket.error, e:
+            sys.stderr.write("narwhal: lost the fork server: %s\n" % e)
+            return 1
+    finally:
+        conn.close()
+    if not response:
+        sys.stderr.write("narwhal: fork server worker died.\n")
+        return 1
+    return json.loads(response)['exit']
@@ -0,0 +1,237 @@
+import os
+import sys
+import errno
+import select
+import signal
+import socket
+import traceback
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from _multiprocessing import recvfd
+
+import pydermonkey
+import pydershell
+from pydershell import ScriptCache
+from narwhal import NarwhalRunner, RUNNER_ENVIRONMENT, environment_options
+
+# Arguments passed to narwhal.js when warming up the daemon; this
+# loads the core modules and packages without running anything.
+WARMUP_ARGV = ['narwhal', '-e', '']
+
+class ForkServer(object):
+    """
+    A long-lived daemon that bootstraps a JS runtime once and then
+    serves requests to run Narwhal programs from a pool of pre-forked
+    worker processes listening on a Unix socket.
+
+    Each worker serves exactly one request and then exits; the server
+    replaces it with a freshly forked worker so that there are always
+    'pool_size' idle workers waiting for connections.
+    """
+
+    # Default number of idle workers to keep around.
+    DEFAULT_POOL_SIZE = 2
+
+    def __init__(self, socket_path, home_dir, engine_home_dir,
+                 pool_size=DEFAULT_POOL_SIZE):
+        self.socket_path = socket_path
+        self.home_dir = home_dir
+        self.engine_home_dir = engine_home_dir
+        self.pool_size = pool_size
+        self.runtime = None
+        self.script_cache = None
+        self._listener = None
+        self._idle = set()
+        self._notify_r = None
+        self._notify_w = None
+
+    def warm_up(self):
+        """
+        Creates the shared runtime and runs a throwaway bootstrap in it
+        so that every core module is compiled before any worker is
+        forked.
+        """
+
+        self.runtime = pydermonkey.Runtime()
+        self.script_cache = ScriptCache(
+            cache_dir = os.environ.get('NARWHAL_PYDER_CACHE_DIR')
+            )
+        runner = NarwhalRunner(argv = WARMUP_ARGV,
+                               home_dir = self.home_dir,
+                               engine_home_dir = self.engine_home_dir,
+                               runtime = self.runtime,
+                               script_cache = self.script_cache)
+        try:
+            runner.run()
+        except SystemExit:
+            pass
+        runner.sandbox.finish()
+
+    def _listen(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(max(self.pool_size, 5))
+        self._listener = listener
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self._idle.add(pid)
+            return
+        status = 1
+        try:
+            os.close(self._notify_r)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            pydershell.reinit_after_fork()
+            status = Worker(self).serve()
+        except:
+            traceback.print_exc()
+        os._exit(status)
+
+    def _read_notifications(self):
+        try:
+            data = os.read(self._notify_r, 4096)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                return
+            raise
+        for line in data.split():
+            pid = int(line)
+            if pid in self._idle:
+                self._idle.remove(pid)
+                self._spawn_worker()
+
+    def _reap_workers(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if not pid:
+                return
+            if pid in self._idle:
+                # An idle worker died without serving a request;
+                # replace it.
+                self._idle.remove(pid)
+                self._spawn_worker()
+
+    def serve_forever(self):
+        """
+        Warms up, forks the initial worker pool and then keeps the pool
+        full until terminated.
+        """
+
+        self.warm_up()
+        self._listen()
+        self._notify_r, self._notify_w = os.pipe()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        try:
+            for i in range(self.pool_size):
+                self._spawn_worker()
+            while True:
+                try:
+                    readable = select.select([self._notify_r], [], [],
+                                             1.0)[0]
+                except select.error, e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    readable = []
+                if readable:
+                    self._read_notifications()
+                self._reap_workers()
+        finally:
+            for pid in self._idle:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            self._listener.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+class Worker(object):
+    """
+    A pre-forked process that waits for a single request, then runs
+    the requested Narwhal program with the client's argv, cwd,
+    environment and stdio.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        # Create the sandbox now, so that it's ready by the time a
+        # request arrives. It's configured by the daemon's environment,
+        # and built again for a client whose environment configures
+        # it differently.
+        self._environment = self._runner_environment()
+        self.runner = self._make_runner()
+
+    def _runner_environment(self):
+        return [os.environ.get(name) for name in RUNNER_ENVIRONMENT]
+
+    def _make_runner(self):
+        runner = NarwhalRunner(argv = [],
+                               home_dir = self.server.home_dir,
+                               engine_home_dir = self.server.engine_home_dir,
+                               runtime = self.server.runtime,
+                               script_cache = self.server.script_cache,
+                               **environment_options())
+        stats_output = os.environ.get('NARWHAL_PYDER_STATS')
+        if stats_output and stats_output != '1':
+            runner.call_stats_output = stats_output
+        return runner
+
+    def _read_request(self, conn):
+        # The client's stdio descriptors come first, since reading
+        # the request through a buffered file could otherwise consume
+        # the data that carries them.
+        fds = [recvfd(conn.fileno()) for i in range(3)]
+        request = json.loads(conn.makefile('rb').readline())
+        return fds, request
+
+    def serve(self):
+        server = self.server
+        conn = server._listener.accept()[0]
+        os.write(server._notify_w, '%d\n' % os.getpid())
+        server._listener.close()
+
+        fds, request = self._read_request(conn)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        if self._runner_environment() != self._environment:
+            self.runner.sandbox.finish()
+            self.runner = self._make_runner()
+        sys.argv = request['argv']
+        self.runner.argv = request['argv']
+
+        try:
+            try:
+                retval = self.runner.run()
+            except SystemExit, e:
+                retval = e.code
+        finally:
+            self.runner.close()
+        if retval is None:
+            retval = 0
+        elif type(retval) != int:
+            retval = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.sendall(json.dumps({'exit': retval}) + '\n')
+        conn.close()
+        return 0
@@ -0,0 +1,125 @@
+import zlib
+import hashlib
+
+import pydermonkey
+from pydershell import JsExposedObject, jsexposed
+from narwhal import ByteBuffer
+
+# Algorithms that the pure-JS hash modules implement, and that can be
+# replaced by hashlib if it supports them.
+ALGORITHMS = ('md4', 'md5', 'sha1', 'sha256')
+
+def available_algorithms():
+    """
+    Returns the names in ALGORITHMS that hashlib supports, which
+    depends on the OpenSSL it was built with.
+    """
+
+    names = []
+    for name in ALGORITHMS:
+        try:
+            hashlib.new(name)
+        except ValueError:
+            continue
+        names.append(name)
+    return names
+
+def string_bytes(string):
+    """
+    Returns the low byte of each UTF-16 code unit of the given string,
+    which is what the pure-JS hashes digest.
+    """
+
+    try:
+        return string.encode('latin-1')
+    except UnicodeEncodeError:
+        return string.encode('utf-16-le')[::2]
+
+def buffer_bytes(source, start, stop):
+    """
+    Returns a read-only view of the bytes of the given ByteString or
+    ByteArray between 'start' and 'stop', without copying them.
+    zlib.crc32() doesn't take memoryviews, so this is an old-style
+    buffer.
+    """
+
+    start = int(start)
+    return buffer(source._bytes.data, source._offset + start,
+                  int(stop) - start)
+
+class Hash(JsExposedObject):
+    """
+    An incremental hashlib hash, which can be updated with strings
+    and with the bytes of ByteStrings and ByteArrays.
+    """
+
+    __jsprops__ = ['name', 'digestSize']
+
+    def __init__(self, name, hash=None):
+        if hash is None:
+            try:
+                hash = hashlib.new(name)
+            except ValueError:
+                raise pydermonkey.error("unsupported hash: %s" % name)
+        self._name = name
+        self._hash = hash
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def digestSize(self):
+        return self._hash.digest_size
+
+    @jsexposed
+    def update(self, string):
+        self._hash.update(string_bytes(unicode(string)))
+        return self
+
+    @jsexposed
+    def updateBytes(self, source, start, stop):
+        self._hash.update(buffer_bytes(source, start, stop))
+        return self
+
+    @jsexposed
+    def digest(self):
+        return ByteBuffer(bytearray(self._hash.digest()))
+
+    @jsexposed
+    def hexDigest(self):
+        return self._hash.hexdigest()
+
+    @jsexposed
+    def copy(self):
+        return Hash(self._name, self._hash.copy())
+
+class Crc32(JsExposedObject):
+    """
+    An incremental CRC-32 checksum, whose value is a signed 32-bit
+    integer like the one the pure-JS crc32 module returns.
+    """
+
+    def __init__(self, crc=0):
+        self._crc = crc
+
+    @jsexposed
+    def update(self, string):
+        self._crc = zlib.crc32(string_bytes(unicode(string)), self._crc)
+        return self
+
+    @jsexposed
+    def updateBytes(self, source, start, stop):
+        self._crc = zlib.crc32(buffer_bytes(source, start, stop), self._crc)
+        return self
+
+    @jsexposed
+    def digest(self):
+        crc = self._crc & 0xFFFFFFFF
+        if crc >= 0x80000000:
+            crc -= 0x100000000
+        return crc
+
+    @jsexposed
+    def copy(self):
+        return Crc32(self._crc)
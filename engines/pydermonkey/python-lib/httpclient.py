@@ -0,0 +1,394 @@
+import time
+import socket
+import urlparse
+import httplib
+
+import pydermonkey
+from pydershell import JsExposedObject, jsexposed
+from narwhal import ByteBuffer, binary_view
+
+class ConnectionPool(object):
+    """
+    Keeps up to 'max_per_host' idle keep-alive connections to each
+    host, so that consecutive requests to the same host don't each
+    pay for a new TCP connection. Idle connections are closed once
+    they've been unused for 'idle_timeout' seconds.
+
+    'connection_factory' is called with the scheme, host, port and
+    timeout of a new connection; it defaults to creating an
+    httplib.HTTPConnection or HTTPSConnection.
+    """
+
+    DEFAULT_MAX_PER_HOST = 8
+
+    DEFAULT_IDLE_TIMEOUT = 30.0
+
+    # Seconds that connecting or waiting for data may take.
+    DEFAULT_TIMEOUT = 60.0
+
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 timeout=DEFAULT_TIMEOUT, connection_factory=None):
+        if connection_factory is None:
+            connection_factory = _new_connection
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connection_factory = connection_factory
+        # Maps a (scheme, host, port) key to a list of (time released,
+        # connection) tuples, most recently released last.
+        self._idle = {}
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, key):
+        """
+        Returns a (connection, reused) tuple for the given (scheme,
+        host, port) key, reusing an idle connection if there is one.
+        """
+
+        idle = self._idle.get(key)
+        expiry = time.time() - self.idle_timeout
+        while idle:
+            released, conn = idle.pop()
+            if released >= expiry:
+                self.reused += 1
+                return conn, True
+            conn.close()
+        scheme, host, port = key
+        self.created += 1
+        return self.connection_factory(scheme, host, port, self.timeout), False
+
+    def release(self, key, conn):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.max_per_host:
+            idle.append((time.time(), conn))
+        else:
+            conn.close()
+
+    def discard(self, key):
+        """
+        Closes the idle connections for the given key, once one of
+        them has turned out to be closed by the server.
+        """
+
+        for released, conn in self._idle.pop(key, []):
+            conn.close()
+
+    def prune(self):
+        """
+        Closes every connection that has been idle for too long.
+        """
+
+        expiry = time.time() - self.idle_timeout
+        for key, idle in self._idle.items():
+            while idle and idle[0][0] < expiry:
+                idle.pop(0)[1].close()
+            if not idle:
+                del self._idle[key]
+
+    def close(self):
+        for idle in self._idle.values():
+            for released, conn in idle:
+                conn.close()
+        self._idle.clear()
+
+    def stats(self):
+        return dict(created = self.created,
+                    reused = self.reused,
+                    idle = sum([len(idle) for idle in self._idle.values()]))
+
+def _new_connection(scheme, host, port, timeout):
+    if scheme == 'https':
+        return httplib.HTTPSConnection(host, port, timeout=timeout)
+    return httplib.HTTPConnection(host, port, timeout=timeout)
+
+def _utf8_boundary(data):
+    """
+    Returns the length of the given bytes without a UTF-8 sequence
+    that's cut off at the end.
+    """
+
+    for back in range(1, min(4, len(data)) + 1):
+        byte = ord(data[-back])
+        if byte & 0xC0 == 0x80:
+            # A continuation byte; look further back for its lead.
+            continue
+        if byte < 0xC0:
+            return len(data)
+        elif byte < 0xE0:
+            needed = 2
+        elif byte < 0xF0:
+            needed = 3
+        else:
+            needed = 4
+        if needed > back:
+            return len(data) - back
+        return len(data)
+    return len(data)
+
+# Methods that can safely be retried on a fresh connection if a reused
+# one turns out to have been closed by the server.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'DELETE', 'PUT', 'TRACE')
+
+class HttpRequest(JsExposedObject):
+    """
+    An HTTP request whose body is streamed to the server as it's
+    written. If no Content-Length header is given, a body is sent
+    with chunked transfer encoding.
+    """
+
+    def __init__(self, sandbox, pool, method, url, headers):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise pydermonkey.error("unsupported URL scheme: %s" % url)
+        port = parts.port
+        if port is None:
+            port = {'http': 80, 'https': 443}[parts.scheme]
+        self._sandbox = sandbox
+        self._pool = pool
+        self._key = (parts.scheme, parts.hostname, port)
+        self._method = method.upper()
+        self._path = parts.path or '/'
+        if parts.query:
+            self._path += '?' + parts.query
+        self._headers = headers
+        self._conn = None
+        self._reused = False
+        self._chunked = False
+        self._body_sent = False
+
+    def _send_headers(self, has_body):
+        conn, self._reused = self._pool.acquire(self._key)
+        self._conn = conn
+        conn.putrequest(self._method, self._path, skip_accept_encoding=True)
+        names = set([name.lower() for name, value in self._headers])
+        for name, value in self._headers:
+            conn.putheader(name, value)
+        if has_body and 'content-length' not in names:
+            conn.putheader('Transfer-Encoding', 'chunked')
+            self._chunked = True
+        conn.endheaders()
+
+    def _send(self, data):
+        if self._conn is None:
+            self._send_headers(True)
+        if not data:
+            return
+        self._body_sent = True
+        if self._chunked:
+            self._conn.send('%x\r\n' % len(data))
+            self._conn.send(data)
+            self._conn.send('\r\n')
+        else:
+            self._conn.send(data)
+
+    @jsexposed
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        try:
+            self._send(str(data))
+        except (socket.error, httplib.HTTPException), e:
+            self._abort()
+            raise pydermonkey.error(str(e))
+        return self
+
+    @jsexposed
+    def writeInto(self, buffer, start, stop):
+        view = binary_view(buffer, start, stop - start)
+        try:
+            self._send(view)
+        except (socket.error, httplib.HTTPException), e:
+            self._abort()
+            raise pydermonkey.error(str(e))
+        return self
+
+    def _abort(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _get_response(self):
+        if self._conn is None:
+            self._send_headers(False)
+        elif self._chunked:
+            self._conn.send('0\r\n\r\n')
+        return self._conn.getresponse()
+
+    @jsexposed
+    def finish(self):
+        """
+        Finishes sending the request and returns its HttpResponse once
+        the response's headers have arrived.
+        """
+
+        try:
+            try:
+                response = self._get_response()
+            except (socket.error, httplib.HTTPException):
+                # A reused connection may have been closed by the
+                # server while it was idle.
+                if not (self._reused and not self._body_sent and
+                        self._method in IDEMPOTENT_METHODS):
+                    raise
+                self._abort()
+                self._pool.discard(self._key)
+                response = self._get_response()
+        except (socket.error, httplib.HTTPException), e:
+            self._abort()
+            raise pydermonkey.error(str(e))
+        conn = self._conn
+        self._conn = None
+        return HttpResponse(self._sandbox, self._pool, self._key, conn,
+                            response)
+
+class HttpResponse(JsExposedObject):
+    """
+    The response to an HttpRequest, whose body is read in chunks.
+    Once the body has been read to the end, the connection goes back
+    to the pool, unless the server asked for it to be closed.
+    """
+
+    __jsprops__ = ['status', 'statusText', 'headers']
+
+    # Largest remainder of a body that close() reads rather than
+    # giving up the connection.
+    DRAIN_LIMIT = 64 * 1024
+
+    def __init__(self, sandbox, pool, key, conn, response):
+        self._sandbox = sandbox
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self._headers = None
+        # Bytes held back by readChunk() for the next read.
+        self._pending = ''
+
+    @property
+    def status(self):
+        return self._response.status
+
+    @property
+    def statusText(self):
+        response = self._response
+        version = {10: 'HTTP/1.0', 11: 'HTTP/1.1'}.get(response.version,
+                                                         'HTTP/0.9')
+        return '%s %d %s' % (version, response.status, response.reason)
+
+    @property
+    def headers(self):
+        """
+        An array of [name, value] pairs, with the names' case as sent
+        by the server and continuation lines joined.
+        """
+
+        if self._headers is None:
+            headers = []
+            for line in self._response.msg.headers:
+                if line[:1] in (' ', '\t') and headers:
+                    headers[-1][1] += ' ' + line.strip()
+                elif ':' in line:
+                    name, value = line.split(':', 1)
+                    headers.append([name.strip(), value.strip()])
+            self._headers = headers
+        return self._sandbox.to_js(self._headers)
+
+    def _finish(self):
+        """
+        Hands the connection back to the pool once the whole body has
+        been read, or closes it.
+        """
+
+        conn = self._conn
+        self._conn = None
+        if conn is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool.release(self._key, conn)
+        else:
+            conn.close()
+
+    def _read(self, size):
+        if self._pending:
+            data = self._pending[:size]
+            self._pending = self._pending[size:]
+            return data
+        if self._conn is None:
+            return ''
+        try:
+            data = self._response.read(size)
+        except (socket.error, httplib.HTTPException), e:
+            self._response.close()
+            self._finish()
+            raise pydermonkey.error(str(e))
+        if not data:
+            self._finish()
+        return data
+
+    @jsexposed
+    def readBytes(self, size=None):
+        """
+        Reads up to 'size' bytes of the body, or the rest of it if
+        'size' isn't given.
+        """
+
+        if size is None or size is pydermonkey.undefined or size < 0:
+            chunks = []
+            while True:
+                data = self._read(self.DRAIN_LIMIT)
+                if not data:
+                    break
+                chunks.append(data)
+            return ByteBuffer(bytearray(''.join(chunks)))
+        return ByteBuffer(bytearray(self._read(int(size))))
+
+    @jsexposed
+    def readChunk(self, size):
+        """
+        Reads about 'size' bytes of the body, holding back a UTF-8
+        sequence cut off at the end until the next read, so that each
+        chunk can be decoded on its own. Returns no bytes only at the
+        end of the body.
+        """
+
+        data = ''
+        while True:
+            more = self._read(int(size))
+            if not more:
+                return ByteBuffer(bytearray(data))
+            data += more
+            end = _utf8_boundary(data)
+            if end:
+                self._pending = data[end:]
+                return ByteBuffer(bytearray(data[:end]))
+
+    @jsexposed
+    def readInto(self, buffer, length, start=None):
+        view = binary_view(buffer, start, length)
+        data = self._read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    @jsexposed
+    def close(self):
+        """
+        Discards the rest of the body. Small remainders are drained so
+        that the connection can still be reused.
+        """
+
+        self._pending = ''
+        if self._conn is None:
+            return
+        length = self._response.length
+        if length is not None and length <= self.DRAIN_LIMIT:
+            try:
+                while self._read(self.DRAIN_LIMIT):
+                    pass
+            except pydermonkey.error:
+                pass
+            return
+        self._response.close()
+        self._conn.close()
+        self._conn = None
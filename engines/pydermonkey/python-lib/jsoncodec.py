@@ -0,0 +1,70 @@
+import re
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+# Maximum number of characters an indent may have, as in ES5.
+MAX_INDENT = 10
+
+_leading_spaces = re.compile(r'^( +)', re.MULTILINE)
+
+def _reject_constant(name):
+    raise ValueError("invalid JSON value: %s" % name)
+
+def parse(text):
+    """
+    Parses the given JSON text strictly, keeping the order of each
+    object's members. Raises a ValueError if it isn't valid JSON.
+    """
+
+    if OrderedDict is None:
+        return json.loads(text, parse_constant=_reject_constant)
+    return json.loads(text, parse_constant=_reject_constant,
+                      object_pairs_hook=OrderedDict)
+
+def _select_keys(value, keys):
+    if isinstance(value, list):
+        return [_select_keys(item, keys) for item in value]
+    if isinstance(value, dict):
+        selected = (OrderedDict or dict)()
+        for key in keys:
+            if key in value:
+                selected[key] = _select_keys(value[key], keys)
+        return selected
+    return value
+
+def _indent_string(space):
+    if isinstance(space, basestring):
+        return space[:MAX_INDENT]
+    if isinstance(space, (int, long, float)) and space >= 1:
+        return ' ' * min(int(space), MAX_INDENT)
+    return ''
+
+def reformat(text, keys=None, space=None):
+    """
+    Reformats the given compact JSON text like JSON.stringify() does
+    with an array replacer of 'keys', which keeps only those members
+    of every object, in that order, and with an indent of 'space'.
+    """
+
+    indent = _indent_string(space)
+    if keys is None and not indent:
+        return text
+    value = parse(text)
+    if keys is not None:
+        value = _select_keys(value, keys)
+    if not indent:
+        return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+    # Every line of the output starts with one space per level of
+    # nesting, since JSON strings can't contain line breaks.
+    text = json.dumps(value, indent=1, separators=(',', ': '),
+                      ensure_ascii=False)
+    return _leading_spaces.sub(lambda match: indent * len(match.group(1)),
+                               text)
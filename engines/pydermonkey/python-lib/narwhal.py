@@ -1,18 +1,584 @@
 import os
 import sys
+import stat
+import errno
+import time
+import mmap
+import zlib
+import codecs
 import traceback
+import collections
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 import pydermonkey
-from pydershell import JsSandbox, JsExposedObject, jsexposed
+import jsoncodec
+from archive import ArchiveSet
+from bundle import ModuleBundle, dir_mtime
+from resolver import (ModuleIndex, SearchDirectory, ArchiveSearchDirectory,
+                      UNKNOWN, normal_path, resolve_id)
+from reactor import Reactor
+from profiler import default_prefix as default_profile_prefix
+from pydershell import JsSandbox, JsExposedObject, ScriptCache, jsexposed
+
+class ByteBuffer(JsExposedObject):
+    """
+    Byte storage for the binary module's ByteString and ByteArray,
+    backed by a Python bytearray so that each byte takes one byte of
+    memory and bulk operations run natively.
+    """
+
+    __jsprops__ = ['length']
+
+    # Charset used when none is given.
+    DEFAULT_CHARSET = 'utf-8'
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def encode(cls, string, charset=None):
+        try:
+            return cls(bytearray(unicode(string).encode(
+                charset or cls.DEFAULT_CHARSET)))
+        except LookupError, e:
+            raise pydermonkey.error(str(e))
+
+    @property
+    def length(self):
+        return len(self.data)
+
+    def view(self, offset, length):
+        """
+        Returns a memoryview of the given range, without copying it.
+        """
+
+        offset = int(offset)
+        return memoryview(self.data)[offset:offset + int(length)]
+
+    @jsexposed
+    def get(self, index):
+        try:
+            return self.data[int(index)]
+        except IndexError:
+            return pydermonkey.undefined
+
+    @jsexposed
+    def set(self, index, value):
+        self.data[int(index)] = int(value) & 0xFF
+        return value
+
+    @jsexposed
+    def fill(self, start, stop, value):
+        start = max(int(start), 0)
+        stop = min(int(stop), len(self.data))
+        if start < stop:
+            self.data[start:stop] = chr(int(value) & 0xFF) * (stop - start)
+
+    @jsexposed
+    def copyFrom(self, source, source_offset, offset, length):
+        offset = int(offset)
+        length = int(length)
+        if source is self:
+            # The ranges may overlap, so copy through a temporary.
+            source_offset = int(source_offset)
+            chunk = self.data[source_offset:source_offset + length]
+        else:
+            chunk = source.view(source_offset, length)
+        self.data[offset:offset + length] = chunk
+
+    @jsexposed
+    def decode(self, offset, length, charset=None):
+        try:
+            return self.view(offset, length).tobytes().decode(
+                charset or self.DEFAULT_CHARSET, 'replace')
+        except LookupError, e:
+            raise pydermonkey.error(str(e))
+
+    @jsexposed
+    def transcode(self, offset, length, source_charset, target_charset):
+        return ByteBuffer.encode(self.decode(offset, length, source_charset),
+                                 target_charset)
+
+def binary_view(binary, start, length):
+    """
+    Returns a memoryview of 'length' bytes of the given ByteString or
+    ByteArray, 'start' bytes past its beginning, raising a JS error
+    unless they're all within it.
+    """
+
+    data = getattr(binary, '_bytes', None)
+    if not isinstance(data, ByteBuffer):
+        raise pydermonkey.error("expected a ByteString or ByteArray")
+    if not isinstance(start, (int, long, float)):
+        start = 0
+    if not isinstance(length, (int, long, float)):
+        raise pydermonkey.error("expected a length")
+    start = int(start)
+    length = int(length)
+    if start < 0 or length < 0 or start + length > binary._length:
+        raise pydermonkey.error("bytes %d to %d are outside of the %d "
+                                "bytes given" % (start, start + length,
+                                                 binary._length))
+    return data.view(binary._offset + start, length)
+
+class FileHandle(JsExposedObject):
+    """
+    A seekable file opened on behalf of JS code, read and written in
+    chunks rather than all at once.
+
+    Data is decoded from and encoded to 'charset'; if 'charset' is
+    None, each byte maps to the character with the same code.
+    """
+
+    # Read-only files at least this many bytes long are memory-mapped
+    # rather than read through a regular file object; set to None to
+    # disable memory-mapping entirely.
+    MMAP_THRESHOLD = 4 * 1024 * 1024
+
+    def __init__(self, path, mode, charset='utf-8'):
+        if charset is None:
+            charset = 'latin-1'
+        self._charset = charset
+        self._file = open(path, mode)
+        if mode == 'rb' and self.MMAP_THRESHOLD is not None:
+            size = os.fstat(self._file.fileno()).st_size
+            if size >= self.MMAP_THRESHOLD:
+                mapped = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+                self._file.close()
+                self._file = mapped
+        self._reset_decoder()
+
+    def _reset_decoder(self):
+        decoder_class = codecs.getincrementaldecoder(self._charset)
+        self._decoder = decoder_class('ignore')
+
+    def _check_open(self):
+        if self._file is None:
+            raise pydermonkey.error("I/O operation on closed file")
+
+    def _read_all(self):
+        if isinstance(self._file, mmap.mmap):
+            # A map's read() always takes a size.
+            return self._file.read(len(self._file) - self._file.tell())
+        return self._file.read()
+
+    @jsexposed
+    def read(self, size=None):
+        self._check_open()
+        if size is None or size is pydermonkey.undefined or size < 0:
+            return self._decoder.decode(self._read_all(), True)
+        return self._decoder.decode(self._file.read(int(size)))
+
+    @jsexposed
+    def readBytes(self, size=None):
+        self._check_open()
+        if size is None or size is pydermonkey.undefined or size < 0:
+            return ByteBuffer(bytearray(self._read_all()))
+        return ByteBuffer(bytearray(self._file.read(int(size))))
+
+    @jsexposed
+    def readInto(self, buffer, length, start=None):
+        """
+        Reads up to 'length' bytes straight into the given ByteArray,
+        at 'start' bytes past its beginning, returning the number of
+        bytes read.
+        """
+
+        self._check_open()
+        view = binary_view(buffer, start, length)
+        data = self._file.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    @jsexposed
+    def writeInto(self, buffer, start, stop):
+        """
+        Writes the bytes of the given ByteString or ByteArray between
+        'start' and 'stop' without decoding or copying them.
+        """
+
+        self._check_open()
+        self._file.write(binary_view(buffer, start, stop - start))
+
+    @jsexposed
+    def readLine(self):
+        self._check_open()
+        return self._decoder.decode(self._file.readline())
+
+    @jsexposed
+    def write(self, data):
+        self._check_open()
+        if isinstance(data, unicode):
+            data = data.encode(self._charset)
+        else:
+            data = str(data)
+        self._file.write(data)
+        return self
+
+    @jsexposed
+    def seek(self, offset, whence=0):
+        self._check_open()
+        self._file.seek(int(offset), int(whence or 0))
+        self._reset_decoder()
+
+    @jsexposed
+    def tell(self):
+        self._check_open()
+        return int(self._file.tell())
+
+    @jsexposed
+    def flush(self):
+        self._check_open()
+        if isinstance(self._file, file):
+            self._file.flush()
+        return self
+
+    @jsexposed
+    def isatty(self):
+        self._check_open()
+        return isinstance(self._file, file) and self._file.isatty()
+
+    @jsexposed
+    def fileno(self):
+        self._check_open()
+        if not isinstance(self._file, file):
+            raise pydermonkey.error("file is memory-mapped")
+        return self._file.fileno()
+
+    @jsexposed
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def _write_fully(fd, data):
+    view = memoryview(data)
+    while len(view):
+        try:
+            written = os.write(fd, view)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        view = view[written:]
+
+class OutputStream(JsExposedObject):
+    """
+    A buffered writer for one of the process' standard output streams,
+    written to with a single system call per buffer.
+
+    'buffering' is 'line' to flush whenever a newline is written,
+    'block' to flush only when 'buffer_size' bytes are buffered or the
+    stream is explicitly flushed, or 'none' to flush every write. If
+    it's None, it's 'line' if the stream is a terminal and 'block'
+    otherwise, decided when the stream is first written to.
+    """
+
+    BUFFERINGS = ('line', 'block', 'none')
+
+    DEFAULT_BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, fd, buffering=None, charset='utf-8',
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        if buffering is not None and buffering not in self.BUFFERINGS:
+            raise ValueError("invalid buffering: %s" % buffering)
+        self._fd = fd
+        self._charset = charset
+        self._buffering = buffering
+        self._buffer_size = buffer_size
+        self._buffer = bytearray()
+
+    def _write(self, data):
+        """
+        Writes the given byte string or buffer, flushing as the
+        stream's buffering requires.
+        """
+
+        buffering = self._buffering
+        if buffering is None:
+            if os.isatty(self._fd):
+                buffering = 'line'
+            else:
+                buffering = 'block'
+            self._buffering = buffering
+        buffer = self._buffer
+        if len(buffer) + len(data) > self._buffer_size:
+            self._flush()
+            if len(data) >= self._buffer_size:
+                _write_fully(self._fd, data)
+                return
+        start = len(buffer)
+        buffer += data
+        if (buffering == 'none' or
+            (buffering == 'line' and buffer.find('\n', start) != -1)):
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            buffer = self._buffer
+            self._buffer = bytearray()
+            _write_fully(self._fd, buffer)
+
+    @jsexposed
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode(self._charset)
+        else:
+            data = str(data)
+        try:
+            self._write(data)
+        except OSError, e:
+            raise pydermonkey.error(str(e))
+        return self
+
+    @jsexposed
+    def writeInto(self, buffer, start, stop):
+        """
+        Writes the bytes of the given ByteString or ByteArray between
+        'start' and 'stop' without decoding them.
+        """
+
+        view = binary_view(buffer, start, stop - start)
+        try:
+            self._write(view)
+        except OSError, e:
+            raise pydermonkey.error(str(e))
+        return self
+
+    @jsexposed
+    def flush(self):
+        try:
+            self._flush()
+        except OSError, e:
+            raise pydermonkey.error(str(e))
+        return self
+
+    @jsexposed
+    def setBuffering(self, buffering):
+        if buffering not in self.BUFFERINGS:
+            raise pydermonkey.error("invalid buffering: %s" % buffering)
+        self._buffering = buffering
+        return self
+
+    @jsexposed
+    def isatty(self):
+        return os.isatty(self._fd)
+
+    @jsexposed
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        """
+        Flushes whatever is left in the buffer, ignoring errors, since
+        there's nobody left to report them to.
+        """
+
+        try:
+            self._flush()
+        except OSError:
+            pass
+
+class InputStream(JsExposedObject):
+    """
+    A buffered reader for the process' standard input, reading
+    'buffer_size' bytes at a time. Like FileHandle, data is decoded
+    from 'charset'.
+    """
+
+    DEFAULT_BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, fd, charset='utf-8',
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        self._fd = fd
+        self._buffer_size = buffer_size
+        self._buffer = bytearray()
+        self._eof = False
+        decoder_class = codecs.getincrementaldecoder(charset)
+        self._decoder = decoder_class('ignore')
+
+    def _fill(self):
+        """
+        Reads more data into the buffer, returning False at the end of
+        the stream.
+        """
+
+        if self._eof:
+            return False
+        while True:
+            try:
+                chunk = os.read(self._fd, self._buffer_size)
+                break
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise pydermonkey.error(str(e))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer += chunk
+        return True
+
+    def _take(self, length):
+        data = str(self._buffer[:length])
+        del self._buffer[:length]
+        return data
+
+    def _read(self, size):
+        if size is None or size is pydermonkey.undefined or size < 0:
+            while self._fill():
+                pass
+            return self._take(len(self._buffer))
+        size = int(size)
+        while len(self._buffer) < size and self._fill():
+            pass
+        return self._take(size)
+
+    @jsexposed
+    def read(self, size=None):
+        data = self._read(size)
+        return self._decoder.decode(data, self._eof and not self._buffer)
+
+    @jsexposed
+    def readLine(self):
+        """
+        Returns the next line, including its newline, or an empty
+        string at the end of the stream.
+        """
+
+        start = 0
+        while True:
+            index = self._buffer.find('\n', start)
+            if index != -1:
+                return self._decoder.decode(self._take(index + 1))
+            start = len(self._buffer)
+            if not self._fill():
+                return self._decoder.decode(self._take(start), True)
+
+    @jsexposed
+    def readInto(self, buffer, length, start=None):
+        """
+        Reads up to 'length' bytes straight into the given ByteArray,
+        at 'start' bytes past its beginning, returning the number of
+        bytes read.
+        """
+
+        view = binary_view(buffer, start, length)
+        if not self._buffer:
+            self._fill()
+        data = self._take(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    @jsexposed
+    def isatty(self):
+        return os.isatty(self._fd)
+
+    @jsexposed
+    def fileno(self):
+        return self._fd
+
+class MetadataCache(object):
+    """
+    Remembers resolved real paths and stat results for 'ttl' seconds,
+    so that repeated queries about the same paths don't each cost
+    several system calls. Each table holds at most 'max_entries'
+    paths, dropping the ones that expire soonest when it's full.
+    """
+
+    # Default number of seconds that cached metadata is trusted for.
+    DEFAULT_TTL = 1.0
+
+    # Default number of paths kept in each table.
+    DEFAULT_MAX_ENTRIES = 4096
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # These are kept in the order that their entries expire in.
+        self._real_paths = collections.OrderedDict()
+        self._stats = collections.OrderedDict()
+
+    def _prune(self, table, now):
+        while table:
+            oldest = next(table.iterkeys())
+            if table[oldest][0] > now and len(table) <= self.max_entries:
+                break
+            del table[oldest]
+
+    def _put(self, table, key, value):
+        now = time.time()
+        table.pop(key, None)
+        table[key] = (now + self.ttl, value)
+        self._prune(table, now)
+
+    def _get(self, table, key, compute):
+        entry = table.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        value = compute()
+        self._put(table, key, value)
+        return value
+
+    def real_path(self, path):
+        return self._get(self._real_paths, path,
+                         lambda: os.path.realpath(os.path.normpath(path)))
+
+    def stat(self, path):
+        """
+        Returns the os.stat() result for the given path, or None if it
+        doesn't exist.
+        """
+
+        def compute():
+            try:
+                return os.stat(path)
+            except OSError:
+                return None
+        return self._get(self._stats, path, compute)
+
+    def prime_stat(self, path, info):
+        self._put(self._stats, path, info)
+
+    def invalidate(self, path=None):
+        """
+        Forgets the cached metadata for the given real path, or for
+        every path if none is given.
+        """
+
+        # Any path may lead through a symlink at the given one, so
+        # none of the real paths can be trusted.
+        self._real_paths.clear()
+        if path is None:
+            self._stats.clear()
+        else:
+            self._stats.pop(path, None)
+            self._stats.pop(os.path.dirname(path), None)
 
 class PyderApi(JsExposedObject):
-    __jsprops__ = ['info']
+    __jsprops__ = ['info', 'stdin', 'stdout', 'stderr', 'reactor']
 
     def __init__(self, runner):
         self._runner = runner
         self._sandbox = runner.sandbox
         self._root_dir = runner.home_dir
         self._cwd = '/'
+        self._metadata = MetadataCache()
+        # A ModuleBundle to answer questions about files from, and one
+        # to record the answers in, if the program is being frozen.
+        self._bundle = runner.bundle
+        self._freezer = runner.freezer
+        self._workers = None
+        self._http_pool = None
+        # The zip archives that modules have been read out of.
+        self._archives = ArchiveSet()
+        # The index of the files on the module search path, once the
+        # loader has told us what it is.
+        self._module_index = None
 
     def _sandboxed_path(self, path):
         if not path.startswith(self._root_dir):
@@ -25,6 +591,21 @@ class PyderApi(JsExposedObject):
             # unix-style paths.
             return path[len(self._root_dir):]
 
+    def _bundle_path(self, path):
+        """
+        Returns the normalized sandboxed path that the given path is
+        recorded under in module bundles.
+        """
+
+        if not path.startswith('/'):
+            path = '/'.join([self._cwd, path])
+        return '/' + os.path.normpath(path).lstrip('/')
+
+    def _bundled_file(self, filename):
+        if self._bundle is None:
+            return None
+        return self._bundle.get_file(self._bundle_path(filename))
+
     def _real_path(self, path):
         if not path.startswith('/'):
             if self._cwd == '/':
@@ -35,19 +616,64 @@ class PyderApi(JsExposedObject):
         # TODO: May need to change this for Windows.
         path = self._root_dir + path
 
-        path = os.path.normpath(path)
-        path = os.path.realpath(path)
+        path = self._metadata.real_path(path)
         if not path.startswith(self._root_dir):
             return None
         return path
 
+    def _archive_member(self, path, directory=False):
+        """
+        Returns an (archive, name) pair if the given real path is
+        inside a module archive, such as /packages/foo.zip/lib/foo.js,
+        or None if it isn't. An archive is a file as well as a
+        directory, so its own path only counts as being inside it if
+        'directory' is true.
+
+        Only the module loader looks inside archives; to the rest of
+        the file API, an archive is just a file.
+        """
+
+        member = self._archives.lookup(path, self._metadata.stat)
+        if member is not None and not member[1] and not directory:
+            return None
+        return member
+
+    def close_archives(self):
+        self._archives.close()
+
+    def _open_search_directory(self, path):
+        real_path = self._real_path(normal_path(path + '/'))
+        if not real_path:
+            return SearchDirectory(None)
+        if self._archive_member(real_path, directory=True) is not None:
+            return ArchiveSearchDirectory(
+                lambda: self._archive_member(real_path, directory=True)
+                )
+        return SearchDirectory(real_path)
+
     @property
     def info(self):
-        argv = ['/bin/narwhal'] + sys.argv[1:]
-        return self._sandbox.new_object(
+        argv = ['/bin/narwhal'] + self._runner.argv[1:]
+        return self._sandbox.to_js(dict(
             os = sys.platform,
-            argv = self._sandbox.new_array(*argv)
-            );
+            argv = argv
+            ))
+
+    @property
+    def stdin(self):
+        return self._runner.stdin
+
+    @property
+    def stdout(self):
+        return self._runner.stdout
+
+    @property
+    def stderr(self):
+        return self._runner.stderr
+
+    @property
+    def reactor(self):
+        return self._runner.reactor
 
     @jsexposed
     def cwd(self):
@@ -63,31 +689,84 @@ class PyderApi(JsExposedObject):
 
     @jsexposed
     def read(self, filename, args=None):
+        charset = 'utf-8'
+        if args and args is not pydermonkey.undefined:
+            if isinstance(args.charset, basestring) and args.charset:
+                charset = args.charset
+        bundled = self._bundled_file(filename)
+        if bundled is not None and charset == 'utf-8':
+            return bundled[2]
         path = self._real_path(filename)
         if not path:
             raise pydermonkey.error("invalid filename: %s" % filename)
+        freezing = self._freezer is not None and charset == 'utf-8'
         try:
-            contents = open(path).read()
-        except IOError, e:
+            f = open(path)
+            try:
+                contents = f.read()
+                # Only a bundle being frozen needs the mtime.
+                if freezing:
+                    mtime = os.fstat(f.fileno()).st_mtime
+            finally:
+                f.close()
+        except (IOError, OSError), e:
             raise pydermonkey.error(str(e))
+        size = len(contents)
         # TODO: Should we really be ignoring errors here?
-        if args and args.charset:
-            contents = contents.decode(args.charset, 'ignore')
-        else:
-            # TODO: Inflate the string instead?
-            contents = contents.decode('utf-8', 'ignore')
+        # TODO: Inflate the string instead?
+        contents = contents.decode(charset, 'ignore')
+        if freezing:
+            self._freezer.add_file(self._bundle_path(filename), mtime,
+                                   size, contents)
         return contents
 
+    @jsexposed
+    def open(self, filename, mode, charset=None):
+        path = self._real_path(filename)
+        if not path:
+            raise pydermonkey.error("invalid filename: %s" % filename)
+        if mode not in ('rb', 'wb', 'ab', 'r+b'):
+            raise pydermonkey.error("invalid mode: %s" % mode)
+        if mode != 'rb':
+            self._metadata.invalidate(path)
+        try:
+            return FileHandle(path, mode, charset)
+        except (IOError, EnvironmentError), e:
+            raise pydermonkey.error(str(e))
+
+    @jsexposed
+    def allocBytes(self, length):
+        return ByteBuffer(bytearray(int(length)))
+
+    @jsexposed
+    def encodeBytes(self, string, charset=None):
+        return ByteBuffer.encode(string, charset)
+
+    @jsexposed
+    def writeBytes(self, buffer, offset, length):
+        try:
+            self._runner.stdout._write(buffer.view(offset, length))
+        except OSError, e:
+            raise pydermonkey.error(str(e))
+
     @jsexposed
     def stat(self, filename):
+        bundled = self._bundled_file(filename)
+        if bundled is not None:
+            return self._sandbox.to_js(dict(
+                mtime = bundled[0],
+                size = bundled[1]
+                ))
         path = self._real_path(filename)
-        if not path or not os.path.exists(path):
+        if not path:
+            return None
+        info = self._metadata.stat(path)
+        if info is None:
             return None
-        info = os.stat(path)
-        return self._sandbox.new_object(
+        return self._sandbox.to_js(dict(
             mtime = info.st_mtime,
             size = int(info.st_size)
-            )
+            ))
 
     @jsexposed
     def canonical(self, path):
@@ -102,52 +781,657 @@ class PyderApi(JsExposedObject):
         path = self._real_path(path)
         if not path:
             return False
-        return os.path.exists(path)
+        return self._metadata.stat(path) is not None
 
     @jsexposed
     def isFile(self, filename):
+        bundle = self._bundle
+        if bundle is not None:
+            bundle_path = self._bundle_path(filename)
+            if bundle.get_file(bundle_path) is not None:
+                return True
+            if bundle.is_missing(bundle_path):
+                return False
         path = self._real_path(filename)
         if not path:
             return False
-        return os.path.isfile(path)
+        info = self._metadata.stat(path)
+        if info is None and self._freezer is not None:
+            bundle_path = self._bundle_path(filename)
+            self._freezer.add_missing(
+                bundle_path,
+                dir_mtime(self._root_dir + os.path.dirname(bundle_path))
+                )
+        return info is not None and stat.S_ISREG(info.st_mode)
 
     @jsexposed
     def isDirectory(self, filename):
         path = self._real_path(filename)
         if not path:
             return False
-        return os.path.isdir(path)
+        info = self._metadata.stat(path)
+        return info is not None and stat.S_ISDIR(info.st_mode)
 
     @jsexposed
     def listDirectory(self, filename):
         path = self._real_path(str(filename))
         dirs = []
-        if path and os.path.isdir(path):
+        if path and self.isDirectory(str(filename)):
             dirs.extend(os.listdir(path))
-        return self._sandbox.new_array(*dirs)
+        return self._sandbox.to_js(dirs)
+
+    @jsexposed
+    def scanDirectory(self, filename):
+        """
+        Returns an array describing every entry of the given directory
+        with its name, type, size and mtime, so that walking a tree
+        takes one call per directory rather than several per entry.
+        """
+
+        path = self._real_path(str(filename))
+        entries = []
+        if path and self.isDirectory(str(filename)):
+            for name in os.listdir(path):
+                child = os.path.join(path, name)
+                try:
+                    info = os.stat(child)
+                except OSError:
+                    try:
+                        # It's a dangling symlink, which is listed
+                        # as neither a file nor a directory.
+                        info = os.lstat(child)
+                    except OSError:
+                        # It was just removed.
+                        continue
+                else:
+                    self._metadata.prime_stat(child, info)
+                entries.append(dict(
+                    name = name,
+                    isFile = stat.S_ISREG(info.st_mode),
+                    isDirectory = stat.S_ISDIR(info.st_mode),
+                    size = int(info.st_size),
+                    mtime = info.st_mtime
+                    ))
+        return self._sandbox.to_js(entries)
+
+    @jsexposed
+    def loaderIsFile(self, filename):
+        """
+        Like isFile, but for the module loader, so it also finds
+        modules inside module archives.
+        """
+
+        path = self._real_path(filename)
+        member = path and self._archive_member(path)
+        if member:
+            archive, name = member
+            return archive.is_file(name)
+        return self.isFile(filename)
+
+    @jsexposed
+    def loaderRead(self, filename, args=None):
+        """
+        Like read, but for the module loader, so it also reads modules
+        out of module archives.
+        """
+
+        path = self._real_path(filename)
+        member = path and self._archive_member(path)
+        if not member:
+            return self.read(filename, args)
+        charset = 'utf-8'
+        if args and args is not pydermonkey.undefined:
+            if isinstance(args.charset, basestring) and args.charset:
+                charset = args.charset
+        archive, name = member
+        try:
+            contents = archive.read(name)
+        except KeyError:
+            raise pydermonkey.error("no such file: %s" % filename)
+        except (IOError, zlib.error), e:
+            raise pydermonkey.error(str(e))
+        return contents.decode(charset, 'ignore')
+
+    @jsexposed
+    def loaderMtime(self, filename):
+        """
+        Returns the mtime of the given module, which is that of its
+        archive if it's inside one, or null if there's no such module.
+        """
+
+        bundled = self._bundled_file(filename)
+        if bundled is not None:
+            return bundled[0]
+        path = self._real_path(filename)
+        if not path:
+            return None
+        member = self._archive_member(path)
+        if member is not None:
+            archive, name = member
+            if not archive.is_file(name):
+                return None
+            return archive.mtime
+        info = self._metadata.stat(path)
+        if info is None:
+            return None
+        return info.st_mtime
+
+    def worker_pool(self):
+        """
+        Returns the pool of this program's worker processes, creating
+        it if needed. Messages from the workers, and from the parent
+        if this is a worker, are delivered by the runner's reactor.
+        """
+
+        if self._workers is None:
+            import workers
+            self._workers = workers.WorkerPool(
+                self._root_dir,
+                self._runner.engine_home_dir,
+                parent = self._runner.parent_channel
+                )
+            self._workers.on_event = self._dispatch_worker_event
+            self._runner.reactor.add_source(self._workers)
+        return self._workers
+
+    def _dispatch_worker_event(self, event):
+        queue = self._sandbox.root.require('event-queue')
+        queue.dispatchExternal(self._sandbox.to_js(list(event)))
+
+    def close_workers(self):
+        if self._workers is not None:
+            self._runner.reactor.remove_source(self._workers)
+            self._workers.close()
+            self._workers = None
+
+    @jsexposed
+    def spawnWorker(self, script):
+        return self.worker_pool().spawn(script)
+
+    @jsexposed
+    def postToWorker(self, worker_id, data):
+        self.worker_pool().post(int(worker_id), data)
+
+    @jsexposed
+    def terminateWorker(self, worker_id):
+        self.worker_pool().terminate(int(worker_id))
+
+    @jsexposed
+    def postToParent(self, type, data):
+        channel = self._runner.parent_channel
+        if channel is None:
+            raise pydermonkey.error("not running in a worker")
+        kind = {'message': 'M', 'error': 'E'}[type]
+        channel.send(kind, data.encode('utf-8'))
+
+    @jsexposed
+    def closeWorker(self):
+        import workers
+
+        if self._runner.parent_channel is None:
+            raise pydermonkey.error("not running in a worker")
+        raise workers.WorkerTerminated()
+
+    @jsexposed
+    def waitForEvent(self):
+        event = self.worker_pool().wait()
+        if event is None:
+            return None
+        return self._sandbox.to_js(list(event))
+
+    def http_pool(self):
+        """
+        Returns the pool of keep-alive HTTP connections, creating it
+        if needed. Its size and idle timeout can be set with
+        NARWHAL_PYDER_HTTP_POOL_SIZE and NARWHAL_PYDER_HTTP_IDLE_TIMEOUT.
+        """
+
+        if self._http_pool is None:
+            import httpclient
+            pool = httpclient.ConnectionPool()
+            size = os.environ.get('NARWHAL_PYDER_HTTP_POOL_SIZE')
+            if size:
+                pool.max_per_host = int(size)
+            idle_timeout = os.environ.get('NARWHAL_PYDER_HTTP_IDLE_TIMEOUT')
+            if idle_timeout:
+                pool.idle_timeout = float(idle_timeout)
+            self._http_pool = pool
+        return self._http_pool
+
+    def close_http(self):
+        if self._http_pool is not None:
+            self._http_pool.close()
+            self._http_pool = None
+
+    @jsexposed
+    def httpRequest(self, method, url, headers):
+        """
+        Starts an HTTP request with the given array of [name, value]
+        header pairs, returning an HttpRequest that the body can be
+        written to.
+        """
+
+        import httpclient
+
+        pool = self.http_pool()
+        pool.prune()
+        headers = [(str(name), str(value))
+                   for name, value in self._sandbox.to_py(headers)]
+        return httpclient.HttpRequest(self._sandbox, pool, method,
+                                      str(url), headers)
+
+    @jsexposed
+    def configureHttp(self, max_per_host=None, idle_timeout=None):
+        pool = self.http_pool()
+        if isinstance(max_per_host, (int, float)):
+            pool.max_per_host = int(max_per_host)
+        if isinstance(idle_timeout, (int, float)):
+            pool.idle_timeout = float(idle_timeout)
+
+    @jsexposed
+    def httpStats(self):
+        return self._sandbox.to_js(self.http_pool().stats())
+
+    def _process_options(self, args, options):
+        """
+        Returns the (args, cwd, env, charset) tuple for starting a
+        child process with the given array of arguments and options.
+        """
+
+        options = self._sandbox.to_py(options)
+        if not isinstance(options, dict):
+            options = {}
+        args = [unicode(arg).encode('utf-8')
+                for arg in self._sandbox.to_py(args)]
+        if not args:
+            raise pydermonkey.error("no command given")
+        cwd = self._real_path(options.get('cwd') or self._cwd)
+        if cwd is None:
+            raise pydermonkey.error("invalid directory: %s" %
+                                    options.get('cwd'))
+        env = options.get('env')
+        if isinstance(env, dict):
+            env = dict([(str(name), unicode(value).encode('utf-8'))
+                        for name, value in env.iteritems()])
+        else:
+            env = None
+        charset = options.get('charset')
+        if not isinstance(charset, basestring):
+            charset = 'utf-8'
+        return args, cwd, env, charset
+
+    @jsexposed
+    def popen(self, args, options=None):
+        """
+        Starts a child process with the given array of arguments,
+        returning a ChildProcess. 'options' may give the 'cwd' to run
+        it in, an 'env' object to replace the environment, and the
+        'charset' of its standard streams.
+        """
+
+        import process
+
+        args, cwd, env, charset = self._process_options(args, options)
+        # Whatever the process changed must be looked at again.
+        return process.ChildProcess(args, cwd, env, charset,
+                                    on_exit = self._metadata.invalidate)
+
+    @jsexposed
+    def system(self, args, options=None):
+        """
+        Runs a child process with the given array of arguments and
+        options, as for popen(), on this process' own standard streams,
+        and returns its exit status once it has finished.
+        """
+
+        import process
+
+        args, cwd, env, charset = self._process_options(args, options)
+        # Keep the output in order with whatever JS has buffered.
+        self._runner.stdout.flush()
+        self._runner.stderr.flush()
+        try:
+            return process.system(args, cwd, env)
+        finally:
+            self._metadata.invalidate()
+
+    @jsexposed
+    def communicate(self, pipes):
+        """
+        Takes an array of [process, input, output, errput] arrays and
+        pumps data between each process and its callbacks until all
+        of them have closed their output, returning their statuses.
+        """
+
+        import process
+
+        pipes = [tuple(pipe) for pipe in self._sandbox.to_py(pipes)]
+        try:
+            return self._sandbox.to_js(process.communicate(pipes))
+        finally:
+            self._metadata.invalidate()
+
+    @jsexposed
+    def parseJson(self, text):
+        """
+        Parses JSON text with Python's json module, and moves the
+        result to JS in a single conversion.
+        """
+
+        try:
+            value = jsoncodec.parse(text)
+            # The conversion has limits on size and depth of its own.
+            return self._sandbox.to_js(value)
+        except ValueError, e:
+            raise pydermonkey.error("JSON.parse: %s" % e)
+
+    @jsexposed
+    def nativeJson(self):
+        """
+        Returns the runtime's own JSON object, which json.js uses
+        unless NARWHAL_PYDER_JSON is 'python' or there isn't one, in
+        which case it returns null.
+        """
+
+        native = self._sandbox.native_json
+        if (native is pydermonkey.undefined or
+            os.environ.get('NARWHAL_PYDER_JSON') == 'python'):
+            return None
+        return native
+
+    @jsexposed
+    def stringifyJson(self, value, keys=None, space=None):
+        """
+        Returns the given value as JSON text, keeping only the members
+        in the 'keys' array if it's given and indenting it by 'space'.
+        Returns null if the value isn't plain data, which JS has to
+        prepare by calling toJSON() methods and dropping functions.
+        """
+
+        text = self._sandbox.to_json(value)
+        if text is None or text is pydermonkey.undefined:
+            return text
+        if keys is not None and keys is not pydermonkey.undefined:
+            keys = [unicode(key) for key in self._sandbox.to_py(keys)]
+        else:
+            keys = None
+        return jsoncodec.reformat(text, keys, space)
+
+    @jsexposed
+    def hashAlgorithms(self):
+        import hashes
+
+        return self._sandbox.to_js(hashes.available_algorithms())
+
+    @jsexposed
+    def newHash(self, name):
+        import hashes
+
+        return hashes.Hash(name)
+
+    @jsexposed
+    def newCrc32(self):
+        import hashes
+
+        return hashes.Crc32()
+
+    @jsexposed
+    def setModulePaths(self, paths, extensions):
+        """
+        Sets the search path and the extensions that resolve() finds
+        modules with, returning the number that resolve() can be given
+        to find modules on them again.
+        """
+
+        if self._module_index is None:
+            self._module_index = ModuleIndex(self._open_search_directory)
+        return self._module_index.set_paths(
+            [unicode(path) for path in self._sandbox.to_py(paths)],
+            [unicode(extension)
+             for extension in self._sandbox.to_py(extensions)]
+            )
+
+    @jsexposed
+    def resolve(self, id, base_id=None, search_path=None):
+        """
+        Returns the path of the file that the module 'id', required
+        from the module 'base_id', would be loaded from, on the search
+        path with the number that setModulePaths() returned, or else
+        the last one set. Returns
+        undefined if it isn't in the index, or if the id is outside of
+        the search path, so that the loader looks for the module
+        itself.
+        """
+
+        if self._module_index is None:
+            return pydermonkey.undefined
+        if not isinstance(base_id, basestring):
+            base_id = None
+        top_id = resolve_id(id, base_id)
+        if top_id.startswith('/') or top_id.split('/')[0] == '..':
+            return pydermonkey.undefined
+        if isinstance(search_path, (int, long, float)):
+            search_path = int(search_path)
+        else:
+            search_path = None
+        path = self._module_index.find(top_id, search_path)
+        if path is UNKNOWN:
+            return pydermonkey.undefined
+        return path
+
+    @jsexposed
+    def moduleIndexStats(self):
+        if self._module_index is None:
+            return None
+        return self._sandbox.to_js(self._module_index.stats())
+
+    @jsexposed
+    def runTests(self, suite_id, modules, options):
+        """
+        Runs the given modules of a test suite in parallel worker
+        processes, as test-engine.js asks, returning the number of
+        tests that passed, failed and had errors.
+        """
+
+        import testrunner
+
+        options = self._sandbox.to_py(options)
+        timings = options.get('timings')
+        if timings:
+            timings = self._real_path(timings)
+        else:
+            cache_dir = os.environ.get('NARWHAL_PYDER_CACHE_DIR')
+            if cache_dir:
+                timings = os.path.join(cache_dir, 'test-timings.json')
+        runner = testrunner.ParallelTestRunner(
+            self._root_dir, self._runner.engine_home_dir, self._runner.stdout,
+            jobs = int(options.get('jobs') or 0),
+            timeout = float(options.get('timeout') or
+                            testrunner.ParallelTestRunner.DEFAULT_TIMEOUT),
+            timings_file = timings
+            )
+        totals = runner.run(suite_id, self._sandbox.to_py(modules), dict(
+            color = options.get('color', True),
+            showStacktraces = options.get('showStacktraces', False)
+            ))
+        return self._sandbox.to_js(totals)
 
     @jsexposed
     def printString(self, *args):
-        sys.stdout.write(" ".join(args))
+        self._runner.stdout.write(" ".join(args))
 
     @jsexposed
-    def evaluate(self, code, filename='<string>', lineno=1):
+    def evaluate(self, code, filename='<string>', lineno=1, prefix=None):
+        cache_key = None
         if filename != '<string>':
+            bundled = self._bundled_file(filename)
             filename = self._root_dir + filename
-        return self._sandbox.evaluate(code, filename, lineno)
+            if bundled is not None:
+                cache_key = (filename, bundled[0], prefix or '',
+                             ScriptCache.digest(code))
+                return self._sandbox.evaluate(code, filename, lineno,
+                                              cache_key)
+            try:
+                mtime = os.stat(filename).st_mtime
+            except OSError:
+                member = self._archive_member(
+                    self._metadata.real_path(filename))
+                mtime = member and member[0].mtime
+            if mtime is not None:
+                # The wrapper prefix and the code's digest distinguish
+                # the different ways the same file may be evaluated,
+                # and edits made within the mtime's resolution.
+                cache_key = (os.path.realpath(filename), mtime,
+                             prefix or '', ScriptCache.digest(code))
+        return self._sandbox.evaluate(code, filename, lineno, cache_key)
+
+    @jsexposed
+    def scriptCacheStats(self):
+        return self._sandbox.to_js(self._sandbox.script_cache.stats())
+
+    @jsexposed
+    def gc(self):
+        self._sandbox.collect_garbage()
+
+    @jsexposed
+    def memoryStats(self):
+        return self._sandbox.to_js(self._sandbox.memory_stats())
+
+    @jsexposed
+    def stats(self):
+        """
+        Returns the calls recorded between Python and JS, or null if
+        they aren't being recorded.
+        """
+
+        call_stats = self._sandbox.call_stats
+        if call_stats is None:
+            return None
+        return self._sandbox.to_js(call_stats.snapshot())
+
+# The environment variables that configure a NarwhalRunner as it's
+# built, rather than while its program runs.
+RUNNER_ENVIRONMENT = ('NARWHAL_PYDER_BUFFERING', 'NARWHAL_PYDER_STATS',
+                      'NARWHAL_PYDER_MEMORY_LIMIT')
+
+def environment_options(environ=None):
+    """
+    Returns the NarwhalRunner arguments that the environment asks for:
+    call stats if NARWHAL_PYDER_STATS is set, and the memory limit
+    given in megabytes by NARWHAL_PYDER_MEMORY_LIMIT.
+    """
+
+    if environ is None:
+        environ = os.environ
+    options = {}
+    if environ.get('NARWHAL_PYDER_STATS'):
+        from pydershell import CallStats
+
+        options['call_stats'] = CallStats()
+    memory_limit = environ.get('NARWHAL_PYDER_MEMORY_LIMIT')
+    if memory_limit:
+        options['memory_limit'] = int(float(memory_limit) * 1024 * 1024)
+    return options
 
 class NarwhalRunner(object):
-    def __init__(self, argv, home_dir, engine_home_dir):
+    def __init__(self, argv, home_dir, engine_home_dir, runtime=None,
+                 script_cache=None, profiler=None, call_stats=None,
+                 bundle=None, freezer=None, memory_limit=None):
         self.argv = argv
         self.home_dir = home_dir
         self.engine_home_dir = engine_home_dir
-        self.sandbox = JsSandbox()
-        self.sandbox.root.pyder = PyderApi(self)
+        if script_cache is None:
+            script_cache = ScriptCache(
+                cache_dir = os.environ.get('NARWHAL_PYDER_CACHE_DIR')
+                )
+        # The channel to the parent process, if this is a worker.
+        self.parent_channel = None
+        # An optional ModuleBundle that file queries are answered from,
+        # and an optional one that they're recorded in, to be written
+        # to 'freeze_output' when the runner is closed.
+        self.bundle = bundle
+        self.freezer = freezer
+        self.freeze_output = None
+        self.sandbox = JsSandbox(script_cache=script_cache, runtime=runtime,
+                                 call_stats=call_stats,
+                                 memory_limit=memory_limit)
+        self.api = PyderApi(self)
+        self.sandbox.root.pyder = self.api
+        # An optional SamplingProfiler, and the filename prefix its
+        # reports are written to when the runner is closed.
+        self.profiler = profiler
+        self.profile_prefix = None
+        # Where the call stats are written when the runner is closed:
+        # a filename for a JSON snapshot, or None for a text report on
+        # stderr.
+        self.call_stats_output = None
+        if profiler is not None:
+            profiler.attach(self.sandbox)
+        # The standard streams used by JS; stdout's buffering can be
+        # set with NARWHAL_PYDER_BUFFERING, while stderr is flushed
+        # at the end of every line.
+        buffering = os.environ.get('NARWHAL_PYDER_BUFFERING') or None
+        if (buffering is not None and
+            buffering not in OutputStream.BUFFERINGS):
+            sys.stderr.write("narwhal: ignoring invalid "
+                             "NARWHAL_PYDER_BUFFERING: %s\n" % buffering)
+            buffering = None
+        self.stdin = InputStream(0)
+        self.stdout = OutputStream(1, buffering)
+        self.stderr = OutputStream(2, 'line')
+        self.sandbox.report_error = self._report_error
+        # The event loop that runs timers and I/O callbacks once the
+        # main module has finished; garbage is collected while it waits.
+        self.reactor = Reactor()
+        self.reactor.on_idle = self.sandbox.maybe_gc
+
+    def _report_error(self, message):
+        # Keep errors in order with whatever the script has printed.
+        self.stderr.close()
+        self.stdout.close()
+        print message
 
     def run(self):
         filename = os.path.join(self.engine_home_dir, 'bootstrap.js')
-        return self.sandbox.run_script(filename)
+        retval = self.sandbox.run_script(filename)
+        if retval == 0 and self.reactor.has_work():
+            retval = self.sandbox.run_function(self.reactor.run)
+        return retval
+
+    def close(self):
+        """
+        Flushes the standard streams, shuts down any worker processes
+        started by the program, closes its pooled HTTP connections and
+        module archives, and writes the frozen module bundle, the
+        profiler's reports and call stats, if they're being collected.
+        """
+
+        self.stdout.close()
+        self.stderr.close()
+        self.api.close_workers()
+        self.api.close_http()
+        self.api.close_archives()
+        if self.freezer is not None and self.freeze_output:
+            self.freezer.write(self.freeze_output)
+        if self.profiler is not None:
+            prefix = self.profile_prefix or default_profile_prefix()
+            for filename in self.profiler.write(prefix):
+                sys.stderr.write("narwhal: wrote profile to %s\n" %
+                                 filename)
+        call_stats = self.sandbox.call_stats
+        if call_stats is not None:
+            if self.call_stats_output:
+                stream = open(self.call_stats_output, 'w')
+                try:
+                    json.dump(call_stats.snapshot(), stream, indent=2)
+                finally:
+                    stream.close()
+            else:
+                call_stats.write_report(sys.stderr)
 
 def run(*args, **kwargs):
     runner = NarwhalRunner(*args, **kwargs)
-    return runner.run()
+    try:
+        return runner.run()
+    finally:
+        runner.close()
@@ -0,0 +1,260 @@
+import os
+import errno
+import codecs
+import select
+import signal
+import subprocess
+
+import pydermonkey
+from pydershell import JsExposedObject, jsexposed
+from reactor import Reactor
+from narwhal import InputStream, OutputStream
+
+# Number of bytes read from a child's output at a time.
+CHUNK_SIZE = 64 * 1024
+
+# Number of bytes that can be written to a pipe without blocking, once
+# it's writable.
+PIPE_BUF = getattr(select, 'PIPE_BUF', 512)
+
+def exit_status(returncode):
+    """
+    Returns a process' exit status the way a shell reports it.
+    """
+
+    if returncode < 0:
+        # Killed by a signal.
+        return 128 - returncode
+    return returncode
+
+def system(args, cwd=None, env=None):
+    """
+    Runs the given argument list to completion in the real directory
+    'cwd', with the standard streams of this process, and returns its
+    exit status.
+    """
+
+    try:
+        popen = subprocess.Popen(args, cwd = cwd, env = env)
+    except OSError, e:
+        raise pydermonkey.error("%s: %s" % (args[0], e.strerror))
+    while True:
+        try:
+            return exit_status(popen.wait())
+        except OSError, e:
+            if e.errno != errno.EINTR:
+                raise pydermonkey.error(str(e))
+
+class PipeOutputStream(OutputStream):
+    """
+    An unbuffered OutputStream over the write end of a pipe to a
+    child process, which JS can close to signal the end of its input.
+    """
+
+    def __init__(self, pipe, charset='utf-8'):
+        OutputStream.__init__(self, pipe.fileno(), 'none', charset)
+        self._pipe = pipe
+
+    @jsexposed
+    def close(self):
+        if not self._pipe.closed:
+            OutputStream.close(self)
+            self._pipe.close()
+
+class PipeInputStream(InputStream):
+    """
+    An InputStream over the read end of a pipe from a child process,
+    reading CHUNK_SIZE bytes at a time.
+    """
+
+    def __init__(self, pipe, charset='utf-8'):
+        InputStream.__init__(self, pipe.fileno(), charset, CHUNK_SIZE)
+        self._pipe = pipe
+        self._charset = charset
+
+    def _fill(self):
+        if self._pipe.closed:
+            return False
+        return InputStream._fill(self)
+
+    @jsexposed
+    def close(self):
+        if not self._pipe.closed:
+            self._eof = True
+            self._pipe.close()
+
+class ChildProcess(JsExposedObject):
+    """
+    A child process with pipes to its standard streams, started with
+    the given argument list in the real directory 'cwd'.
+
+    Its output can either be read from its stdout and stderr streams,
+    or pumped to callbacks with communicate(), which handles any
+    number of processes at once. 'on_exit' is called once the process
+    is seen to have exited.
+    """
+
+    __jsprops__ = ['pid', 'stdin', 'stdout', 'stderr']
+
+    def __init__(self, args, cwd=None, env=None, charset='utf-8',
+                 on_exit=None):
+        # Called once it's seen that the process has exited.
+        self._on_exit = on_exit
+        try:
+            self._popen = subprocess.Popen(args,
+                                           cwd = cwd,
+                                           env = env,
+                                           stdin = subprocess.PIPE,
+                                           stdout = subprocess.PIPE,
+                                           stderr = subprocess.PIPE,
+                                           close_fds = True)
+        except OSError, e:
+            raise pydermonkey.error("%s: %s" % (args[0], e.strerror))
+        self._charset = charset
+        self._stdin = PipeOutputStream(self._popen.stdin, charset)
+        self._stdout = PipeInputStream(self._popen.stdout, charset)
+        self._stderr = PipeInputStream(self._popen.stderr, charset)
+
+    @property
+    def pid(self):
+        return self._popen.pid
+
+    @property
+    def stdin(self):
+        return self._stdin
+
+    @property
+    def stdout(self):
+        return self._stdout
+
+    @property
+    def stderr(self):
+        return self._stderr
+
+    def _status(self, returncode):
+        if returncode is None:
+            return None
+        if self._on_exit is not None:
+            on_exit = self._on_exit
+            self._on_exit = None
+            on_exit()
+        return exit_status(returncode)
+
+    @jsexposed
+    def poll(self):
+        """
+        Returns the exit status if the process has finished, or null.
+        """
+
+        return self._status(self._popen.poll())
+
+    @jsexposed
+    def wait(self):
+        self._stdin.close()
+        while True:
+            try:
+                return self._status(self._popen.wait())
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise pydermonkey.error(str(e))
+
+    @jsexposed
+    def kill(self, signum=None):
+        if not isinstance(signum, (int, float)):
+            signum = signal.SIGTERM
+        if self._popen.poll() is None:
+            try:
+                os.kill(self._popen.pid, int(signum))
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise pydermonkey.error(str(e))
+
+def communicate(pipes, reactor=None):
+    """
+    Pumps data between several child processes and callbacks at once,
+    until every process has closed its output, and returns their exit
+    statuses.
+
+    'pipes' is a list of (process, input, output, errput) tuples.
+    'input' is called with a number of characters and returns up to
+    that many to write to the process, or an empty string or None
+    once there are no more; 'output' and 'errput' are called with
+    each chunk of text the process writes to stdout and stderr. Any
+    of them may be None, to close stdin or to discard the output.
+    """
+
+    if reactor is None:
+        reactor = Reactor()
+    for process, input, output, errput in pipes:
+        _pump_input(reactor, process._stdin, input)
+        _pump_output(reactor, process._stdout, output)
+        _pump_output(reactor, process._stderr, errput)
+    reactor.run()
+    return [process.wait() for process, input, output, errput in pipes]
+
+def _pump_input(reactor, stream, input):
+    if input is None or stream._pipe.closed:
+        stream.close()
+        return
+    fd = stream._fd
+    encoder = codecs.getincrementalencoder(stream._charset)()
+    pending = ['']
+
+    def finish():
+        reactor.remove_writer(fd)
+        stream.close()
+
+    def writable(fd):
+        if not pending[0]:
+            text = input(PIPE_BUF)
+            if not isinstance(text, basestring) or not text:
+                finish()
+                return
+            pending[0] = encoder.encode(text)
+        try:
+            written = os.write(fd, pending[0][:PIPE_BUF])
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                return
+            if e.errno != errno.EPIPE:
+                raise
+            # The process has stopped reading its input.
+            pending[0] = ''
+            finish()
+            return
+        pending[0] = pending[0][written:]
+
+    reactor.add_writer(fd, writable)
+
+def _pump_output(reactor, stream, output):
+    fd = stream._fd
+    decoder = codecs.getincrementaldecoder(stream._charset)('replace')
+
+    def emit(data, final=False):
+        text = decoder.decode(data, final)
+        if text and output is not None:
+            output(text)
+
+    # Whatever JS has already buffered goes first.
+    if stream._buffer:
+        emit(stream._take(len(stream._buffer)))
+    if stream._eof or stream._pipe.closed:
+        emit('', True)
+        stream.close()
+        return
+
+    def readable(fd):
+        try:
+            data = os.read(fd, CHUNK_SIZE)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                return
+            raise
+        if data:
+            emit(data)
+        else:
+            reactor.remove_reader(fd)
+            emit('', True)
+            stream.close()
+
+    reactor.add_reader(fd, readable)
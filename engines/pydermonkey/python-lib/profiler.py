@@ -0,0 +1,131 @@
+import os
+
+from pydershell import iter_stack_frames
+
+class SamplingProfiler(object):
+    """
+    Samples the JS stack of a JsSandbox from its operation callback,
+    'rate' times per second of running JS, and aggregates the samples
+    by stack and by function.
+
+    Since samples are only taken when the watchdog triggers the
+    operation callback, a profiled script pays for one stack walk per
+    sample and nothing in between.
+    """
+
+    # Default number of samples per second.
+    DEFAULT_RATE = 100
+
+    # Default number of functions listed in the text report.
+    DEFAULT_TOP = 25
+
+    def __init__(self, rate=DEFAULT_RATE):
+        if rate <= 0:
+            raise ValueError('sampling rate must be positive: %r' % rate)
+        self.rate = rate
+        self.samples = 0
+        # Maps a stack, as a tuple of (filename, function name) pairs
+        # from outermost to innermost, to the number of samples of it.
+        self.stacks = {}
+
+    def attach(self, sandbox):
+        """
+        Makes the given sandbox call this profiler from its operation
+        callback, and makes the callback fire at the sampling rate.
+        """
+
+        sandbox.profiler = self
+        sandbox.check_interval = min(sandbox.check_interval,
+                                     1.0 / self.rate)
+
+    def sample(self, cx):
+        frames = [(filename, name or '<anonymous>')
+                  for filename, lineno, name
+                  in iter_stack_frames(cx.get_stack())]
+        if not frames:
+            return
+        frames.reverse()
+        stack = tuple(frames)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def function_counts(self):
+        """
+        Returns a dict mapping each (filename, function name) pair to
+        a (self, total) tuple of sample counts.
+        """
+
+        counts = {}
+        for stack, count in self.stacks.iteritems():
+            for frame in set(stack):
+                self_count, total_count = counts.get(frame, (0, 0))
+                counts[frame] = (self_count, total_count + count)
+            leaf = stack[-1]
+            self_count, total_count = counts[leaf]
+            counts[leaf] = (self_count + count, total_count)
+        return counts
+
+    def write_collapsed(self, stream):
+        """
+        Writes the samples in the collapsed-stack format read by
+        flamegraph.pl: one line per stack, with semicolon-separated
+        frames followed by a sample count.
+        """
+
+        lines = []
+        for stack, count in self.stacks.iteritems():
+            frames = ['%s (%s)' % (name, filename)
+                      for filename, name in stack]
+            lines.append('%s %d' % (';'.join(frames), count))
+        lines.sort()
+        for line in lines:
+            stream.write(line + '\n')
+
+    def write_report(self, stream, top=DEFAULT_TOP):
+        """
+        Writes a table of the 'top' functions with the most self
+        samples, followed by the 'top' functions with the most total
+        samples.
+        """
+
+        counts = self.function_counts().items()
+        total = float(max(self.samples, 1))
+        interval_ms = 1000.0 / self.rate
+
+        stream.write('%d samples at %d Hz (%.1f ms of JS)\n' %
+                     (self.samples, self.rate,
+                      self.samples * interval_ms))
+        for title, index in (('self', 0), ('total', 1)):
+            stream.write('\nTop %d functions by %s samples:\n' %
+                         (top, title))
+            stream.write('%8s %7s %8s %7s  %s\n' %
+                         ('self', '%', 'total', '%', 'function'))
+            counts.sort(key=lambda item: (-item[1][index], item[0]))
+            for (filename, name), (self_count, total_count) in counts[:top]:
+                stream.write('%8d %6.2f%% %8d %6.2f%%  %s (%s)\n' %
+                             (self_count, self_count * 100 / total,
+                              total_count, total_count * 100 / total,
+                              name, filename))
+
+    def write(self, prefix):
+        """
+        Writes the collapsed stacks to '<prefix>.collapsed' and the
+        text report to '<prefix>.txt', returning the two filenames.
+        """
+
+        collapsed = prefix + '.collapsed'
+        report = prefix + '.txt'
+        stream = open(collapsed, 'w')
+        try:
+            self.write_collapsed(stream)
+        finally:
+            stream.close()
+        stream = open(report, 'w')
+        try:
+            self.write_report(stream)
+        finally:
+            stream.close()
+        return collapsed, report
+
+def default_prefix():
+    return 'narwhal-profile.%d' % os.getpid()
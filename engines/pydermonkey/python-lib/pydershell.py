@@ -1,60 +1,108 @@
+import os
 import sys
+import gc
 import time
+import heapq
+import itertools
 import threading
+import linecache
 import traceback
 import weakref
 import types
+import hashlib
+import collections
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
 import pydermonkey
 
 class ContextWatchdogThread(threading.Thread):
     """
-    Watches active JS contexts and triggers their operation callbacks
-    at a regular interval.
+    Triggers the operation callbacks of JS contexts at scheduled
+    deadlines.
+
+    Deadlines are kept in a heap, so the thread only wakes up when the
+    earliest one is due, and sleeps until something is scheduled when
+    there are none.
     """
 
-    # Default interval, in seconds, that the operation callbacks are
-    # triggered at.
+    # Default interval, in seconds, at which the operation callbacks
+    # of running contexts are triggered.
     DEFAULT_INTERVAL = 0.25
 
     def __init__(self, interval=DEFAULT_INTERVAL):
         threading.Thread.__init__(self)
-        self._lock = threading.Lock()
-        self._stop = threading.Event()
-        self._contexts = []
+        self._cond = threading.Condition()
+        self._stop = False
+        self._deadlines = []
+        self._counter = itertools.count()
         self.interval = interval
         self.setDaemon(True)
 
-    def add_context(self, cx):
-        self._lock.acquire()
+    def schedule(self, cx, deadline):
+        """
+        Schedules the operation callback of the given context to be
+        triggered at 'deadline', as returned by time.time().
+        """
+
+        self._cond.acquire()
         try:
-            self._contexts.append(weakref.ref(cx))
+            entry = (deadline, self._counter.next(), weakref.ref(cx))
+            heapq.heappush(self._deadlines, entry)
+            if self._deadlines[0] is entry:
+                self._cond.notify()
         finally:
-            self._lock.release()
+            self._cond.release()
 
     def join(self):
-        self._stop.set()
+        self._cond.acquire()
+        try:
+            self._stop = True
+            self._cond.notify()
+        finally:
+            self._cond.release()
         threading.Thread.join(self)
 
     def run(self):
-        while not self._stop.isSet():
-            time.sleep(self.interval)
-            new_list = []
-            self._lock.acquire()
-            try:
-                for weakcx in self._contexts:
-                    cx = weakcx()
+        self._cond.acquire()
+        try:
+            while not self._stop:
+                now = time.time()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    cx = heapq.heappop(self._deadlines)[2]()
                     if cx:
-                        new_list.append(weakcx)
                         cx.trigger_operation_callback()
-                self._contexts = new_list
-            finally:
-                self._lock.release()
+                if self._deadlines:
+                    self._cond.wait(self._deadlines[0][0] - now)
+                else:
+                    self._cond.wait()
+        finally:
+            self._cond.release()
 
 # Create a global watchdog.
 watchdog = ContextWatchdogThread()
 watchdog.start()
 
+def get_watchdog():
+    """
+    Returns the global watchdog.
+    """
+
+    return watchdog
+
+def reinit_after_fork():
+    """
+    Re-creates the global watchdog in a newly forked child process,
+    since the watchdog's thread doesn't survive a fork().
+    """
+
+    global watchdog
+    watchdog = ContextWatchdogThread()
+    watchdog.start()
+
 class InternalError(BaseException):
     """
     Represents an error in a JS-wrapped Python function that wasn't
@@ -67,12 +115,55 @@ class InternalError(BaseException):
         BaseException.__init__(self)
         self.exc_info = sys.exc_info()
 
+class ScriptTimeoutError(BaseException):
+    """
+    Raised when a sandbox exceeds one of its execution budgets.
+    'reason' is one of 'time', 'cpu', 'operations' or 'memory'.
+
+    Like InternalError, it's derived from BaseException so that it
+    unrolls the whole JS/Python stack, and can only be caught by the
+    Python code that started the script.
+    """
+
+    def __init__(self, reason, limit):
+        BaseException.__init__(self, reason, limit)
+        self.reason = reason
+        self.limit = limit
+
+    def __str__(self):
+        return "script exceeded its %s limit of %s" % (self.reason,
+                                                      self.limit)
+
+def _cpu_time():
+    # This is the CPU time of the whole process, since Python doesn't
+    # give the CPU time of a single thread.
+    times = os.times()
+    return times[0] + times[1]
+
+def memory_usage():
+    """
+    Returns the resident set size of this process in bytes, or its
+    peak size if the current one isn't available, in which case it
+    never goes down.
+    """
+
+    try:
+        statm = open('/proc/self/statm').read().split()
+        return int(statm[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # It's in bytes on Mac OS X, and in kilobytes elsewhere.
+        if sys.platform == 'darwin':
+            return maxrss
+        return maxrss * 1024
+
 class SafeJsObjectWrapper(object):
     """
     Securely wraps a JS object to behave like any normal Python object.
     """
 
-    __slots__ = ['_jsobject', '_sandbox', '_this']
+    __slots__ = ['_jsobject', '_sandbox', '_this', '__weakref__']
 
     def __init__(self, sandbox, jsobject, this):
         if not isinstance(jsobject, pydermonkey.Object):
@@ -149,7 +240,15 @@ class SafeJsFunctionWrapper(SafeJsObjectWrapper):
         SafeJsObjectWrapper.__init__(self, sandbox, jsfunction, this)
 
     def __call__(self, *args):
-        cx = self._sandbox.cx
+        call_function = self._sandbox.cx.call_function
+        stats = self._sandbox.call_stats
+        if stats is None:
+            return self.__call(call_function, args)
+        call = stats.wrap_call('js', js_function_name(self._jsobject),
+                               self.__call)
+        return call(stats.wrap_callee(call_function), args)
+
+    def __call(self, call_function, args):
         jsobject = self._jsobject
         this = self._this
 
@@ -157,40 +256,77 @@ class SafeJsFunctionWrapper(SafeJsObjectWrapper):
         for arg in args:
             arglist.append(self._wrap_to_js(arg))
 
-        obj = cx.call_function(this, jsobject, tuple(arglist))
+        self._sandbox._enter()
+        try:
+            obj = call_function(this, jsobject, tuple(arglist))
+        finally:
+            self._sandbox._leave()
         return self._wrap_to_python(obj)
 
-def format_stack(js_stack):
+def capture_py_stack(frame):
     """
-    Returns a formatted Python-esque stack traceback of the given
-    JS stack.
+    Records the code object and current line of the given Python
+    frame and each of its callers, oldest first, without keeping the
+    frames or their locals alive.
     """
 
-    STACK_LINE  ="  File \"%(filename)s\", line %(lineno)d, in %(name)s"
+    captured = []
+    while frame is not None:
+        captured.append((frame.f_code, frame.f_lineno))
+        frame = frame.f_back
+    captured.reverse()
+    return captured
+
+def extract_py_stack(captured):
+    """
+    Turns a stack recorded by capture_py_stack() into a list of
+    (filename, lineno, name, line) tuples, like those returned by
+    traceback.extract_stack().
+    """
+
+    stack = []
+    for code, lineno in captured:
+        filename = code.co_filename
+        linecache.checkcache(filename)
+        line = linecache.getline(filename, lineno)
+        stack.append((filename, lineno, code.co_name,
+                      line.strip() or None))
+    return stack
+
+def iter_stack_frames(js_stack):
+    """
+    Yields a (filename, lineno, name) tuple for each JS frame of the
+    given stack, innermost first, skipping frames of Python functions.
+    """
 
-    lines = []
     while js_stack:
         script = js_stack['script']
         function = js_stack['function']
         if script:
-            frameinfo = dict(filename = script.filename,
-                             lineno = js_stack['lineno'],
-                             name = '<module>')
+            yield (script.filename, js_stack['lineno'], '<module>')
         elif function and not function.is_python:
-            frameinfo = dict(filename = function.filename,
-                             lineno = js_stack['lineno'],
-                             name = function.name)
-        else:
-            frameinfo = None
-        if frameinfo:
-            lines.insert(0, STACK_LINE % frameinfo)
-            try:
-                filelines = open(frameinfo['filename']).readlines()
-                line = filelines[frameinfo['lineno'] - 1].strip()
-                lines.insert(1, "    %s" % line)
-            except Exception:
-                pass
+            yield (function.filename, js_stack['lineno'], function.name)
         js_stack = js_stack['caller']
+
+def format_stack(js_stack):
+    """
+    Returns a formatted Python-esque stack traceback of the given
+    JS stack.
+    """
+
+    STACK_LINE  ="  File \"%s\", line %d, in %s"
+
+    lines = []
+    checked = set()
+    for filename, lineno, name in iter_stack_frames(js_stack):
+        lines.insert(0, STACK_LINE % (filename, lineno, name))
+        if filename not in checked:
+            # Make sure we don't show lines from an outdated copy.
+            linecache.checkcache(filename)
+            checked.add(filename)
+        line = linecache.getline(filename, lineno).strip()
+        if line:
+            lines.insert(1, "    %s" % line)
     lines.insert(0, "Traceback (most recent call last):")
     return '\n'.join(lines)
 
@@ -227,29 +363,414 @@ class JsExposedObject(object):
 
     pass
 
+class CallStats(object):
+    """
+    Collects call counts and latencies of calls that cross between
+    Python and JS: 'py' calls are exposed Python functions called from
+    JS, and 'js' calls are JS functions called from Python.
+
+    For each function, the time spent converting arguments and return
+    values is recorded separately from the time spent in the callee.
+    """
+
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        # Maps a (direction, name) pair to a [calls, total, max,
+        # marshal] list of counts and seconds.
+        self.entries = {}
+        # Callee time of each instrumented call in progress, innermost
+        # last.
+        self.__callee_times = []
+
+    def record(self, direction, name, elapsed, marshal):
+        key = (direction, name)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [0, 0.0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        if elapsed > entry[2]:
+            entry[2] = elapsed
+        entry[3] += marshal
+
+    def wrap_call(self, direction, name, function):
+        """
+        Returns a function that calls 'function' and records how long
+        it took; the time reported by the innermost wrap_callee()
+        function it calls is recorded as callee time, and the rest as
+        marshalling time.
+        """
+
+        timer = self.timer
+        callee_times = self.__callee_times
+        record = self.record
+
+        def instrumented(*args):
+            callee_times.append(0.0)
+            start = timer()
+            try:
+                return function(*args)
+            finally:
+                elapsed = timer() - start
+                record(direction, name, elapsed,
+                       elapsed - callee_times.pop())
+        return instrumented
+
+    def wrap_callee(self, function):
+        timer = self.timer
+        callee_times = self.__callee_times
+
+        def callee(*args):
+            start = timer()
+            try:
+                return function(*args)
+            finally:
+                callee_times[-1] += timer() - start
+        return callee
+
+    def snapshot(self):
+        """
+        Returns a list with a dictionary for each function that has
+        been called, with the most expensive functions first. Times
+        are in seconds.
+        """
+
+        result = []
+        for (direction, name), entry in self.entries.iteritems():
+            calls, total, max_time, marshal = entry
+            result.append(dict(direction = direction,
+                               name = name,
+                               calls = calls,
+                               total = total,
+                               mean = total / calls,
+                               max = max_time,
+                               marshal = marshal))
+        result.sort(key=lambda info: (-info['total'], info['name']))
+        return result
+
+    def clear(self):
+        self.entries.clear()
+
+    def write_report(self, stream):
+        stream.write('%-3s %8s %10s %9s %9s %10s  %s\n' %
+                     ('dir', 'calls', 'total ms', 'mean us', 'max ms',
+                      'marshal ms', 'function'))
+        for info in self.snapshot():
+            stream.write('%-3s %8d %10.2f %9.1f %9.2f %10.2f  %s\n' %
+                         (info['direction'], info['calls'],
+                          info['total'] * 1000, info['mean'] * 1000000,
+                          info['max'] * 1000, info['marshal'] * 1000,
+                          info['name']))
+
+def js_function_name(jsfunction):
+    """
+    Returns a name identifying the given JS function in reports.
+    """
+
+    name = jsfunction.name or '<anonymous>'
+    if jsfunction.filename:
+        return '%s (%s)' % (name, jsfunction.filename)
+    return name
+
+class LruCache(object):
+    """
+    A mapping that holds at most 'max_entries' items, evicting the
+    least recently used one when it's full.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        # Kept in the order the entries were last used in.
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            return default
+        self._entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def values(self):
+        return self._entries.values()
+
+    def clear(self):
+        self._entries.clear()
+
+class ScriptCache(object):
+    """
+    Caches compiled JS scripts so that the same source isn't parsed
+    and compiled more than once.
+
+    Entries are keyed by an arbitrary hashable key, which is usually
+    a tuple containing a script's real path, its mtime, any wrapper
+    prefix that was added to its source and the digest() of the code.
+    Compiled scripts are kept in memory, evicting the least recently
+    used entry once 'max_entries' is exceeded.
+
+    If 'cache_dir' is given and the pydermonkey build supports script
+    serialization, compiled scripts are also persisted to disk so
+    they can be reused by later processes.
+    """
+
+    # Default maximum number of compiled scripts kept in memory.
+    DEFAULT_MAX_ENTRIES = 512
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries = LruCache(max_entries)
+
+    @staticmethod
+    def can_serialize(cx):
+        """
+        Returns whether the given context is able to serialize and
+        deserialize compiled scripts.
+        """
+
+        return (hasattr(cx, 'serialize_script') and
+                hasattr(cx, 'deserialize_script'))
+
+    @staticmethod
+    def digest(code):
+        """
+        Returns a digest of the given source code, for use in cache
+        keys, so that an edit which keeps a file's mtime and length
+        still changes its key.
+        """
+
+        if isinstance(code, unicode):
+            code = code.encode('utf-8')
+        return hashlib.sha1(code).hexdigest()
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.jsc')
+
+    def _load_from_disk(self, cx, key):
+        if not (self.cache_dir and self.can_serialize(cx)):
+            return None
+        try:
+            data = open(self._disk_path(key), 'rb').read()
+            return cx.deserialize_script(data)
+        except Exception:
+            return None
+
+    def _save_to_disk(self, cx, key, script):
+        if not (self.cache_dir and self.can_serialize(cx)):
+            return
+        path = self._disk_path(key)
+        tmp_path = '%s.%d' % (path, os.getpid())
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            f = open(tmp_path, 'wb')
+            try:
+                f.write(cx.serialize_script(script))
+            finally:
+                f.close()
+            os.rename(tmp_path, path)
+        except Exception:
+            # The disk cache is purely an optimization, so just
+            # ignore any problems writing to it.
+            pass
+
+    def compile(self, cx, obj, key, code, filename, lineno):
+        """
+        Returns the compiled script for the given key, compiling
+        'code' and caching the result if it's not already cached.
+        """
+
+        script = self._entries.get(key)
+        if script is not None:
+            self.hits += 1
+            return script
+
+        script = self._load_from_disk(cx, key)
+        if script is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            script = cx.compile_script(obj, code, filename, lineno)
+            self._save_to_disk(cx, key, script)
+        self._entries[key] = script
+        return script
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """
+        Returns a dictionary of cache statistics.
+        """
+
+        return dict(entries = len(self._entries),
+                    hits = self.hits,
+                    disk_hits = self.disk_hits,
+                    misses = self.misses)
+
+# JS functions used to move plain data across the JS/Python boundary
+# as a single JSON string. stringify() returns null if the value isn't
+# plain data, or has more than 'maxItems' values in it. They're given
+# the runtime's native JSON object, since scripts may replace the
+# global one.
+MARSHAL_HELPERS_JS = """
+(function (JSON) { return {
+  stringify: function stringify(value, maxItems) {
+    var plain = true;
+    var count = 0;
+    var replacer = function (key, value) {
+      if (++count > maxItems)
+        plain = false;
+      switch (typeof value) {
+      case "function":
+      case "undefined":
+        plain = false;
+        break;
+      case "number":
+        if (!isFinite(value))
+          plain = false;
+        break;
+      case "object":
+        if (value !== null) {
+          var proto = Object.getPrototypeOf(value);
+          if (proto !== Object.prototype && proto !== Array.prototype)
+            plain = false;
+        }
+      }
+      return plain ? value : undefined;
+    };
+    var text;
+    try {
+      text = JSON.stringify(value, replacer);
+    } catch (e) {
+      // It has a cycle in it.
+      return null;
+    }
+    return plain ? text : null;
+  },
+  parse: function parse(text) {
+    return JSON.parse(text);
+  },
+  isArray: function isArray(value) {
+    return Object.prototype.toString.call(value) === "[object Array]";
+  }
+}; })
+"""
+
 class JsSandbox(object):
     """
     A JS runtime and associated functionality capable of securely
     loading and executing scripts.
+
+    'time_limit' and 'cpu_limit' are optional budgets, in seconds, of
+    wall-clock and CPU time that each top-level call into JS may use;
+    'operation_limit' is an optional maximum number of times the
+    operation callback may be triggered during such a call. Exceeding
+    any of them raises a ScriptTimeoutError.
+
+    The CPU time is that of the whole process, so a sandbox is charged
+    for whatever other threads, and sandboxes running on them, use
+    while it runs. The operation callback is triggered every
+    'check_interval' seconds, so 'operation_limit' is a budget of
+    those intervals rather than of JS operations, and a profiler that
+    lowers the interval makes it run out sooner.
+
+    'memory_limit' is an optional budget, in bytes, of how far the
+    whole process may grow while the sandbox runs JS; it isn't a limit
+    on the JS heap, which can't be measured directly. The growth of
+    the resident set is attributed to the sandbox, including Python
+    objects made on its behalf and whatever other threads allocate
+    meanwhile, and where only the peak resident set is known it's a
+    high-water mark that memory freed later never comes back off.
+    It's checked from the operation callback, garbage collecting once
+    before a ScriptTimeoutError is raised. If the sandbox creates its
+    own runtime and the runtime can set GC parameters, the JS heap is
+    also capped at 'memory_limit' bytes with JSGC_MAX_BYTES.
+
+    maybe_gc() collects garbage once the process has grown by
+    'gc_threshold' bytes since the last collection, and is meant to be
+    called when the program is idle.
+
+    If 'call_stats' is a CallStats, calls between Python and JS are
+    recorded in it; otherwise they aren't instrumented at all.
     """
 
-    def __init__(self, watchdog=watchdog):
-        rt = pydermonkey.Runtime()
+    # Default number of bytes the process may grow by before
+    # maybe_gc() collects garbage.
+    DEFAULT_GC_THRESHOLD = 8 * 1024 * 1024
+
+    def __init__(self, watchdog=None, script_cache=None, runtime=None,
+                 time_limit=None, cpu_limit=None, operation_limit=None,
+                 call_stats=None, memory_limit=None,
+                 gc_threshold=DEFAULT_GC_THRESHOLD):
+        if watchdog is None:
+            watchdog = get_watchdog()
+        if runtime is None:
+            runtime = pydermonkey.Runtime()
+            # A runtime of our own can have its heap capped without
+            # affecting anyone else's sandboxes.
+            if (memory_limit is not None and
+                hasattr(runtime, 'set_gc_parameter')):
+                runtime.set_gc_parameter('JSGC_MAX_BYTES', memory_limit)
+        rt = runtime
         cx = rt.new_context()
         root = cx.new_object()
         cx.init_standard_classes(root)
 
         cx.set_operation_callback(self._opcb)
         cx.set_throw_hook(self._throwhook)
-        watchdog.add_context(cx)
 
         self.rt = rt
         self.cx = cx
+        self.watchdog = watchdog
+        self.time_limit = time_limit
+        self.cpu_limit = cpu_limit
+        self.operation_limit = operation_limit
+        self.operation_count = 0
+        self.memory_limit = memory_limit
+        self.gc_threshold = gc_threshold
+        # Bytes that the sandbox's scripts have added to the process,
+        # as far as can be told, which is only tracked if there's a
+        # memory limit, and the number of garbage collections.
+        self.memory_used = 0
+        self.gc_count = 0
+        self.__start_memory = None
+        self.__gc_memory = memory_usage()
+        # Seconds between operation callbacks while JS is running.
+        self.check_interval = watchdog.interval
+        # An optional object whose sample(cx) method is called from
+        # each operation callback, such as a SamplingProfiler.
+        self.profiler = None
+        self.call_stats = call_stats
+        self.__depth = 0
+        self.__start_time = None
+        self.__start_cpu = None
+        self.__next_check = None
         self.curr_exc = None
-        self.py_stack = None
         self.js_stack = None
-        self.__py_to_js = {}
+        self.__py_captured = None
+        self.__py_stack = None
+        self.__owns_script_cache = script_cache is None
+        if script_cache is None:
+            script_cache = ScriptCache()
+        self.script_cache = script_cache
         self.__type_protos = {}
+        self.__marshal_helpers = None
+        self.__native_json = cx.get_property(root, 'JSON')
+        self.__init_wrapper_caches(root)
         self.root = self.wrap_jsobject(root, root)
 
     def finish(self):
@@ -260,37 +781,244 @@ class JsSandbox(object):
         http://code.google.com/p/pydermonkey/issues/detail?id=2
         """
 
-        for jsobj in self.__py_to_js.values():
+        for jsobj in list(self.__private_jsobjects):
             self.cx.clear_object_private(jsobj)
+        del self.__marshal_helpers
+        del self.__native_json
+        self.__js_to_py.clear()
+        del self.__private_jsobjects
+        del self.__weak_jsobjects
         del self.__py_to_js
+        del self.__js_to_py
+        del self.__pyobject_handlers
         del self.__type_protos
+        if self.__owns_script_cache:
+            self.script_cache.clear()
+        del self.script_cache
         del self.curr_exc
-        del self.py_stack
         del self.js_stack
+        del self.__py_captured
+        del self.__py_stack
         del self.cx
         del self.rt
 
+    def __init_wrapper_caches(self, root):
+        try:
+            weakref.ref(root)
+            self.__weak_jsobjects = True
+        except TypeError:
+            self.__weak_jsobjects = False
+
+        # The JS functions wrapping Python callables, whose privates
+        # refer back to the sandbox, so finish() must clear them to
+        # break the reference cycles of pydermonkey issue #2. The
+        # privates of wrapped instances don't, so they aren't kept,
+        # and go along with their JS objects.
+        if self.__weak_jsobjects:
+            self.__private_jsobjects = weakref.WeakSet()
+        else:
+            self.__private_jsobjects = set()
+
+        # Python objects exposed to JS, mapped to their JS
+        # counterparts for as long as those are referenced from
+        # Python. If this build of pydermonkey can't weakly reference
+        # JS objects, only callables are looked up, since the lookup
+        # would keep every instance alive.
+        if self.__weak_jsobjects:
+            self.__py_to_js = weakref.WeakValueDictionary()
+        else:
+            self.__py_to_js = {}
+
+        # Wrappers of JS objects, keyed by the object and its 'this'.
+        self.__js_to_py = weakref.WeakValueDictionary()
+
+        # Types of Python objects, mapped to the functions that expose
+        # them to JS.
+        self.__pyobject_handlers = {}
+
+        self.py_hits = 0
+        self.py_misses = 0
+        self.js_hits = 0
+        self.js_misses = 0
+
+    def __remember_pycallable(self, func, jsfunc):
+        self.__private_jsobjects.add(jsfunc)
+        self.__py_to_js[func] = jsfunc
+
+    def __remember_pyinstance(self, value, jsobj):
+        if self.__weak_jsobjects:
+            self.__py_to_js[value] = jsobj
+
+    def __lookup_pyobject(self, value):
+        jsobj = self.__py_to_js.get(value)
+        if jsobj is None:
+            self.py_misses += 1
+        else:
+            self.py_hits += 1
+        return jsobj
+
+    def wrapper_stats(self):
+        """
+        Returns a dictionary describing the size and effectiveness of
+        the caches that map objects between Python and JS.
+        """
+
+        return dict(py_objects = len(self.__py_to_js),
+                    py_privates = len(self.__private_jsobjects),
+                    py_hits = self.py_hits,
+                    py_misses = self.py_misses,
+                    js_wrappers = len(self.__js_to_py),
+                    js_hits = self.js_hits,
+                    js_misses = self.js_misses)
+
+    def memory_stats(self):
+        """
+        Returns a dictionary describing the memory used by the process
+        and attributed to the sandbox, and the number of objects the
+        sandbox keeps to map objects between Python and JS.
+        """
+
+        return dict(rss = memory_usage(),
+                    memory_used = self.memory_used,
+                    memory_limit = self.memory_limit,
+                    gc_count = self.gc_count,
+                    py_objects = len(self.__py_to_js),
+                    py_privates = len(self.__private_jsobjects),
+                    type_protos = len(self.__type_protos),
+                    js_wrappers = len(self.__js_to_py))
+
+    def collect_garbage(self):
+        """
+        Runs the JS garbage collector, and Python's, since wrappers
+        can keep JS objects alive through reference cycles.
+        """
+
+        before = memory_usage()
+        self.cx.gc()
+        gc.collect()
+        after = memory_usage()
+        self.memory_used = max(0, self.memory_used - (before - after))
+        self.gc_count += 1
+        self.__gc_memory = after
+
+    def maybe_gc(self):
+        """
+        Collects garbage if the process has grown by 'gc_threshold'
+        bytes since the last collection, returning whether it did.
+        """
+
+        if self.__depth or memory_usage() - self.__gc_memory < \
+               self.gc_threshold:
+            return False
+        self.collect_garbage()
+        return True
+
+    def __check_memory(self):
+        used = self.memory_used + memory_usage() - self.__start_memory
+        if used < self.memory_limit:
+            return
+        # The garbage may be all that's over the limit.
+        self.collect_garbage()
+        used = self.memory_used + memory_usage() - self.__start_memory
+        if used >= self.memory_limit:
+            raise ScriptTimeoutError('memory', self.memory_limit)
+
+    def __schedule_check(self, now):
+        deadline = now + self.check_interval
+        if self.time_limit is not None:
+            deadline = min(deadline, self.__start_time + self.time_limit)
+        if self.__next_check is None or deadline < self.__next_check:
+            self.__next_check = deadline
+            self.watchdog.schedule(self.cx, deadline)
+
+    def _enter(self):
+        self.__depth += 1
+        if self.__depth == 1:
+            now = time.time()
+            self.__start_time = now
+            if self.cpu_limit is not None:
+                self.__start_cpu = _cpu_time()
+            self.operation_count = 0
+            if self.memory_limit is not None:
+                self.__start_memory = memory_usage()
+            self.__schedule_check(now)
+
+    def _leave(self):
+        self.__depth -= 1
+        if not self.__depth and self.memory_limit is not None:
+            growth = memory_usage() - self.__start_memory
+            self.memory_used = max(0, self.memory_used + growth)
+
     def _opcb(self, cx):
-        # Don't do anything; if a keyboard interrupt was triggered,
-        # it'll get raised here automatically.
-        pass
+        # If a keyboard interrupt was triggered, it'll get raised here
+        # automatically.
+        self.__next_check = None
+        if not self.__depth:
+            return
+        self.operation_count += 1
+        now = time.time()
+        if (self.time_limit is not None and
+            now - self.__start_time >= self.time_limit):
+            raise ScriptTimeoutError('time', self.time_limit)
+        if (self.cpu_limit is not None and
+            _cpu_time() - self.__start_cpu >= self.cpu_limit):
+            raise ScriptTimeoutError('cpu', self.cpu_limit)
+        if (self.operation_limit is not None and
+            self.operation_count > self.operation_limit):
+            raise ScriptTimeoutError('operations', self.operation_limit)
+        if self.memory_limit is not None:
+            self.__check_memory()
+        if self.profiler is not None:
+            self.profiler.sample(cx)
+        self.__schedule_check(now)
 
     def _throwhook(self, cx):
         curr_exc = cx.get_pending_exception()
         if self.curr_exc != curr_exc:
+            # Most exceptions are caught by JS code, so only record
+            # the code and line of each Python frame; the source lines
+            # are only looked up if someone asks for them.
             self.curr_exc = curr_exc
-            self.py_stack = traceback.extract_stack()
+            self.__py_captured = capture_py_stack(sys._getframe(1))
+            self.__py_stack = None
             self.js_stack = cx.get_stack()
 
+    @property
+    def native_json(self):
+        """
+        The runtime's own JSON object, as it was when the sandbox was
+        created, or undefined if it has none. Scripts may replace the
+        global one.
+        """
+
+        return self.wrap_jsobject(self.__native_json)
+
+    @property
+    def py_stack(self):
+        """
+        The Python stack at the time the most recent JS exception was
+        thrown, in the form returned by traceback.extract_stack().
+        """
+
+        if self.__py_stack is None and self.__py_captured is not None:
+            self.__py_stack = extract_py_stack(self.__py_captured)
+        return self.__py_stack
+
     def __wrap_pycallable(self, func, pyproto=None):
-        if func in self.__py_to_js:
-            return self.__py_to_js[func]
+        jsfunc = self.__lookup_pyobject(func)
+        if jsfunc is not None:
+            return jsfunc
 
         if hasattr(func, '__name__'):
             name = func.__name__
         else:
             name = ""
 
+        stats = self.call_stats
+        call = func
+        if stats is not None:
+            call = stats.wrap_callee(func)
+
         if pyproto:
             def wrapper(func_cx, this, args):
                 try:
@@ -304,7 +1032,7 @@ class JsSandbox(object):
                     # TODO: Fill in extra required params with
                     # pymonkey.undefined?  or automatically throw an
                     # exception to calling js code?
-                    return self.wrap_pyobject(func(instance, *arglist))
+                    return self.wrap_pyobject(call(instance, *arglist))
                 except pydermonkey.error:
                     raise
                 except Exception:
@@ -319,20 +1047,30 @@ class JsSandbox(object):
                     # TODO: Fill in extra required params with
                     # pymonkey.undefined?  or automatically throw an
                     # exception to calling js code?
-                    return self.wrap_pyobject(func(*arglist))
+                    return self.wrap_pyobject(call(*arglist))
                 except pydermonkey.error:
                     raise
                 except Exception:
                     raise InternalError()
+        if stats is not None:
+            if pyproto:
+                label = '%s.%s' % (pyproto.__name__, name)
+            else:
+                label = name or repr(func)
+            wrapper = stats.wrap_call('py', label, wrapper)
         wrapper.wrapped_pyobject = func
         wrapper.__name__ = name
 
         jsfunc = self.cx.new_function(wrapper, name)
-        self.__py_to_js[func] = jsfunc
+        self.__remember_pycallable(func, jsfunc)
 
         return jsfunc
 
     def __wrap_pyinstance(self, value):
+        jsobj = self.__lookup_pyobject(value)
+        if jsobj is not None:
+            return jsobj
+
         pyproto = type(value)
         if pyproto not in self.__type_protos:
             jsproto = self.cx.new_object()
@@ -370,35 +1108,60 @@ class JsSandbox(object):
                     jsmethod = self.__wrap_pycallable(attr, pyproto)
                     self.cx.define_property(jsproto, name, jsmethod)
             self.__type_protos[pyproto] = jsproto
-        return self.cx.new_object(value, self.__type_protos[pyproto])
+        jsobj = self.cx.new_object(value, self.__type_protos[pyproto])
+        self.__remember_pyinstance(value, jsobj)
+        return jsobj
 
-    def wrap_pyobject(self, value):
-        """
-        Wraps the given Python object for export to untrusted JS.
+    def __wrap_pyprimitive(self, value):
+        return value
 
-        If the Python object isn't of a type that can be exposed to JS,
-        a TypeError is raised.
-        """
+    def __wrap_pylong(self, value):
+        # JS numbers are all doubles.
+        return float(value)
 
+    def __unwrap_jsobject_wrapper(self, value):
+        # It's already wrapped, just unwrap it.
+        return value.wrapped_jsobject
+
+    def __wrap_exposed_pycallable(self, value):
+        if not (hasattr(value, '__jsexposed__') and
+                value.__jsexposed__):
+            raise ValueError("Callable isn't configured for exposure "
+                             "to untrusted JS code")
+        return self.__wrap_pycallable(value)
+
+    def __find_pyobject_handler(self, value):
         if (isinstance(value, (int, basestring, float, bool)) or
             value is pydermonkey.undefined or
             value is None):
-            return value
+            return self.__wrap_pyprimitive
+        if isinstance(value, long):
+            return self.__wrap_pylong
         if isinstance(value, SafeJsObjectWrapper):
-            # It's already wrapped, just unwrap it.
-            return value.wrapped_jsobject
+            return self.__unwrap_jsobject_wrapper
         elif callable(value):
-            if not (hasattr(value, '__jsexposed__') and
-                    value.__jsexposed__):
-                raise ValueError("Callable isn't configured for exposure "
-                                 "to untrusted JS code")
-            return self.__wrap_pycallable(value)
+            return self.__wrap_exposed_pycallable
         elif isinstance(value, JsExposedObject):
-            return self.__wrap_pyinstance(value)
+            return self.__wrap_pyinstance
         else:
             raise TypeError("Can't expose objects of type '%s' to JS." %
                             type(value).__name__)
 
+    def wrap_pyobject(self, value):
+        """
+        Wraps the given Python object for export to untrusted JS.
+
+        If the Python object isn't of a type that can be exposed to JS,
+        a TypeError is raised.
+        """
+
+        pytype = type(value)
+        handler = self.__pyobject_handlers.get(pytype)
+        if handler is None:
+            handler = self.__find_pyobject_handler(value)
+            self.__pyobject_handlers[pytype] = handler
+        return handler(value)
+
     def wrap_jsobject(self, jsvalue, this=None):
         """
         Wraps the given pydermonkey.Object for import to trusted
@@ -412,7 +1175,7 @@ class JsSandbox(object):
             if jsvalue.is_python:
                 # It's a Python function, just unwrap it.
                 return self.cx.get_object_private(jsvalue).wrapped_pyobject
-            return SafeJsFunctionWrapper(self, jsvalue, this)
+            wrapper_class = SafeJsFunctionWrapper
         elif isinstance(jsvalue, pydermonkey.Object):
             # It's a wrapped Python object instance, just unwrap it.
             instance = self.cx.get_object_private(jsvalue)
@@ -421,17 +1184,27 @@ class JsSandbox(object):
                     raise AssertionError("Object private is not of type "
                                          "JsExposedObject")
                 return instance
-            else:
-                return SafeJsObjectWrapper(self, jsvalue, this)
+            wrapper_class = SafeJsObjectWrapper
         else:
             # It's a primitive value.
             return jsvalue
 
+        key = (jsvalue, this)
+        wrapper = self.__js_to_py.get(key)
+        if wrapper is None:
+            self.js_misses += 1
+            wrapper = wrapper_class(self, jsvalue, this)
+            self.__js_to_py[key] = wrapper
+        else:
+            self.js_hits += 1
+        return wrapper
+
     def new_array(self, *contents):
-        array = self.wrap_jsobject(self.cx.new_array_object())
-        for item in contents:
-            array.push(item)
-        return array
+        array = self.cx.new_array_object()
+        if contents:
+            self.__push(array, [self.wrap_pyobject(item)
+                                for item in contents])
+        return self.wrap_jsobject(array)
 
     def new_object(self, **contents):
         obj = self.wrap_jsobject(self.cx.new_object())
@@ -439,9 +1212,215 @@ class JsSandbox(object):
             obj[name] = contents[name]
         return obj
 
-    def evaluate(self, code, filename='<string>', lineno=1):
-        retval = self.cx.evaluate_script(self.root.wrapped_jsobject,
-                                         code, filename, lineno)
+    # Default limits on the structures converted by to_js() and to_py().
+    DEFAULT_MAX_DEPTH = 64
+    DEFAULT_MAX_ITEMS = 1000000
+
+    def __push(self, array, jsvalues):
+        # Appends all the values with a single call into JS.
+        push = self.cx.get_property(array, 'push')
+        self.cx.call_function(array, push, tuple(jsvalues))
+
+    def __get_marshal_helpers(self):
+        if self.__marshal_helpers is None:
+            cx = self.cx
+            root = self.root.wrapped_jsobject
+            make_helpers = cx.evaluate_script(root, MARSHAL_HELPERS_JS,
+                                              '<marshal>', 1)
+            helpers = cx.call_function(root, make_helpers,
+                                       (self.__native_json,))
+            self.__marshal_helpers = dict(
+                (name, cx.get_property(helpers, name))
+                for name in ('stringify', 'parse', 'isArray')
+                )
+        return self.__marshal_helpers
+
+    def __call_marshal_helper(self, name, *args):
+        helper = self.__get_marshal_helpers()[name]
+        return self.cx.call_function(self.root.wrapped_jsobject, helper,
+                                     args)
+
+    def __inspect_pyvalue(self, value, max_depth, max_items):
+        # Enforces the limits on the given Python value, and returns
+        # whether it's plain data without cycles or shared references,
+        # which can be sent to JS as JSON.
+        plain = [True]
+        count = [0]
+        seen = set()
+
+        def inspect(value, depth):
+            count[0] += 1
+            if count[0] > max_items:
+                raise ValueError("Value has more than %d items" % max_items)
+            if isinstance(value, (list, tuple, dict)):
+                if depth >= max_depth:
+                    raise ValueError("Value is nested more than %d "
+                                     "levels deep" % max_depth)
+                if id(value) in seen:
+                    # JSON would give each reference its own copy.
+                    plain[0] = False
+                    return
+                seen.add(id(value))
+                if isinstance(value, dict):
+                    for key in value:
+                        if not isinstance(key, basestring):
+                            plain[0] = False
+                        inspect(value[key], depth + 1)
+                else:
+                    for item in value:
+                        inspect(item, depth + 1)
+            elif isinstance(value, float):
+                if value != value or value in (float('inf'), float('-inf')):
+                    plain[0] = False
+            elif not (value is None or
+                      isinstance(value, (int, long, bool, basestring))):
+                plain[0] = False
+
+        inspect(value, 0)
+        return plain[0]
+
+    def __build_jsvalue(self, value, memo):
+        if isinstance(value, (list, tuple)):
+            if id(value) in memo:
+                return memo[id(value)]
+            array = self.cx.new_array_object()
+            memo[id(value)] = array
+            if value:
+                self.__push(array, [self.__build_jsvalue(item, memo)
+                                    for item in value])
+            return array
+        elif isinstance(value, dict):
+            if id(value) in memo:
+                return memo[id(value)]
+            obj = self.cx.new_object()
+            memo[id(value)] = obj
+            for key in value:
+                self.cx.define_property(obj, unicode(key),
+                                        self.__build_jsvalue(value[key],
+                                                             memo))
+            return obj
+        else:
+            return self.wrap_pyobject(value)
+
+    def to_js(self, value, max_depth=DEFAULT_MAX_DEPTH,
+              max_items=DEFAULT_MAX_ITEMS):
+        """
+        Converts the given Python value, including any lists, tuples
+        and dictionaries nested in it, to its JS equivalent.
+
+        Plain data is moved across as a single JSON string; anything
+        else is built up piece by piece, with other values exposed
+        through wrap_pyobject(), as is any value with cycles or shared
+        references, which are preserved. A ValueError is raised if the
+        value is nested more than 'max_depth' levels deep or has more
+        than 'max_items' values in it.
+        """
+
+        if not isinstance(value, (list, tuple, dict)):
+            return self.wrap_jsobject(self.wrap_pyobject(value))
+        if self.__inspect_pyvalue(value, max_depth, max_items):
+            try:
+                text = json.dumps(value)
+            except UnicodeDecodeError:
+                # It contains non-UTF-8 byte strings.
+                text = None
+            if text is not None:
+                jsvalue = self.__call_marshal_helper('parse', text)
+                return self.wrap_jsobject(jsvalue)
+        return self.wrap_jsobject(self.__build_jsvalue(value, {}))
+
+    def __build_pyvalue(self, jsvalue, memo, depth, limits):
+        if (not isinstance(jsvalue, pydermonkey.Object) or
+            isinstance(jsvalue, pydermonkey.Function) or
+            self.cx.get_object_private(jsvalue) is not None):
+            return self.wrap_jsobject(jsvalue)
+        max_depth, max_items, count = limits
+        if jsvalue in memo:
+            return memo[jsvalue]
+        if depth >= max_depth:
+            raise ValueError("Value is nested more than %d levels deep" %
+                             max_depth)
+        cx = self.cx
+        if self.__call_marshal_helper('isArray', jsvalue):
+            result = []
+            memo[jsvalue] = result
+            keys = range(int(cx.get_property(jsvalue, 'length')))
+        else:
+            result = {}
+            memo[jsvalue] = result
+            keys = cx.enumerate(jsvalue)
+        count[0] += len(keys)
+        if count[0] > max_items:
+            raise ValueError("Value has more than %d items" % max_items)
+        for key in keys:
+            item = self.__build_pyvalue(cx.get_property(jsvalue, key),
+                                        memo, depth + 1, limits)
+            if isinstance(result, list):
+                result.append(item)
+            else:
+                result[key] = item
+        return result
+
+    def to_json(self, jsvalue, max_items=DEFAULT_MAX_ITEMS):
+        """
+        Returns the given JS value as compact JSON text, produced by
+        the runtime's native JSON object, or None if it isn't plain
+        data or has more than 'max_items' values in it.
+        """
+
+        if isinstance(jsvalue, SafeJsObjectWrapper):
+            jsvalue = jsvalue.wrapped_jsobject
+        return self.__call_marshal_helper('stringify', jsvalue, max_items)
+
+    def to_py(self, jsvalue, max_depth=DEFAULT_MAX_DEPTH,
+              max_items=DEFAULT_MAX_ITEMS):
+        """
+        Converts the given JS value, including any arrays and plain
+        objects nested in it, to Python lists and dictionaries.
+
+        Plain data is moved across as a single JSON string; anything
+        else is walked property by property, with other values wrapped
+        through wrap_jsobject(), preserving cycles and shared
+        references. Since telling whether plain data has shared
+        references would mean walking it in JS, each reference to an
+        object shared within it gets its own copy. A ValueError is
+        raised if the value is nested more than 'max_depth' levels deep
+        or has more than 'max_items' values in it.
+        """
+
+        if isinstance(jsvalue, SafeJsObjectWrapper):
+            jsvalue = jsvalue.wrapped_jsobject
+        if not isinstance(jsvalue, pydermonkey.Object):
+            return jsvalue
+        text = self.to_json(jsvalue, max_items)
+        if text is not None:
+            value = json.loads(text)
+            self.__inspect_pyvalue(value, max_depth, max_items)
+            return value
+        return self.__build_pyvalue(jsvalue, {}, 0,
+                                    (max_depth, max_items, [0]))
+
+    def evaluate(self, code, filename='<string>', lineno=1, cache_key=None):
+        """
+        Evaluates the given code in the sandbox's global scope.
+
+        If 'cache_key' is provided, the compiled form of the code is
+        cached under it and reused by later evaluations with the same
+        key.
+        """
+
+        root = self.root.wrapped_jsobject
+        self._enter()
+        try:
+            if cache_key is None:
+                retval = self.cx.evaluate_script(root, code, filename,
+                                                 lineno)
+            else:
+                script = self.script_cache.compile(self.cx, root, cache_key,
+                                                   code, filename, lineno)
+                retval = self.cx.execute_script(root, script)
+        finally:
+            self._leave()
         return self.wrap_jsobject(retval)
 
     def run_script(self, filename, callback=None):
@@ -449,20 +1428,56 @@ class JsSandbox(object):
         Runs the given JS script, returning 0 on success, -1 on failure.
         """
 
-        retval = -1
+        return self.run_function(self.__run_script, filename, callback)
+
+    def __run_script(self, filename, callback):
         contents = open(filename).read()
         cx = self.cx
+        root = self.root.wrapped_jsobject
+        cache_key = (os.path.realpath(filename),
+                     os.stat(filename).st_mtime, '',
+                     self.script_cache.digest(contents))
+        script = self.script_cache.compile(cx, root, cache_key,
+                                           contents, filename, 1)
+        self._enter()
         try:
-            result = cx.evaluate_script(self.root.wrapped_jsobject,
-                                        contents, filename, 1)
-            if callback:
-                callback(self.wrap_jsobject(result))
+            result = cx.execute_script(root, script)
+        finally:
+            self._leave()
+        if callback:
+            callback(self.wrap_jsobject(result))
+
+    def run_function(self, function, *args):
+        """
+        Calls the given function, which may run JS code, returning 0
+        on success. If a script error stops it, the error is reported
+        like it is by run_script() and -1 is returned.
+        """
+
+        retval = -1
+        try:
+            function(*args)
             retval = 0
         except pydermonkey.error, e:
-            print format_stack(self.js_stack)
-            print e.args[1]
+            self.report_error(format_stack(self.js_stack))
+            self.report_error(e.args[1])
+        except ScriptTimeoutError, e:
+            self.report_error("Error: %s" % e)
+        except MemoryError:
+            self.report_error("Error: out of memory")
         except InternalError, e:
-            print "An internal error occurred."
+            if issubclass(e.exc_info[0], MemoryError):
+                self.report_error("Error: out of memory")
+                return retval
+            self.report_error("An internal error occurred.")
             traceback.print_tb(e.exc_info[2])
-            print e.exc_info[1]
+            self.report_error(e.exc_info[1])
         return retval
+
+    def report_error(self, message):
+        """
+        Prints a line describing an error that stopped a script. This
+        can be replaced to report errors elsewhere.
+        """
+
+        print message
@@ -0,0 +1,284 @@
+import time
+import heapq
+import errno
+import select
+import itertools
+import collections
+
+from pydershell import JsExposedObject, jsexposed
+
+class Reactor(JsExposedObject):
+    """
+    A single-threaded event loop that runs callbacks for timers,
+    queued tasks and file descriptors becoming readable or writable.
+    Callbacks may be Python callables or JS functions.
+
+    Besides individual file descriptors, 'sources' can be added: any
+    object with a filenos() method returning the descriptors it's
+    currently interested in, and a ready(fd) method called when one
+    of them becomes readable.
+
+    Exceptions raised by callbacks propagate out of run_once() and
+    run(), leaving the reactor ready to continue.
+
+    If 'on_idle' is set, it's called whenever the reactor is about to
+    wait for a timer or I/O, which makes it a good time to collect
+    garbage.
+    """
+
+    def __init__(self):
+        # A heap of (deadline, sequence number, timer id) tuples;
+        # entries of cancelled timers are skipped when they come up.
+        self._timers = []
+        # Maps a timer id to its (callback, interval) tuple, where
+        # interval is None for one-shot timers.
+        self._timer_info = {}
+        self._tasks = collections.deque()
+        self._readers = {}
+        self._writers = {}
+        self._sources = []
+        self._ids = itertools.count(1)
+        self._sequence = itertools.count()
+        self._stopped = False
+        self.on_idle = None
+
+    def call_later(self, delay, callback, interval=None):
+        """
+        Calls 'callback' after 'delay' seconds, and then every
+        'interval' seconds if it isn't None, returning an id that can
+        be passed to cancel().
+        """
+
+        timer_id = self._ids.next()
+        self._timer_info[timer_id] = (callback, interval)
+        self._push_timer(time.time() + delay, timer_id)
+        return timer_id
+
+    def _push_timer(self, deadline, timer_id):
+        heapq.heappush(self._timers,
+                       (deadline, self._sequence.next(), timer_id))
+
+    def cancel(self, timer_id):
+        self._timer_info.pop(timer_id, None)
+        if len(self._timers) > 2 * len(self._timer_info) + 64:
+            # Too many cancelled timers are clogging up the heap.
+            self._timers = [entry for entry in self._timers
+                            if entry[2] in self._timer_info]
+            heapq.heapify(self._timers)
+
+    def call_soon(self, callback):
+        self._tasks.append(callback)
+
+    def add_reader(self, fd, callback):
+        self._readers[fd] = callback
+
+    def remove_reader(self, fd):
+        self._readers.pop(fd, None)
+
+    def add_writer(self, fd, callback):
+        self._writers[fd] = callback
+
+    def remove_writer(self, fd):
+        self._writers.pop(fd, None)
+
+    def add_source(self, source):
+        if source not in self._sources:
+            self._sources.append(source)
+
+    def remove_source(self, source):
+        if source in self._sources:
+            self._sources.remove(source)
+
+    def _source_fds(self):
+        fds = {}
+        for source in self._sources:
+            for fd in source.filenos():
+                fds[fd] = source
+        return fds
+
+    def has_work(self):
+        """
+        Returns whether anything is left that could run a callback.
+        """
+
+        return bool(self._tasks or self._timer_info or self._readers or
+                    self._writers or self._source_fds())
+
+    def _next_timeout(self):
+        if self._tasks:
+            return 0
+        while self._timers and self._timers[0][2] not in self._timer_info:
+            heapq.heappop(self._timers)
+        if self._timers:
+            return max(0, self._timers[0][0] - time.time())
+        return None
+
+    def _poll(self, readers, writers, timeout):
+        """
+        Returns the lists of readable and writable descriptors once
+        any are ready or 'timeout' seconds have passed.
+        """
+
+        if not (readers or writers):
+            if timeout:
+                time.sleep(timeout)
+            return [], []
+        while True:
+            try:
+                if hasattr(select, 'poll'):
+                    return self._poll_with_poll(readers, writers, timeout)
+                readable, writable = select.select(readers, writers, [],
+                                                   timeout)[:2]
+                return readable, writable
+            except (select.error, IOError, OSError), e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def _poll_with_poll(self, readers, writers, timeout):
+        poller = select.poll()
+        for fd in readers:
+            poller.register(fd, select.POLLIN | select.POLLPRI)
+        for fd in writers:
+            flags = select.POLLOUT
+            if fd in readers:
+                flags |= select.POLLIN | select.POLLPRI
+            poller.register(fd, flags)
+        if timeout is not None:
+            timeout = timeout * 1000
+        readable = []
+        writable = []
+        for fd, flags in poller.poll(timeout):
+            if flags & (select.POLLIN | select.POLLPRI | select.POLLHUP |
+                        select.POLLERR | select.POLLNVAL):
+                if fd in readers:
+                    readable.append(fd)
+            if flags & (select.POLLOUT | select.POLLERR | select.POLLNVAL):
+                if fd in writers:
+                    writable.append(fd)
+        return readable, writable
+
+    def run_once(self, block=True):
+        """
+        Waits for the next timer or I/O event, unless 'block' is
+        false, and runs every callback that's ready. Returns False
+        without waiting if there's nothing left that could run.
+        """
+
+        source_fds = self._source_fds()
+        timeout = self._next_timeout()
+        if (timeout is None and not (self._readers or self._writers or
+                                     source_fds)):
+            return False
+        if not block:
+            timeout = 0
+        elif timeout != 0 and self.on_idle is not None:
+            self.on_idle()
+        readers = self._readers.keys() + source_fds.keys()
+        readable, writable = self._poll(readers, self._writers.keys(),
+                                        timeout)
+
+        for fd in writable:
+            callback = self._writers.get(fd)
+            if callback is not None:
+                callback(fd)
+        for fd in readable:
+            if fd in source_fds:
+                source_fds[fd].ready(fd)
+            else:
+                callback = self._readers.get(fd)
+                if callback is not None:
+                    callback(fd)
+
+        # Collect the due timers before running any, so that repeating
+        # timers run at most once per iteration.
+        now = time.time()
+        due = collections.deque()
+        while self._timers and self._timers[0][0] <= now:
+            due.append(heapq.heappop(self._timers))
+        try:
+            while due:
+                deadline, sequence, timer_id = due.popleft()
+                info = self._timer_info.get(timer_id)
+                if info is None:
+                    continue
+                callback, interval = info
+                if interval is None:
+                    del self._timer_info[timer_id]
+                else:
+                    self._push_timer(max(now, deadline + interval),
+                                     timer_id)
+                callback()
+        finally:
+            # If a callback raised, the timers after it are still due,
+            # and run the next time around.
+            for entry in due:
+                heapq.heappush(self._timers, entry)
+
+        # Only run the tasks queued so far, so that a task that keeps
+        # queueing more can't starve timers and I/O.
+        for i in range(len(self._tasks)):
+            self._tasks.popleft()()
+        return True
+
+    def run(self):
+        """
+        Runs callbacks until there's nothing left that could run one,
+        or until stop() is called.
+        """
+
+        self._stopped = False
+        while not self._stopped and self.run_once():
+            pass
+
+    def stop(self):
+        self._stopped = True
+
+    @jsexposed
+    def setTimer(self, callback, delay, repeat=False):
+        """
+        Calls 'callback' after 'delay' milliseconds, repeatedly if
+        'repeat' is true, returning the timer's id.
+        """
+
+        delay = max(0, float(delay or 0)) / 1000
+        interval = None
+        if repeat is True:
+            interval = delay
+        return self.call_later(delay, callback, interval)
+
+    @jsexposed
+    def clearTimer(self, timer_id):
+        if isinstance(timer_id, (int, float)):
+            self.cancel(int(timer_id))
+
+    @jsexposed
+    def enqueue(self, callback):
+        self.call_soon(callback)
+
+    @jsexposed
+    def addReader(self, fd, callback):
+        self.add_reader(int(fd), callback)
+
+    @jsexposed
+    def removeReader(self, fd):
+        self.remove_reader(int(fd))
+
+    @jsexposed
+    def addWriter(self, fd, callback):
+        self.add_writer(int(fd), callback)
+
+    @jsexposed
+    def removeWriter(self, fd):
+        self.remove_writer(int(fd))
+
+    @jsexposed
+    def runOnce(self, block=True):
+        return self.run_once(block is not False)
+
+    @jsexposed
+    def isIdle(self):
+        return not self.has_work()
+
+    @jsexposed
+    def hasTasks(self):
+        return bool(self._tasks)
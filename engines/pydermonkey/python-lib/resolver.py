@@ -0,0 +1,311 @@
+import os
+import stat
+import time
+import posixpath
+
+# What ModuleIndex.find() returns when a module isn't in the index,
+# so that the loader has to look for it itself.
+UNKNOWN = object()
+
+def normal_path(path):
+    """
+    Normalizes a sandboxed path the way file.normal() does in JS.
+    """
+
+    path = posixpath.normpath(path)
+    if path.startswith('//'):
+        path = '/' + path.lstrip('/')
+    return path
+
+def resolve_id(id, base_id=None):
+    """
+    Returns the top-level module id that 'id' refers to when it's
+    required from the module 'base_id', like sandbox.resolve() in JS.
+    """
+
+    if id.startswith('.'):
+        id = posixpath.dirname(base_id or '') + '/' + id
+    return normal_path(id)
+
+def _join(relative, name):
+    if relative:
+        return relative + '/' + name
+    return name
+
+class SearchDirectory(object):
+    """
+    The files in a directory of the module search path and in the
+    directories under it, listed one directory at a time, the first
+    time that a module is looked for in it. Listed directories are
+    kept up to date by listing again the ones whose mtimes have
+    changed. A path of None is a directory that's never readable,
+    such as one outside of the sandbox.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Maps the relative path of every directory listed, '' being
+        # the top one, to its (mtime, time listed, file names), with
+        # an mtime of None if it doesn't exist.
+        self._directories = {}
+
+    def _list(self, relative):
+        """
+        Returns the (mtime, time listed, file names) of the given
+        directory.
+        """
+
+        path = os.path.join(self.path, relative)
+        listed = time.time()
+        try:
+            mtime = os.stat(path).st_mtime
+            names = os.listdir(path)
+        except OSError:
+            return None, listed, set()
+        files = set()
+        for name in names:
+            try:
+                info = os.stat(os.path.join(path, name))
+            except OSError:
+                # It's a dangling symlink, or it was just removed.
+                continue
+            if stat.S_ISREG(info.st_mode):
+                files.add(name)
+        return mtime, listed, files
+
+    def files_in(self, relative):
+        """
+        Returns the names of the files in the given directory, listing
+        it if it hasn't been listed yet.
+        """
+
+        if self.path is None:
+            return frozenset()
+        entry = self._directories.get(relative)
+        if entry is None:
+            entry = self._directories[relative] = self._list(relative)
+        return entry[2]
+
+    def refresh(self):
+        """
+        Lists again the directories whose mtimes have changed, and
+        returns the set of files that have been added or removed.
+
+        A directory listed within a second of its mtime is listed
+        again even if its mtime hasn't changed, since a change made
+        later in that second may not have moved an mtime with a
+        resolution of a second.
+        """
+
+        changed = set()
+        if self.path is None:
+            return changed
+        for relative, (old_mtime, listed, old_files) in \
+                self._directories.items():
+            try:
+                mtime = os.stat(os.path.join(self.path, relative)).st_mtime
+            except OSError:
+                mtime = None
+            if (mtime == old_mtime and
+                (mtime is None or listed - mtime >= 1)):
+                continue
+            entry = self._directories[relative] = self._list(relative)
+            changed.update(_join(relative, name)
+                           for name in old_files ^ entry[2])
+        return changed
+
+class ArchiveSearchDirectory(object):
+    """
+    The files in a directory of the module search path that's inside
+    a module archive, and in the directories under it, which are
+    listed again whenever the archive changes.
+    """
+
+    def __init__(self, lookup):
+        # Returns the (archive, directory name) pair, or None if the
+        # archive has gone.
+        self._lookup = lookup
+        self._member = lookup()
+        # Maps the relative path of every directory listed to the
+        # names of the files in it.
+        self._directories = {}
+
+    def _list(self, relative):
+        if not self._member:
+            return frozenset()
+        archive, directory = self._member
+        path = '/'.join(filter(None, [directory.strip('/'), relative]))
+        return frozenset(name for name in archive.list_directory(path)
+                         if archive.is_file(_join(path, name)))
+
+    def files_in(self, relative):
+        files = self._directories.get(relative)
+        if files is None:
+            files = self._directories[relative] = self._list(relative)
+        return files
+
+    def refresh(self):
+        member = self._lookup()
+        if (member and member[0]) is (self._member and self._member[0]):
+            return set()
+        self._member = member
+        changed = set()
+        for relative, old_files in self._directories.items():
+            files = self._directories[relative] = self._list(relative)
+            changed.update(_join(relative, name)
+                           for name in old_files ^ files)
+        return changed
+
+class SearchPathIndex(object):
+    """
+    The index of one search path and list of extensions, which maps
+    each file's path relative to the path's directories to the first
+    directory it's in. The directories that a module id names are
+    added, from every directory of the path, the first time that a
+    module is looked for in them.
+    """
+
+    def __init__(self, paths, extensions, directories):
+        self.paths = paths
+        self.extensions = extensions
+        self.directories = directories
+        self.index = {}
+        # The relative paths of the directories whose files are in
+        # the index.
+        self.levels = set()
+
+    def _add_level(self, level):
+        self.levels.add(level)
+        for position in reversed(xrange(len(self.directories))):
+            for name in self.directories[position].files_in(level):
+                self.index[_join(level, name)] = position
+
+    def _first_position(self, name):
+        level, base = posixpath.split(name)
+        for position, directory in enumerate(self.directories):
+            if base in directory.files_in(level):
+                return position
+        return None
+
+    def update(self, changed):
+        """
+        Updates the index for the given relative paths of files that
+        have been added or removed.
+        """
+
+        for name in changed:
+            if posixpath.dirname(name) not in self.levels:
+                continue
+            position = self._first_position(name)
+            if position is None:
+                self.index.pop(name, None)
+            else:
+                self.index[name] = position
+
+    def find(self, top_id):
+        for extension in self.extensions:
+            name = top_id + extension
+            level = posixpath.dirname(name)
+            if level not in self.levels:
+                self._add_level(level)
+            position = self.index.get(name)
+            if position is not None:
+                return normal_path(self.paths[position] + '/' + name)
+        return UNKNOWN
+
+class ModuleIndex(object):
+    """
+    Indexes of the files in the directories of module search paths,
+    so that finding a module takes a dictionary lookup per extension
+    rather than a stat() per directory. Each search path and list of
+    extensions set has its own SearchPathIndex, identified by the
+    number set_paths() returns, so loaders with different search
+    paths can take turns without rebuilding them. Their directories
+    are shared, and each is listed only once.
+
+    The listed directories are checked for changes at most once every
+    'ttl' seconds, which costs a stat() per directory. A module that
+    isn't in the index may have been added since, so the loader looks
+    for it itself.
+    """
+
+    # Default number of seconds that the index is trusted for.
+    DEFAULT_TTL = 1.0
+
+    def __init__(self, open_directory, ttl=DEFAULT_TTL):
+        # Returns the SearchDirectory for a sandboxed search path.
+        self._open_directory = open_directory
+        self.ttl = ttl
+        # Every directory that has been on a search path, by its
+        # sandboxed path.
+        self._opened = {}
+        # The SearchPathIndex of each search path and extensions, by
+        # (paths, extensions) and in the order they were first set.
+        self._indexes = {}
+        self._index_list = []
+        # The one used when find() isn't told which.
+        self._current = None
+        self._expires = 0
+
+    def set_paths(self, paths, extensions):
+        """
+        Sets the sandboxed search paths and the extensions tried for
+        each module id, in the order that the JS loader tries them,
+        and returns the number that find() knows them by. Directories
+        that have been on a search path before aren't listed again
+        unless they've changed.
+        """
+
+        key = (tuple(paths), tuple(extensions))
+        index = self._indexes.get(key)
+        if index is None:
+            directories = []
+            for path in key[0]:
+                if path not in self._opened:
+                    self._opened[path] = self._open_directory(path)
+                directories.append(self._opened[path])
+            index = SearchPathIndex(key[0], key[1], directories)
+            index.number = len(self._index_list)
+            self._indexes[key] = index
+            self._index_list.append(index)
+        self._current = index
+        return index.number
+
+    def refresh(self):
+        changed = set()
+        for directory in self._opened.itervalues():
+            changed.update(directory.refresh())
+        if changed:
+            for index in self._index_list:
+                index.update(changed)
+        self._expires = time.time() + self.ttl
+
+    def find(self, top_id, number=None):
+        """
+        Returns the sandboxed path of the file that the loader would
+        find the given relative top-level module id in, on the search
+        path with the given number or else the last one set, or
+        UNKNOWN if it isn't in the index.
+        """
+
+        if number is None:
+            index = self._current
+        else:
+            index = self._index_list[number]
+        if index is None:
+            return UNKNOWN
+        if time.time() >= self._expires:
+            self.refresh()
+        return index.find(top_id)
+
+    def stats(self):
+        index = self._current
+        if index is None:
+            return dict(paths = 0, directories = 0, files = 0,
+                        search_paths = 0)
+        return dict(
+            paths = len(index.paths),
+            directories = len(index.levels),
+            files = len(index.index),
+            search_paths = len(self._index_list)
+            )
@@ -0,0 +1,333 @@
+import os
+import sys
+import time
+import errno
+import select
+import socket
+import tempfile
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import pydermonkey
+from pydershell import ScriptCache, ScriptTimeoutError
+from workers import Channel, WorkerProcess, _cpu_count
+
+class ParallelTestRunner(object):
+    """
+    Runs the test modules of a suite in 'jobs' worker processes, each
+    bootstrapping its own JsSandbox, and merges their results.
+
+    Each module is given by the path of property names that leads to
+    it from the suite's exports, as listed by listModules() in
+    test/runner.js. The modules are handed out one at a time, the
+    slowest first according to the timings recorded in
+    'timings_file' by earlier runs, and each one's output is written
+    to 'output' in one piece once it has finished.
+
+    Each test may run for 'timeout' seconds, which is enforced by the
+    sandbox's operation callback, and each module for 'module_timeout'
+    seconds, after which its worker process is killed, in case it's
+    blocked where the operation callback can't stop it.
+    """
+
+    # Default number of seconds a test may run for.
+    DEFAULT_TIMEOUT = 60.0
+
+    # Default number of seconds a module may run for.
+    DEFAULT_MODULE_TIMEOUT = 600.0
+
+    def __init__(self, home_dir, engine_home_dir, output, jobs=None,
+                 timeout=DEFAULT_TIMEOUT,
+                 module_timeout=DEFAULT_MODULE_TIMEOUT, timings_file=None):
+        if not jobs:
+            jobs = _cpu_count()
+        self.home_dir = home_dir
+        self.engine_home_dir = engine_home_dir
+        self.output = output
+        self.jobs = jobs
+        self.timeout = timeout
+        self.module_timeout = module_timeout
+        self.timings_file = timings_file
+        self.timings = self._read_timings()
+
+    def _read_timings(self):
+        if not self.timings_file:
+            return {}
+        try:
+            stream = open(self.timings_file)
+            try:
+                timings = json.load(stream)
+            finally:
+                stream.close()
+        except (IOError, ValueError):
+            return {}
+        if not isinstance(timings, dict):
+            return {}
+        return timings
+
+    def _write_timings(self):
+        if not self.timings_file:
+            return
+        try:
+            stream = open(self.timings_file, 'w')
+            try:
+                json.dump(self.timings, stream, indent=2, sort_keys=True)
+            finally:
+                stream.close()
+        except IOError, e:
+            sys.stderr.write("narwhal: couldn't write test timings: %s\n" %
+                             e)
+
+    def _spawn(self):
+        program = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'testrunner.py')
+        return WorkerProcess(self.home_dir, self.engine_home_dir, program)
+
+    def _write(self, text):
+        self.output.write(text)
+
+    def run(self, suite_id, modules, options):
+        """
+        Runs the given modules of the suite with the given id, passing
+        'options' to runTest() in test/runner.js, and returns a dict
+        of the number of tests that passed, failed and had errors.
+        """
+
+        # Modules are taken from the end, and those without timings
+        # might be the slowest of all.
+        pending = sorted(modules, key=lambda module: self.timings.get(
+            module_key(module), float('inf')))
+        totals = dict(passed = 0, failed = 0, error = 0)
+        # Maps each busy process to its module and when it started.
+        busy = {}
+        idle = []
+        start = time.time()
+        try:
+            while pending or busy:
+                while pending and len(busy) < self.jobs:
+                    proc = idle and idle.pop() or self._spawn()
+                    module = pending.pop()
+                    proc.channel.send('S', json.dumps(dict(
+                        suite = suite_id,
+                        module = module,
+                        timeout = self.timeout,
+                        options = options
+                        )))
+                    busy[proc] = (module, time.time())
+                for proc, result in self._wait(busy):
+                    module, started = busy.pop(proc)
+                    if result is None or 'output' not in result:
+                        self._kill(proc)
+                        result = dict(passed = 0, failed = 0, error = 1,
+                                      output = self._lost(module, result))
+                    else:
+                        idle.append(proc)
+                        self.timings[module_key(module)] = \
+                            time.time() - started
+                    self._write(result['output'])
+                    for name in totals:
+                        totals[name] += result[name]
+        finally:
+            for proc in busy:
+                self._kill(proc)
+            for proc in idle:
+                # It exits once its end of the channel is closed.
+                proc.close()
+                proc.process.wait()
+        self._write(u"Ran %d modules in %.2fs with %d processes\n" %
+                    (len(modules), time.time() - start, self.jobs))
+        self.output.flush()
+        self._write_timings()
+        return totals
+
+    def _lost(self, module, result):
+        if result is None:
+            reason = u"its worker process exited"
+        else:
+            reason = result['error']
+        return u"Module %s didn't finish: %s\n" % (module_key(module),
+                                                   reason)
+
+    def _wait(self, busy):
+        """
+        Waits for results from the busy processes, returning a list of
+        (process, result) pairs, where the result is None for a
+        process that died, or has an 'error' instead of 'output' if
+        the module didn't finish.
+        """
+
+        now = time.time()
+        deadline = min(started for module, started in busy.itervalues()) + \
+            self.module_timeout
+        results = []
+        for proc, (module, started) in busy.items():
+            if now - started >= self.module_timeout:
+                results.append((proc, dict(
+                    error = u"it ran for longer than %gs" %
+                    self.module_timeout
+                    )))
+        if results:
+            return results
+        channels = dict((proc.channel, proc) for proc in busy)
+        try:
+            ready = select.select(channels.keys(), [], [],
+                                  max(0, deadline - now))[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        for channel in ready:
+            frame = channel.receive()
+            if frame is None:
+                results.append((channels[channel], None))
+            elif frame[0] == 'E':
+                results.append((channels[channel],
+                                dict(error = frame[1].decode('utf-8'))))
+            else:
+                results.append((channels[channel], json.loads(frame[1])))
+        return results
+
+    def _kill(self, proc):
+        try:
+            proc.process.kill()
+        except OSError:
+            pass
+        proc.close()
+        proc.process.wait()
+
+def module_key(module):
+    return '.'.join(module)
+
+class ModuleShard(object):
+    """
+    The part of a worker process that runs test modules for a
+    ParallelTestRunner, in a sandbox bootstrapped once, capturing what
+    each one prints.
+    """
+
+    def __init__(self, home_dir, engine_home_dir, runtime, script_cache):
+        from narwhal import NarwhalRunner, OutputStream
+
+        self._capture = tempfile.TemporaryFile()
+        self.runner = NarwhalRunner(argv = ['narwhal', '-e', ''],
+                                    home_dir = home_dir,
+                                    engine_home_dir = engine_home_dir,
+                                    runtime = runtime,
+                                    script_cache = script_cache)
+        self.runner.stdout = OutputStream(self._capture.fileno(), 'block')
+        self.ready = self.runner.run() == 0
+        self._suites = {}
+        self._test_runner = None
+
+    def _take_output(self):
+        self.runner.stdout.flush()
+        self._capture.seek(0)
+        output = self._capture.read()
+        self._capture.seek(0)
+        self._capture.truncate()
+        return output.decode('utf-8', 'replace')
+
+    def run(self, suite_id, module, timeout, options):
+        sandbox = self.runner.sandbox
+        require = sandbox.root.require
+        if self._test_runner is None:
+            self._test_runner = require('test/runner')
+            if not options.get('color', True):
+                require('term').stream.disable()
+        test_runner = self._test_runner
+        if suite_id not in self._suites:
+            self._suites[suite_id] = require(suite_id)
+        suite = self._suites[suite_id]
+
+        # The names of the suites the module is in, indented as
+        # run() prints them.
+        for depth, name in enumerate(module):
+            self.runner.stdout.write('%s+ Running %s\n' %
+                                     ('  ' * (depth + 1), name))
+        results = dict(passed = 0, failed = 0, error = 0)
+        js_options = sandbox.to_js(options)
+        tests = test_runner.listTests(suite, sandbox.to_js(module))
+        for test in sandbox.to_py(tests):
+            # Each call into JS is limited, so this stops a test that
+            # runs too long without stopping the rest of the module.
+            sandbox.time_limit = timeout
+            try:
+                status = test_runner.runTest(suite, sandbox.to_js(test),
+                                             js_options)
+            except ScriptTimeoutError, e:
+                self.runner.stdout.write('Timeout in %s: %s\n' %
+                                         (test[-1], e))
+                status = 'error'
+                self._abort_test(test_runner, test[-1])
+            except pydermonkey.error, e:
+                # It was thrown by the module's setup() or teardown().
+                self.runner.stdout.write('Exception in %s: %s\n' %
+                                         (test[-1], e.args[1]))
+                status = 'error'
+            finally:
+                sandbox.time_limit = None
+            results[status] += 1
+        results['output'] = self._take_output()
+        return results
+
+    def _abort_test(self, test_runner, name):
+        """
+        Runs the check for new globals and the teardown() that a test
+        stopped by a timeout skipped, so they don't leak into the
+        module's next tests.
+        """
+
+        try:
+            test_runner.abortTest()
+        except ScriptTimeoutError, e:
+            self.runner.stdout.write('Timeout after %s: %s\n' % (name, e))
+        except pydermonkey.error, e:
+            self.runner.stdout.write('Exception after %s: %s\n' %
+                                     (name, e.args[1]))
+
+    def close(self):
+        self.runner.close()
+        self.runner.sandbox.finish()
+        self._capture.close()
+
+def main():
+    """
+    Entry point of a worker process of a ParallelTestRunner. The
+    channel to the parent is passed in as stdin.
+    """
+
+    home_dir, engine_home_dir = sys.argv[1:3]
+    sock = socket.fromfd(0, socket.AF_UNIX, socket.SOCK_STREAM)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    channel = Channel(sock)
+
+    script_cache = ScriptCache(
+        cache_dir = os.environ.get('NARWHAL_PYDER_CACHE_DIR')
+        )
+    shard = ModuleShard(home_dir, engine_home_dir, pydermonkey.Runtime(),
+                        script_cache)
+    try:
+        while True:
+            frame = channel.receive()
+            if frame is None:
+                break
+            if not shard.ready:
+                channel.send('E', 'test worker failed to bootstrap')
+                continue
+            request = json.loads(frame[1])
+            results = shard.run(request['suite'], request['module'],
+                                request['timeout'], request['options'])
+            try:
+                channel.send('M', json.dumps(results))
+            except socket.error:
+                break
+    finally:
+        shard.close()
+
+if __name__ == '__main__':
+    main()
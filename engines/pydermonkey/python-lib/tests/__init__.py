@@ -0,0 +1,7 @@
+# Unit tests for the pydermonkey engine's Python modules. Run them
+# from engines/pydermonkey/python-lib with:
+#
+#   python -m unittest discover -s tests
+#
+# Tests of modules that need pydermonkey are skipped where it isn't
+# installed.
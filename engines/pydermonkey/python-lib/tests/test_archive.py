@@ -0,0 +1,172 @@
+import os
+import stat
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+import archive
+
+try:
+    import narwhal
+except ImportError:
+    narwhal = None
+
+def stat_path(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def write_archive(path, members):
+    index = zipfile.ZipFile(path, 'w')
+    try:
+        for name, (contents, compress_type) in sorted(members.items()):
+            info = zipfile.ZipInfo(name)
+            info.compress_type = compress_type
+            index.writestr(info, contents)
+    finally:
+        index.close()
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'foo.zip')
+        write_archive(self.path, {
+            'lib/foo.js': ('exports.foo = 1;', zipfile.ZIP_STORED),
+            'lib/bar/baz.js': ('exports.baz = 2;' * 50,
+                               zipfile.ZIP_DEFLATED),
+            'package.json': ('{}', zipfile.ZIP_STORED),
+            })
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+class ModuleArchiveTests(ArchiveTestCase):
+    def test_index(self):
+        module_archive = archive.ModuleArchive(self.path)
+        try:
+            self.assertTrue(module_archive.is_file('lib/foo.js'))
+            self.assertFalse(module_archive.is_file('lib'))
+            self.assertTrue(module_archive.is_directory('lib/bar/'))
+            self.assertEqual(module_archive.list_directory(''),
+                             ['lib', 'package.json'])
+            self.assertEqual(module_archive.list_directory('lib'),
+                             ['bar', 'foo.js'])
+            self.assertEqual(sorted(module_archive.walk('lib')),
+                             ['bar/baz.js', 'foo.js'])
+        finally:
+            module_archive.close()
+
+    def test_read_stored_and_deflated(self):
+        module_archive = archive.ModuleArchive(self.path)
+        try:
+            self.assertEqual(module_archive.read('lib/foo.js'),
+                             'exports.foo = 1;')
+            self.assertEqual(module_archive.read('lib/bar/baz.js'),
+                             'exports.baz = 2;' * 50)
+            self.assertEqual(module_archive.file_size('lib/bar/baz.js'),
+                             len('exports.baz = 2;') * 50)
+            self.assertRaises(KeyError, module_archive.read, 'lib/nope.js')
+        finally:
+            module_archive.close()
+
+class ArchiveSetTests(ArchiveTestCase):
+    def setUp(self):
+        ArchiveTestCase.setUp(self)
+        self.archives = archive.ArchiveSet()
+
+    def tearDown(self):
+        self.archives.close()
+        ArchiveTestCase.tearDown(self)
+
+    def test_lookup(self):
+        module_archive, name = self.archives.lookup(
+            self.path + '/lib/foo.js', stat_path)
+        self.assertEqual(name, 'lib/foo.js')
+        self.assertEqual(self.archives.lookup(self.path, stat_path),
+                         (module_archive, ''))
+        self.assertEqual(self.archives.lookup(self.dir, stat_path), None)
+        self.assertEqual(self.archives.lookup(
+                os.path.join(self.dir, 'nope.zip/lib'), stat_path), None)
+
+    def test_changed_archives_are_reopened(self):
+        first = self.archives.lookup(self.path, stat_path)[0]
+        self.assertTrue(self.archives.lookup(self.path, stat_path)[0]
+                        is first)
+        write_archive(self.path, {
+            'lib/foo.js': ('exports.foo = 3;', zipfile.ZIP_STORED),
+            })
+        info = os.stat(self.path)
+        os.utime(self.path, (info.st_atime, info.st_mtime + 10))
+        second, name = self.archives.lookup(self.path + '/lib/foo.js',
+                                            stat_path)
+        self.assertFalse(second is first)
+        self.assertEqual(second.read(name), 'exports.foo = 3;')
+
+    def test_bad_archives_are_ignored(self):
+        bad_path = os.path.join(self.dir, 'bad.jar')
+        open(bad_path, 'w').write('not a zip')
+        self.assertEqual(self.archives.lookup(bad_path + '/foo.js',
+                                              stat_path), None)
+
+class Sandbox(object):
+    """
+    Stands in for a JsSandbox, for the PyderApi calls that don't need
+    a JS runtime.
+    """
+
+    def to_js(self, value):
+        return value
+
+class Runner(object):
+    def __init__(self, home_dir):
+        self.home_dir = home_dir
+        self.sandbox = Sandbox()
+        self.bundle = None
+        self.freezer = None
+
+@unittest.skipIf(narwhal is None, "pydermonkey isn't installed")
+class PyderApiArchiveTests(ArchiveTestCase):
+    def setUp(self):
+        ArchiveTestCase.setUp(self)
+        self.api = narwhal.PyderApi(Runner(self.dir))
+
+    def tearDown(self):
+        self.api.close_archives()
+        ArchiveTestCase.tearDown(self)
+
+    def test_file_api_sees_an_archive_as_a_file(self):
+        self.assertTrue(self.api.isFile('/foo.zip'))
+        self.assertFalse(self.api.isDirectory('/foo.zip'))
+        self.assertFalse(self.api.exists('/foo.zip/lib/foo.js'))
+        self.assertFalse(self.api.isFile('/foo.zip/lib/foo.js'))
+        self.assertEqual(self.api.listDirectory('/foo.zip'), [])
+        self.assertEqual(self.api.scanDirectory('/foo.zip'), [])
+        self.assertEqual(self.api.stat('/foo.zip/lib/foo.js'), None)
+        self.assertEqual(
+            [entry['name'] for entry in self.api.scanDirectory('/')],
+            ['foo.zip'])
+
+    def test_loader_sees_inside_archives(self):
+        self.assertTrue(self.api.loaderIsFile('/foo.zip/lib/foo.js'))
+        self.assertFalse(self.api.loaderIsFile('/foo.zip/lib'))
+        self.assertFalse(self.api.loaderIsFile('/foo.zip/lib/nope.js'))
+        self.assertEqual(self.api.loaderRead('/foo.zip/lib/bar/baz.js'),
+                         u'exports.baz = 2;' * 50)
+        self.assertEqual(self.api.loaderMtime('/foo.zip/lib/foo.js'),
+                         os.stat(self.path).st_mtime)
+        self.assertEqual(self.api.loaderMtime('/foo.zip/lib/nope.js'), None)
+
+    def test_loader_falls_back_to_files(self):
+        path = os.path.join(self.dir, 'plain.js')
+        open(path, 'w').write('exports.plain = 1;')
+        self.assertTrue(self.api.loaderIsFile('/plain.js'))
+        self.assertEqual(self.api.loaderRead('/plain.js'),
+                         u'exports.plain = 1;')
+        self.assertEqual(self.api.loaderMtime('/plain.js'),
+                         os.stat(path).st_mtime)
+        self.assertEqual(self.api.loaderMtime('/nope.js'), None)
+
+if __name__ == '__main__':
+    unittest.main()
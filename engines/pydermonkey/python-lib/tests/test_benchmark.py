@@ -0,0 +1,99 @@
+import unittest
+
+try:
+    import benchmark
+except ImportError:
+    benchmark = None
+
+def results(**benchmarks):
+    return dict(benchmarks = dict(
+        (name, dict(benchmark.summarize(samples), unit = 's'))
+        for name, samples in benchmarks.items()
+        ))
+
+@unittest.skipIf(benchmark is None, "pydermonkey isn't installed")
+class SummarizeTests(unittest.TestCase):
+    def test_odd_number_of_samples(self):
+        summary = benchmark.summarize([3.0, 1.0, 2.0])
+        self.assertEqual(summary['n'], 3)
+        self.assertEqual(summary['median'], 2.0)
+        self.assertEqual(summary['mean'], 2.0)
+        self.assertEqual(summary['stdev'], 1.0)
+        self.assertEqual((summary['min'], summary['max']), (1.0, 3.0))
+
+    def test_even_number_of_samples(self):
+        summary = benchmark.summarize([4.0, 1.0, 2.0, 3.0])
+        self.assertEqual(summary['median'], 2.5)
+
+    def test_single_sample(self):
+        summary = benchmark.summarize([5.0])
+        self.assertEqual(summary['median'], 5.0)
+        self.assertEqual(summary['stdev'], 0.0)
+
+@unittest.skipIf(benchmark is None, "pydermonkey isn't installed")
+class CompareTests(unittest.TestCase):
+    def statuses(self, current, baseline):
+        return dict((info['name'], info['status'])
+                    for info in benchmark.compare(current, baseline))
+
+    def test_significant_changes(self):
+        baseline = results(slower = [1.0, 1.1, 0.9, 1.0],
+                           faster = [1.0, 1.1, 0.9, 1.0],
+                           noisy = [1.0, 1.1, 0.9, 1.0],
+                           same = [1.0, 1.0, 1.0, 1.0])
+        current = results(slower = [2.0, 2.1, 1.9, 2.0],
+                          faster = [0.5, 0.6, 0.4, 0.5],
+                          noisy = [0.1, 3.0, 0.2, 2.5],
+                          same = [1.0, 1.0, 1.0, 1.0])
+        self.assertEqual(self.statuses(current, baseline),
+                         dict(slower = 'regression',
+                              faster = 'improvement',
+                              noisy = 'unchanged',
+                              same = 'unchanged'))
+
+    def test_small_changes_are_unchanged(self):
+        baseline = results(a = [1.0, 1.0, 1.0, 1.0])
+        current = results(a = [1.05, 1.05, 1.05, 1.05])
+        self.assertEqual(self.statuses(current, baseline),
+                         dict(a = 'unchanged'))
+
+    def test_new_missing_and_skipped(self):
+        baseline = results(old = [1.0], skip = [1.0])
+        current = results(new = [1.0])
+        current['skipped'] = dict(skip = 'unsupported')
+        self.assertEqual(self.statuses(current, baseline),
+                         dict(old = 'missing', skip = 'skipped',
+                              new = 'new'))
+
+@unittest.skipIf(benchmark is None, "pydermonkey isn't installed")
+class RunTests(unittest.TestCase):
+    def setUp(self):
+        self.registered = benchmark._benchmarks[:]
+        self.calls = []
+
+        @benchmark.benchmark('test_counted')
+        def counted(runner):
+            self.calls.append(runner)
+            return float(len(self.calls))
+
+        @benchmark.benchmark('test_unsupported')
+        def unsupported(runner):
+            raise benchmark.BenchmarkSkipped('not here')
+
+        self.runner = benchmark.BenchmarkRunner('.', '.', repeat = 3)
+
+    def tearDown(self):
+        self.runner.close()
+        benchmark._benchmarks[:] = self.registered
+
+    def test_warms_up_then_samples(self):
+        results = self.runner.run(['test_counted', 'test_unsupported'])
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(results['benchmarks']['test_counted']['samples'],
+                         [2.0, 3.0, 4.0])
+        self.assertEqual(results['skipped'],
+                         dict(test_unsupported = 'not here'))
+        self.assertFalse('test_unsupported' in results['benchmarks'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import bundle
+
+class ModuleBundleTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'lib'))
+        self.file = os.path.join(self.root, 'bundle.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write_file(self, path, contents):
+        with open(self.root + path, 'w') as f:
+            f.write(contents)
+        return os.stat(self.root + path).st_mtime
+
+    def freeze(self):
+        frozen = bundle.ModuleBundle()
+        mtime = self.write_file('/lib/a.js', 'exports.a = 1;')
+        frozen.add_file('/lib/a.js', mtime, 14, u'exports.a = 1;')
+        frozen.add_missing('/lib/b.js',
+                           bundle.dir_mtime(self.root + '/lib'))
+        frozen.write(self.file)
+        return frozen
+
+    def test_round_trip(self):
+        self.freeze()
+        loaded = bundle.ModuleBundle.load(self.file, self.root)
+        self.assertEqual(loaded.get_file('/lib/a.js')[1:],
+                         (14, u'exports.a = 1;'))
+        self.assertTrue(loaded.is_missing('/lib/b.js'))
+        self.assertFalse(loaded.is_missing('/lib/a.js'))
+        self.assertEqual(len(loaded), 1)
+
+    def test_changed_files_are_dropped(self):
+        self.freeze()
+        os.utime(self.root + '/lib/a.js', (0, 0))
+        loaded = bundle.ModuleBundle.load(self.file, self.root)
+        self.assertEqual(loaded.get_file('/lib/a.js'), None)
+
+    def test_changed_directories_forget_missing_paths(self):
+        self.freeze()
+        os.utime(self.root + '/lib', (0, 0))
+        loaded = bundle.ModuleBundle.load(self.file, self.root)
+        self.assertFalse(loaded.is_missing('/lib/b.js'))
+
+    def test_unreadable_bundles(self):
+        self.assertEqual(bundle.ModuleBundle.load(self.file, self.root),
+                         None)
+        self.write_file('/bundle.json', '{"version": 0}')
+        self.assertEqual(bundle.ModuleBundle.load(self.file, self.root),
+                         None)
+        self.write_file('/bundle.json', '{')
+        self.assertEqual(bundle.ModuleBundle.load(self.file, self.root),
+                         None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import StringIO
+
+from _multiprocessing import recvfd
+
+import forkclient
+
+class ConnectTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'socket')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def serve(self, respond):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(1)
+        self.requests = []
+
+        def serve_one():
+            conn = listener.accept()[0]
+            for i in range(3):
+                os.close(recvfd(conn.fileno()))
+            self.requests.append(conn.makefile('rb').readline())
+            respond(conn)
+            conn.close()
+            listener.close()
+
+        thread = threading.Thread(target=serve_one)
+        thread.start()
+        return thread
+
+    def connect(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            return forkclient.connect(self.path, ['narwhal', '-e', '1'],
+                                      '/', {}), sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+
+    def test_no_server_is_unavailable(self):
+        self.assertRaises(forkclient.ServerUnavailable,
+                          forkclient.connect, self.path, ['narwhal'])
+
+    def test_returns_exit_code(self):
+        thread = self.serve(lambda conn: conn.sendall('{"exit": 3}\n'))
+        self.assertEqual(self.connect(), (3, ''))
+        thread.join()
+        self.assertTrue('"argv": ["narwhal", "-e", "1"]' in
+                        self.requests[0])
+
+    def test_lost_worker_isnt_unavailable(self):
+        # The program may have run, so it mustn't be run again.
+        thread = self.serve(lambda conn: None)
+        retval, errors = self.connect()
+        thread.join()
+        self.assertEqual(retval, 1)
+        self.assertTrue('died' in errors)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+try:
+    import hashes
+    from narwhal import ByteBuffer
+except ImportError:
+    hashes = None
+
+# The vectors of tests/hashes.js.
+VECTORS = [
+    ('md4', u'test hash', '549089516e75bd13c41ff098fbb58d5e'),
+    ('md4', u'abc', 'a448017aaf21d8525fc10ae87aa6729d'),
+    ('md5', u'Hello, World!', '65a8e27d8879283831b664bd8b7f0ad4'),
+    ('md5', u'message digest', 'f96b697d7cb7938d525a2f31aaf161d0'),
+    ('md5', u'abc', '900150983cd24fb0d6963f7d28e17f72'),
+    ('sha1', u'Hello, World!', '0a0a9f2a6772942557ab5355d76af442f8f65e01'),
+    ('sha1', u'160-bit hash', '90d925d853c3d35cd54070bb75280fefad9de9e7'),
+    ('sha256', u'Hello, World!',
+     'dffd6021bb2bd5b0af676290809ec3a53191dd81c7f70a4b28688a362182986f'),
+    ]
+
+class Binary(object):
+    """
+    Stands in for a ByteString or ByteArray from binary.js.
+    """
+
+    def __init__(self, data, offset=0):
+        self._bytes = ByteBuffer(bytearray(data))
+        self._offset = offset
+        self._length = len(data) - offset
+
+@unittest.skipIf(hashes is None, "pydermonkey isn't installed")
+class HashTests(unittest.TestCase):
+    def test_vectors(self):
+        available = hashes.available_algorithms()
+        for name, text, hex_digest in VECTORS:
+            if name not in available:
+                continue
+            self.assertEqual(hashes.Hash(name).update(text).hexDigest(),
+                             hex_digest)
+
+    def test_updates_accumulate(self):
+        hash = hashes.Hash('md5').update(u'Hello, ')
+        copy = hash.copy()
+        hash.update(u'World!')
+        self.assertEqual(hash.hexDigest(),
+                         '65a8e27d8879283831b664bd8b7f0ad4')
+        self.assertEqual(copy.hexDigest(),
+                         hashes.Hash('md5').update(u'Hello, ').hexDigest())
+
+    def test_bytes_are_hashed_in_place(self):
+        binary = Binary('xxHello, World!', 2)
+        hash = hashes.Hash('sha1').updateBytes(binary, 0, 13)
+        self.assertEqual(hash.hexDigest(),
+                         '0a0a9f2a6772942557ab5355d76af442f8f65e01')
+        self.assertEqual(len(hash.digest().data), hash.digestSize)
+
+    def test_strings_are_hashed_by_their_low_bytes(self):
+        self.assertEqual(hashes.string_bytes(u'\xe9a'), '\xe9a')
+        self.assertEqual(hashes.string_bytes(u'\u20ac\u0141a'), '\xac\x41a')
+        self.assertEqual(hashes.Hash('md5').update(u'\u0161').hexDigest(),
+                         hashes.Hash('md5').update(u'a').hexDigest())
+
+    def test_unsupported_algorithms(self):
+        self.assertRaises(hashes.pydermonkey.error, hashes.Hash, 'md17')
+
+@unittest.skipIf(hashes is None, "pydermonkey isn't installed")
+class Crc32Tests(unittest.TestCase):
+    def test_vector_is_signed(self):
+        # -(0xec4ac3d0 + 1) ^ -1, as computed by tests/hashes.js.
+        self.assertEqual(hashes.Crc32().update(u'Hello, World!').digest(),
+                         -330644528)
+
+    def test_positive_checksums(self):
+        self.assertEqual(hashes.Crc32().update(u'abc').digest(), 0x352441c2)
+        self.assertEqual(hashes.Crc32().digest(), 0)
+
+    def test_updates_and_copies(self):
+        crc = hashes.Crc32().update(u'Hello, ')
+        copy = crc.copy()
+        crc.updateBytes(Binary('World!'), 0, 6)
+        self.assertEqual(crc.digest(), -330644528)
+        self.assertEqual(copy.digest(),
+                         hashes.Crc32().update(u'Hello, ').digest())
+
+if __name__ == '__main__':
+    unittest.main()
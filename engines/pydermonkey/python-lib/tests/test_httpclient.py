@@ -0,0 +1,155 @@
+import socket
+import threading
+import unittest
+import BaseHTTPServer
+
+try:
+    import httpclient
+except ImportError:
+    httpclient = None
+
+# A body whose three-byte characters straddle any 8K chunk boundary.
+EUROS = (u'\u20ac' * 5000).encode('utf-8')
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.peers.add(self.client_address)
+        if self.path == '/euros':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(EUROS), 1000):
+                piece = EUROS[start:start + 1000]
+                self.wfile.write('%x\r\n%s\r\n' % (len(piece), piece))
+            self.wfile.write('0\r\n\r\n')
+        elif self.path == '/hang-up':
+            # Claims the connection can be reused, then closes it.
+            self.respond(200, 'bye')
+            self.close_connection = 1
+        elif self.path == '/missing':
+            self.respond(404, 'no such thing')
+        else:
+            self.respond(200, 'hello')
+
+    def do_POST(self):
+        self.server.encodings.append(self.headers.get('Transfer-Encoding'))
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = []
+            while True:
+                size = int(self.rfile.readline(), 16)
+                body.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    break
+            body = ''.join(body)
+        else:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        self.respond(200, body)
+
+class Sandbox(object):
+    def to_js(self, value):
+        return value
+
+@unittest.skipIf(httpclient is None, "pydermonkey isn't installed")
+class HttpClientTests(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.peers = set()
+        self.server.encodings = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.pool = httpclient.ConnectionPool(timeout = 5)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def request(self, path, method='GET', headers=(), body=()):
+        request = httpclient.HttpRequest(Sandbox(), self.pool, method,
+                                         self.url + path, list(headers))
+        for piece in body:
+            request.write(piece)
+        return request.finish()
+
+    def read(self, response):
+        return str(response.readBytes().data)
+
+    def test_keep_alive_connections_are_reused(self):
+        for i in range(3):
+            response = self.request('/')
+            self.assertEqual(response.status, 200)
+            self.assertEqual(self.read(response), 'hello')
+        self.assertEqual(self.pool.stats(),
+                         dict(created = 1, reused = 2, idle = 1))
+        self.assertEqual(len(self.server.peers), 1)
+
+    def test_chunks_end_on_character_boundaries(self):
+        response = self.request('/euros')
+        chunks = []
+        while True:
+            chunk = str(response.readChunk(8192).data)
+            if not chunk:
+                break
+            chunks.append(chunk.decode('utf-8'))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(u''.join(chunks), EUROS.decode('utf-8'))
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    def test_utf8_boundary(self):
+        euro = u'\u20ac'.encode('utf-8')
+        self.assertEqual(httpclient._utf8_boundary('ab'), 2)
+        self.assertEqual(httpclient._utf8_boundary('a' + euro), 4)
+        self.assertEqual(httpclient._utf8_boundary('a' + euro[:2]), 1)
+        self.assertEqual(httpclient._utf8_boundary(euro[:1]), 0)
+        self.assertEqual(httpclient._utf8_boundary('\x80' * 5), 5)
+
+    def test_request_bodies(self):
+        response = self.request('/', 'POST', body = [u'caf', u'\xe9'])
+        self.assertEqual(self.read(response), 'caf\xc3\xa9')
+        response = self.request('/', 'POST', [('Content-Length', '4')],
+                                ['ab', 'cd'])
+        self.assertEqual(self.read(response), 'abcd')
+        self.assertEqual(self.server.encodings, ['chunked', None])
+
+    def test_stale_connections_are_retried(self):
+        self.read(self.request('/hang-up'))
+        response = self.request('/')
+        self.assertEqual(self.read(response), 'hello')
+        self.assertEqual(self.pool.stats()['created'], 2)
+
+    def test_error_statuses(self):
+        response = self.request('/missing')
+        self.assertEqual(response.status, 404)
+        self.assertEqual(response.statusText, 'HTTP/1.1 404 Not Found')
+        self.assertEqual(self.read(response), 'no such thing')
+
+    def test_connection_errors_become_js_errors(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        request = httpclient.HttpRequest(Sandbox(), self.pool, 'GET',
+                                         'http://127.0.0.1:%d/' % port, [])
+        self.assertRaises(httpclient.pydermonkey.error, request.finish)
+        self.assertRaises(httpclient.pydermonkey.error,
+                          httpclient.HttpRequest, Sandbox(), self.pool,
+                          'GET', 'ftp://127.0.0.1/', [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import jsoncodec
+
+class ParseTests(unittest.TestCase):
+    def test_keeps_member_order(self):
+        value = jsoncodec.parse('{"b": 1, "a": [true, null, 2.5]}')
+        self.assertEqual(list(value.items()),
+                         [(u'b', 1), (u'a', [True, None, 2.5])])
+
+    def test_rejects_non_json_constants(self):
+        for text in ('NaN', '[Infinity]', '{"a": -Infinity}'):
+            self.assertRaises(ValueError, jsoncodec.parse, text)
+
+    def test_rejects_invalid_text(self):
+        for text in ('', '{', "{'a': 1}", '[1,]'):
+            self.assertRaises(ValueError, jsoncodec.parse, text)
+
+class ReformatTests(unittest.TestCase):
+    TEXT = '{"b":{"a":1,"c":[2,{"a":3,"d":4}]},"a":0}'
+
+    def test_unchanged_without_keys_or_space(self):
+        self.assertTrue(jsoncodec.reformat(self.TEXT) is self.TEXT)
+        self.assertTrue(jsoncodec.reformat(self.TEXT, None, 0) is self.TEXT)
+
+    def test_selects_keys_in_the_given_order(self):
+        self.assertEqual(jsoncodec.reformat(self.TEXT, [u'a', u'b']),
+                         '{"a":0,"b":{"a":1}}')
+        self.assertEqual(jsoncodec.reformat('[{"a":1,"b":2}]', [u'b']),
+                         '[{"b":2}]')
+
+    def test_indents_with_spaces_or_strings(self):
+        self.assertEqual(jsoncodec.reformat('{"a":[1]}', None, 2),
+                         '{\n  "a": [\n    1\n  ]\n}')
+        self.assertEqual(jsoncodec.reformat('[1]', None, u'\t'),
+                         '[\n\t1\n]')
+
+    def test_indents_are_capped(self):
+        self.assertEqual(jsoncodec.reformat('[1]', None, 100),
+                         '[\n' + ' ' * 10 + '1\n]')
+        self.assertEqual(jsoncodec.reformat('[1]', None, u'-' * 20),
+                         '[\n' + '-' * 10 + '1\n]')
+
+    def test_keeps_non_ascii_text(self):
+        self.assertEqual(jsoncodec.reformat(u'["\xe9"]', None, 1),
+                         u'[\n "\xe9"\n]')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,265 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+try:
+    import narwhal
+    import pydershell
+except ImportError:
+    narwhal = None
+
+class Binary(object):
+    """
+    Stands in for a ByteString or ByteArray from binary.js.
+    """
+
+    def __init__(self, data, offset=0, length=None):
+        self._bytes = narwhal.ByteBuffer(bytearray(data))
+        self._offset = offset
+        if length is None:
+            length = len(data) - offset
+        self._length = length
+
+@unittest.skipIf(narwhal is None, "pydermonkey isn't installed")
+class ByteBufferTests(unittest.TestCase):
+    def test_get_and_set(self):
+        buffer = narwhal.ByteBuffer(bytearray(2))
+        buffer.set(0, 0x1FF)
+        self.assertEqual(buffer.get(0), 0xFF)
+        self.assertTrue(buffer.get(2) is narwhal.pydermonkey.undefined)
+
+    def test_fill_is_clamped(self):
+        buffer = narwhal.ByteBuffer(bytearray(4))
+        buffer.fill(-1, 2, 7)
+        buffer.fill(3, 10, 9)
+        self.assertEqual(buffer.data, bytearray('\x07\x07\x00\x09'))
+
+    def test_copy_within_overlapping_ranges(self):
+        buffer = narwhal.ByteBuffer(bytearray('abcdef'))
+        buffer.copyFrom(buffer, 0, 2, 4)
+        self.assertEqual(buffer.data, bytearray('ababcd'))
+
+    def test_encode_and_decode(self):
+        buffer = narwhal.ByteBuffer.encode(u'\xe9t\xe9')
+        self.assertEqual(buffer.length, 5)
+        self.assertEqual(buffer.decode(0, 5), u'\xe9t\xe9')
+        self.assertEqual(buffer.decode(0, 2, 'latin-1'), u'\xc3\xa9')
+        self.assertRaises(narwhal.pydermonkey.error,
+                          narwhal.ByteBuffer.encode, u'x', 'no-such-charset')
+
+@unittest.skipIf(narwhal is None, "pydermonkey isn't installed")
+class BinaryViewTests(unittest.TestCase):
+    def test_views_within_the_binary(self):
+        binary = Binary('abcdef', 1, 4)
+        self.assertEqual(narwhal.binary_view(binary, 1, 2).tobytes(), 'cd')
+        self.assertEqual(narwhal.binary_view(binary, None, 4).tobytes(),
+                         'bcde')
+
+    def test_rejects_ranges_outside_the_binary(self):
+        binary = Binary('abcdef', 1, 4)
+        for start, length in ((0, 5), (3, 2), (-1, 1), (0, -1)):
+            self.assertRaises(narwhal.pydermonkey.error,
+                              narwhal.binary_view, binary, start, length)
+
+    def test_rejects_other_objects(self):
+        self.assertRaises(narwhal.pydermonkey.error,
+                          narwhal.binary_view, object(), 0, 0)
+
+@unittest.skipIf(narwhal is None, "pydermonkey isn't installed")
+class FileHandleTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'file')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_file(self, data):
+        stream = open(self.path, 'wb')
+        stream.write(data)
+        stream.close()
+
+    def test_reads_characters_split_across_chunks(self):
+        self.write_file(u'a\xe9b\u20ac'.encode('utf-8'))
+        handle = narwhal.FileHandle(self.path, 'rb')
+        chunks = [handle.read(1) for i in range(7)]
+        self.assertEqual(u''.join(chunks), u'a\xe9b\u20ac')
+        self.assertEqual(handle.read(), u'')
+        handle.close()
+
+    def test_reads_lines(self):
+        self.write_file('one\ntwo\n')
+        handle = narwhal.FileHandle(self.path, 'rb')
+        self.assertEqual(handle.readLine(), u'one\n')
+        self.assertEqual(handle.readLine(), u'two\n')
+        self.assertEqual(handle.readLine(), u'')
+        handle.close()
+
+    def test_writes_and_seeks(self):
+        handle = narwhal.FileHandle(self.path, 'wb')
+        handle.write(u'\xe9t\xe9')
+        self.assertEqual(handle.tell(), 5)
+        handle.close()
+        handle = narwhal.FileHandle(self.path, 'r+b')
+        handle.seek(2)
+        self.assertEqual(handle.read(), u't\xe9')
+        handle.close()
+
+    def test_binary_charset_maps_bytes(self):
+        self.write_file('\x00\xff')
+        handle = narwhal.FileHandle(self.path, 'rb', None)
+        self.assertEqual(handle.read(), u'\x00\xff')
+        handle.close()
+
+    def test_memory_maps_large_files(self):
+        self.write_file('x' * 100)
+        threshold = narwhal.FileHandle.MMAP_THRESHOLD
+        narwhal.FileHandle.MMAP_THRESHOLD = 10
+        try:
+            handle = narwhal.FileHandle(self.path, 'rb')
+        finally:
+            narwhal.FileHandle.MMAP_THRESHOLD = threshold
+        self.assertFalse(handle.isatty())
+        self.assertEqual(handle.read(10), u'x' * 10)
+        self.assertEqual(handle.tell(), 10)
+        self.assertEqual(len(handle.read()), 90)
+        handle.close()
+
+    def test_reads_into_and_writes_from_binaries(self):
+        self.write_file('hello')
+        handle = narwhal.FileHandle(self.path, 'rb')
+        binary = Binary('........', 2, 6)
+        self.assertEqual(handle.readInto(binary, 6, 0), 5)
+        self.assertEqual(str(binary._bytes.data), '..hello.')
+        self.assertRaises(narwhal.pydermonkey.error,
+                          handle.readInto, binary, 6, 1)
+        handle.close()
+        handle = narwhal.FileHandle(self.path, 'wb')
+        handle.writeInto(binary, 1, 4)
+        handle.close()
+        self.assertEqual(open(self.path).read(), 'ell')
+
+    def test_closed_handle_raises_js_error(self):
+        self.write_file('x')
+        handle = narwhal.FileHandle(self.path, 'rb')
+        handle.close()
+        self.assertRaises(narwhal.pydermonkey.error, handle.read)
+
+@unittest.skipIf(narwhal is None, "pydermonkey isn't installed")
+class OutputStreamTests(unittest.TestCase):
+    def setUp(self):
+        self.read_fd, self.write_fd = os.pipe()
+
+    def tearDown(self):
+        os.close(self.read_fd)
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+
+    def written(self):
+        os.close(self.write_fd)
+        self.write_fd = None
+        return os.read(self.read_fd, 65536)
+
+    def test_block_buffering_waits_for_flush(self):
+        stream = narwhal.OutputStream(self.write_fd, 'block')
+        stream.write(u'a\n')
+        stream.writeInto(Binary('xbcx'), 1, 3)
+        self.assertEqual(stream._buffer, bytearray('a\nbc'))
+        stream.flush()
+        self.assertEqual(self.written(), 'a\nbc')
+
+    def test_line_buffering_flushes_at_newlines(self):
+        stream = narwhal.OutputStream(self.write_fd, 'line')
+        stream.write(u'\xe9')
+        self.assertEqual(stream._buffer, bytearray('\xc3\xa9'))
+        stream.write(u'\n')
+        self.assertEqual(self.written(), '\xc3\xa9\n')
+
+    def test_invalid_buffering(self):
+        self.assertRaises(ValueError, narwhal.OutputStream, 1, 'bogus')
+        stream = narwhal.OutputStream(self.write_fd)
+        self.assertRaises(narwhal.pydermonkey.error,
+                          stream.setBuffering, 'bogus')
+
+    def test_write_errors_become_js_errors(self):
+        stream = narwhal.OutputStream(self.write_fd, 'none')
+        os.close(self.read_fd)
+        self.read_fd = os.open(os.devnull, os.O_RDONLY)
+        self.assertRaises(narwhal.pydermonkey.error, stream.write, u'x')
+        self.assertRaises(narwhal.pydermonkey.error,
+                          stream.writeInto, Binary('x'), 0, 1)
+
+@unittest.skipIf(narwhal is None, "pydermonkey isn't installed")
+class MetadataCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = os.path.realpath(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_caches_missing_paths_until_invalidated(self):
+        cache = narwhal.MetadataCache()
+        path = os.path.join(self.dir, 'x')
+        self.assertTrue(cache.stat(path) is None)
+        open(path, 'w').close()
+        self.assertTrue(cache.stat(path) is None)
+        cache.invalidate(path)
+        self.assertTrue(cache.stat(path) is not None)
+
+    def test_entries_expire(self):
+        cache = narwhal.MetadataCache(ttl=0.01)
+        path = os.path.join(self.dir, 'x')
+        self.assertTrue(cache.stat(path) is None)
+        open(path, 'w').close()
+        time.sleep(0.02)
+        self.assertTrue(cache.stat(path) is not None)
+
+    def test_is_bounded(self):
+        cache = narwhal.MetadataCache(max_entries=3)
+        for i in range(10):
+            cache.stat(os.path.join(self.dir, str(i)))
+            cache.real_path(os.path.join(self.dir, str(i)))
+        self.assertEqual(len(cache._stats), 3)
+        self.assertEqual(len(cache._real_paths), 3)
+        # The most recent entries are the ones kept.
+        self.assertEqual(list(cache._stats),
+                         [os.path.join(self.dir, name)
+                          for name in ('7', '8', '9')])
+
+    def test_expired_entries_are_dropped(self):
+        cache = narwhal.MetadataCache(ttl=0.01)
+        cache.stat(os.path.join(self.dir, 'a'))
+        time.sleep(0.02)
+        cache.stat(os.path.join(self.dir, 'b'))
+        self.assertEqual(list(cache._stats), [os.path.join(self.dir, 'b')])
+
+    def test_invalidating_a_path_forgets_real_paths(self):
+        cache = narwhal.MetadataCache()
+        link = os.path.join(self.dir, 'link')
+        os.mkdir(os.path.join(self.dir, 'a'))
+        os.mkdir(os.path.join(self.dir, 'b'))
+        os.symlink('a', link)
+        self.assertEqual(cache.real_path(link + '/x'), self.dir + '/a/x')
+        os.remove(link)
+        os.symlink('b', link)
+        cache.invalidate(link)
+        self.assertEqual(cache.real_path(link + '/x'), self.dir + '/b/x')
+
+@unittest.skipIf(narwhal is None, "pydermonkey isn't installed")
+class EnvironmentOptionsTests(unittest.TestCase):
+    def test_nothing_set(self):
+        self.assertEqual(narwhal.environment_options({}), {})
+
+    def test_stats_and_memory_limit(self):
+        options = narwhal.environment_options(dict(
+            NARWHAL_PYDER_STATS = '1',
+            NARWHAL_PYDER_MEMORY_LIMIT = '1.5'
+            ))
+        self.assertEqual(options['memory_limit'], 3 * 512 * 1024)
+        self.assertTrue(isinstance(options['call_stats'],
+                                   pydershell.CallStats))
+
+if __name__ == '__main__':
+    unittest.main()
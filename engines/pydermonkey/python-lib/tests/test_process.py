@@ -0,0 +1,86 @@
+import os
+import signal
+import tempfile
+import unittest
+
+try:
+    import process
+except ImportError:
+    process = None
+
+@unittest.skipIf(process is None, "pydermonkey isn't installed")
+class ChildProcessTests(unittest.TestCase):
+    def test_reads_output_and_exit_status(self):
+        exits = []
+        child = process.ChildProcess(['sh', '-c', 'echo hi; exit 3'],
+                                     on_exit = lambda: exits.append(1))
+        self.assertEqual(child.stdout.read(), u'hi\n')
+        self.assertEqual(child.wait(), 3)
+        self.assertEqual(child.poll(), 3)
+        self.assertEqual(exits, [1])
+
+    def test_killed_processes_report_the_signal(self):
+        child = process.ChildProcess(['sleep', '10'])
+        child.kill()
+        self.assertEqual(child.wait(), 128 + signal.SIGTERM)
+        # Killing it again does nothing.
+        child.kill()
+
+    def test_missing_commands_raise_js_errors(self):
+        self.assertRaises(process.pydermonkey.error, process.ChildProcess,
+                          ['/no/such/command'])
+
+@unittest.skipIf(process is None, "pydermonkey isn't installed")
+class CommunicateTests(unittest.TestCase):
+    def test_pumps_input_and_output(self):
+        remaining = [u'caf\xe9\n' * 1000]
+        def input(length):
+            text = remaining[0][:length]
+            remaining[0] = remaining[0][length:]
+            return text
+        output, errput = [], []
+        child = process.ChildProcess(['sh', '-c', 'cat; echo err >&2'])
+        statuses = process.communicate([(child, input, output.append,
+                                         errput.append)])
+        self.assertEqual(statuses, [0])
+        self.assertEqual(u''.join(output), u'caf\xe9\n' * 1000)
+        self.assertEqual(u''.join(errput), u'err\n')
+
+    def test_no_input_closes_stdin(self):
+        output = []
+        children = [process.ChildProcess(['cat']) for i in range(3)]
+        statuses = process.communicate([(child, None, output.append, None)
+                                        for child in children])
+        self.assertEqual(statuses, [0, 0, 0])
+        self.assertEqual(output, [])
+
+@unittest.skipIf(process is None, "pydermonkey isn't installed")
+class SystemTests(unittest.TestCase):
+    def test_inherits_standard_streams(self):
+        out = tempfile.TemporaryFile()
+        saved = os.dup(1)
+        os.dup2(out.fileno(), 1)
+        try:
+            status = process.system(['sh', '-c', 'echo hi; exit 2'])
+        finally:
+            os.dup2(saved, 1)
+            os.close(saved)
+        self.assertEqual(status, 2)
+        out.seek(0)
+        self.assertEqual(out.read(), 'hi\n')
+
+    def test_runs_in_the_given_directory(self):
+        directory = os.path.realpath(tempfile.mkdtemp())
+        try:
+            status = process.system(['sh', '-c', 'test "$(pwd)" = "$DIR"'],
+                                    directory, dict(DIR = directory))
+            self.assertEqual(status, 0)
+        finally:
+            os.rmdir(directory)
+
+    def test_missing_commands_raise_js_errors(self):
+        self.assertRaises(process.pydermonkey.error, process.system,
+                          ['/no/such/command'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import sys
+import time
+import weakref
+import threading
+import traceback
+import unittest
+
+try:
+    import pydershell
+except ImportError:
+    pydershell = None
+
+@unittest.skipIf(pydershell is None, "pydermonkey isn't installed")
+class LruCacheTests(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = pydershell.LruCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_setting_refreshes_an_entry(self):
+        cache = pydershell.LruCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'] = 3
+        cache['c'] = 4
+        self.assertEqual(sorted(cache.values()), [3, 4])
+
+    def test_get_default(self):
+        cache = pydershell.LruCache(1)
+        self.assertEqual(cache.get('a', 5), 5)
+        cache['a'] = None
+        self.assertEqual(cache.get('a', 5), None)
+
+    def test_clear(self):
+        cache = pydershell.LruCache(1)
+        cache['a'] = 1
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+class FakeContext(object):
+    """
+    Stands in for a pydermonkey context, compiling scripts to their
+    source code.
+    """
+
+    def __init__(self):
+        self.compiled = []
+
+    def compile_script(self, obj, code, filename, lineno):
+        self.compiled.append(code)
+        return ('script', code)
+
+@unittest.skipIf(pydershell is None, "pydermonkey isn't installed")
+class ScriptCacheTests(unittest.TestCase):
+    def test_compiles_once_per_key(self):
+        cache = pydershell.ScriptCache()
+        cx = FakeContext()
+        first = cache.compile(cx, None, 'a', 'x = 1', 'a.js', 1)
+        second = cache.compile(cx, None, 'a', 'x = 1', 'a.js', 1)
+        self.assertTrue(first is second)
+        self.assertEqual(cx.compiled, ['x = 1'])
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_digest_tells_same_length_edits_apart(self):
+        digest = pydershell.ScriptCache.digest
+        self.assertNotEqual(digest('x = 1'), digest('x = 2'))
+        self.assertEqual(digest(u'x = 1'), digest('x = 1'))
+        # Non-ASCII source is digested as UTF-8.
+        self.assertEqual(digest(u'\xe9'), digest('\xc3\xa9'))
+
+    def test_evicts_least_recently_used(self):
+        cache = pydershell.ScriptCache(max_entries=2)
+        cx = FakeContext()
+        cache.compile(cx, None, 'a', 'a', 'a.js', 1)
+        cache.compile(cx, None, 'b', 'b', 'b.js', 1)
+        cache.compile(cx, None, 'a', 'a', 'a.js', 1)
+        cache.compile(cx, None, 'c', 'c', 'c.js', 1)
+        cache.compile(cx, None, 'a', 'a', 'a.js', 1)
+        cache.compile(cx, None, 'b', 'b', 'b.js', 1)
+        self.assertEqual(cx.compiled, ['a', 'b', 'c', 'b'])
+
+class FakeTriggeredContext(object):
+    def __init__(self):
+        self.triggered = threading.Event()
+
+    def trigger_operation_callback(self):
+        self.triggered.set()
+
+@unittest.skipIf(pydershell is None, "pydermonkey isn't installed")
+class MemoryUsageTests(unittest.TestCase):
+    def setUp(self):
+        self.platform = sys.platform
+
+    def tearDown(self):
+        sys.platform = self.platform
+        if 'open' in vars(pydershell):
+            del pydershell.open
+
+    def without_proc(self, platform):
+        def no_proc(*args):
+            raise IOError('no /proc')
+        pydershell.open = no_proc
+        sys.platform = platform
+        return pydershell.memory_usage()
+
+    def test_peak_size_units(self):
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        darwin = self.without_proc('darwin')
+        linux = self.without_proc('linux2')
+        latest = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.assertTrue(maxrss <= darwin <= latest)
+        self.assertTrue(maxrss * 1024 <= linux <= latest * 1024)
+
+    def test_current_size(self):
+        self.assertTrue(pydershell.memory_usage() > 0)
+
+class Marker(object):
+    pass
+
+@unittest.skipIf(pydershell is None, "pydermonkey isn't installed")
+class PyStackTests(unittest.TestCase):
+    def capture(self):
+        marker = Marker()
+        captured = pydershell.capture_py_stack(sys._getframe())
+        return captured, weakref.ref(marker)
+
+    def test_keeps_the_line_at_capture_time(self):
+        captured, marker = self.capture()
+        stack = pydershell.extract_py_stack(captured)
+        filename, lineno, name, line = stack[-1]
+        self.assertEqual(name, 'capture')
+        self.assertEqual(line, 'captured = pydershell.capture_py_stack('
+                               'sys._getframe())')
+        self.assertEqual(stack[-2][2],
+                         'test_keeps_the_line_at_capture_time')
+        self.assertEqual(
+            [entry[:3] for entry in stack[:-2]],
+            [entry[:3] for entry in traceback.extract_stack()[:-1]])
+
+    def test_doesnt_keep_locals_alive(self):
+        captured, marker = self.capture()
+        self.assertTrue(marker() is None)
+
+@unittest.skipIf(pydershell is None, "pydermonkey isn't installed")
+class ContextWatchdogThreadTests(unittest.TestCase):
+    def setUp(self):
+        self.watchdog = pydershell.ContextWatchdogThread()
+        self.watchdog.start()
+
+    def tearDown(self):
+        self.watchdog.join()
+
+    def test_triggers_at_deadline(self):
+        cx = FakeTriggeredContext()
+        start = time.time()
+        self.watchdog.schedule(cx, start + 0.05)
+        self.assertTrue(cx.triggered.wait(5))
+        self.assertTrue(time.time() - start >= 0.05)
+
+    def test_earlier_deadline_wakes_it(self):
+        late = FakeTriggeredContext()
+        early = FakeTriggeredContext()
+        self.watchdog.schedule(late, time.time() + 60)
+        self.watchdog.schedule(early, time.time() + 0.01)
+        self.assertTrue(early.triggered.wait(5))
+        self.assertFalse(late.triggered.is_set())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import time
+import unittest
+
+try:
+    import reactor
+except ImportError:
+    reactor = None
+
+class Source(object):
+    def __init__(self, fd):
+        self.fd = fd
+        self.ready_fds = []
+
+    def filenos(self):
+        return [self.fd]
+
+    def ready(self, fd):
+        self.ready_fds.append(fd)
+        os.read(fd, 1)
+
+@unittest.skipIf(reactor is None, "pydermonkey isn't installed")
+class ReactorTests(unittest.TestCase):
+    def setUp(self):
+        self.reactor = reactor.Reactor()
+        self.calls = []
+
+    def call(self, name):
+        return lambda *args: self.calls.append(name)
+
+    def test_nothing_to_do(self):
+        self.assertFalse(self.reactor.has_work())
+        self.assertFalse(self.reactor.run_once())
+        self.assertTrue(self.reactor.isIdle())
+
+    def test_tasks_run_in_order(self):
+        self.reactor.call_soon(self.call('a'))
+        self.reactor.call_soon(self.call('b'))
+        self.assertTrue(self.reactor.hasTasks())
+        self.reactor.run()
+        self.assertEqual(self.calls, ['a', 'b'])
+        self.assertFalse(self.reactor.hasTasks())
+
+    def test_tasks_queued_by_tasks_wait_a_turn(self):
+        def requeue():
+            self.calls.append('first')
+            self.reactor.call_soon(self.call('second'))
+        self.reactor.call_soon(requeue)
+        self.reactor.run_once()
+        self.assertEqual(self.calls, ['first'])
+        self.reactor.run_once()
+        self.assertEqual(self.calls, ['first', 'second'])
+
+    def test_errors_leave_later_tasks_queued(self):
+        def fail():
+            raise ValueError('task failed')
+        self.reactor.call_soon(fail)
+        self.reactor.call_soon(self.call('after'))
+        self.assertRaises(ValueError, self.reactor.run_once)
+        self.reactor.run()
+        self.assertEqual(self.calls, ['after'])
+
+    def test_timers_fire_in_deadline_order(self):
+        self.reactor.call_later(0.02, self.call('late'))
+        self.reactor.call_later(0.01, self.call('early'))
+        cancelled = self.reactor.call_later(0, self.call('cancelled'))
+        self.reactor.cancel(cancelled)
+        self.reactor.run()
+        self.assertEqual(self.calls, ['early', 'late'])
+
+    def test_errors_leave_later_timers_due(self):
+        def fail():
+            raise ValueError('timer failed')
+        self.reactor.call_later(0, fail)
+        self.reactor.call_later(0, self.call('after'))
+        time.sleep(0.01)
+        self.assertRaises(ValueError, self.reactor.run_once)
+        self.assertEqual(self.calls, [])
+        self.assertTrue(self.reactor.run_once(block=False))
+        self.assertEqual(self.calls, ['after'])
+        self.assertFalse(self.reactor.has_work())
+
+    def test_repeating_timers(self):
+        def tick():
+            self.calls.append('tick')
+            if len(self.calls) == 3:
+                self.reactor.cancel(timer_id)
+        timer_id = self.reactor.call_later(0, tick, 0.001)
+        self.reactor.run()
+        self.assertEqual(self.calls, ['tick'] * 3)
+
+    def test_set_timer_takes_milliseconds(self):
+        start = time.time()
+        self.reactor.setTimer(self.call('timer'), 20)
+        self.reactor.run()
+        self.assertEqual(self.calls, ['timer'])
+        self.assertTrue(time.time() - start >= 0.015)
+
+    def test_readers_and_writers(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            def writable(fd):
+                os.write(fd, 'x')
+                self.reactor.remove_writer(fd)
+            def readable(fd):
+                self.calls.append(os.read(fd, 1))
+                self.reactor.remove_reader(fd)
+            self.reactor.add_writer(write_fd, writable)
+            self.reactor.add_reader(read_fd, readable)
+            self.reactor.run()
+            self.assertEqual(self.calls, ['x'])
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_sources(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            source = Source(read_fd)
+            self.reactor.add_source(source)
+            self.assertTrue(self.reactor.has_work())
+            os.write(write_fd, 'x')
+            self.reactor.run_once()
+            self.assertEqual(source.ready_fds, [read_fd])
+            self.reactor.remove_source(source)
+            self.assertFalse(self.reactor.has_work())
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_stop(self):
+        def stop():
+            self.calls.append('stop')
+            self.reactor.stop()
+        self.reactor.call_soon(stop)
+        self.reactor.call_later(0, self.call('timer'))
+        self.reactor.run()
+        self.assertEqual(self.calls, ['timer', 'stop'])
+        self.assertFalse(self.reactor.has_work())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import os
+import time
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+import archive
+import resolver
+
+class ResolveIdTests(unittest.TestCase):
+    def test_top_level_ids(self):
+        self.assertEqual(resolver.resolve_id('foo/bar'), 'foo/bar')
+        self.assertEqual(resolver.resolve_id('foo//bar/'), 'foo/bar')
+
+    def test_relative_ids(self):
+        self.assertEqual(resolver.resolve_id('./baz', 'foo/bar'), 'foo/baz')
+        self.assertEqual(resolver.resolve_id('../baz', 'foo/bar'), 'baz')
+        self.assertEqual(resolver.resolve_id('../../baz', 'foo/bar'),
+                         '../baz')
+
+class ResolverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, contents=''):
+        path = os.path.join(self.dir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').write(contents)
+
+    def age(self, path, seconds=10):
+        """
+        Moves the mtime of the given directory into the past, so that
+        its listing isn't taken again just for being recent.
+        """
+
+        path = os.path.join(self.dir, path)
+        mtime = os.stat(path).st_mtime - seconds
+        os.utime(path, (mtime, mtime))
+
+class SearchDirectoryTests(ResolverTestCase):
+    def test_directories_are_listed_when_looked_in(self):
+        self.write('lib/foo.js')
+        self.write('lib/deep/er/bar.js')
+        directory = resolver.SearchDirectory(os.path.join(self.dir, 'lib'))
+        self.assertEqual(directory._directories, {})
+        self.assertEqual(directory.files_in(''), set(['foo.js']))
+        self.assertEqual(directory.files_in('deep/er'), set(['bar.js']))
+        self.assertEqual(sorted(directory._directories), ['', 'deep/er'])
+        self.assertEqual(directory.files_in('nope'), set())
+
+    def test_refresh_lists_changed_directories(self):
+        self.write('lib/foo.js')
+        self.age('lib')
+        directory = resolver.SearchDirectory(os.path.join(self.dir, 'lib'))
+        directory.files_in('')
+        self.assertEqual(directory.refresh(), set())
+        self.write('lib/bar.js')
+        os.remove(os.path.join(self.dir, 'lib/foo.js'))
+        self.assertEqual(directory.refresh(), set(['foo.js', 'bar.js']))
+        self.assertEqual(directory.files_in(''), set(['bar.js']))
+
+    def test_recent_listings_are_taken_again(self):
+        self.write('lib/foo.js')
+        directory = resolver.SearchDirectory(os.path.join(self.dir, 'lib'))
+        directory.files_in('')
+        # Added within the second that the listing was taken in, and
+        # without changing the directory's mtime.
+        info = os.stat(os.path.join(self.dir, 'lib'))
+        self.write('lib/bar.js')
+        os.utime(os.path.join(self.dir, 'lib'),
+                 (info.st_atime, info.st_mtime))
+        self.assertEqual(directory.refresh(), set(['bar.js']))
+
+    def test_unreadable_directory(self):
+        directory = resolver.SearchDirectory(None)
+        self.assertEqual(directory.files_in(''), frozenset())
+        self.assertEqual(directory.refresh(), set())
+
+class ArchiveSearchDirectoryTests(ResolverTestCase):
+    def setUp(self):
+        ResolverTestCase.setUp(self)
+        self.path = os.path.join(self.dir, 'foo.zip')
+        self.archives = archive.ArchiveSet()
+
+    def tearDown(self):
+        self.archives.close()
+        ResolverTestCase.tearDown(self)
+
+    def write_archive(self, names):
+        index = zipfile.ZipFile(self.path, 'w')
+        try:
+            for name in names:
+                index.writestr(name, '')
+        finally:
+            index.close()
+
+    def lookup(self):
+        def stat_path(path):
+            try:
+                return os.stat(path)
+            except OSError:
+                return None
+        return self.archives.lookup(self.path + '/lib', stat_path)
+
+    def test_files_and_refresh(self):
+        self.write_archive(['lib/foo.js', 'lib/bar/baz.js', 'README'])
+        directory = resolver.ArchiveSearchDirectory(self.lookup)
+        self.assertEqual(directory.files_in(''), set(['foo.js']))
+        self.assertEqual(directory.files_in('bar'), set(['baz.js']))
+        self.assertEqual(directory.refresh(), set())
+
+        self.write_archive(['lib/bar/baz.js', 'lib/bar/qux.js'])
+        info = os.stat(self.path)
+        os.utime(self.path, (info.st_atime, info.st_mtime + 10))
+        self.assertEqual(directory.refresh(), set(['foo.js', 'bar/qux.js']))
+        self.assertEqual(directory.files_in(''), set())
+
+        os.remove(self.path)
+        self.assertEqual(directory.refresh(),
+                         set(['bar/baz.js', 'bar/qux.js']))
+
+class ModuleIndexTests(ResolverTestCase):
+    def setUp(self):
+        ResolverTestCase.setUp(self)
+        self.opened = []
+        self.index = resolver.ModuleIndex(self.open_directory, ttl=0)
+
+    def open_directory(self, path):
+        self.opened.append(path)
+        return resolver.SearchDirectory(os.path.join(self.dir,
+                                                     path.lstrip('/')))
+
+    def test_first_path_and_extension_win(self):
+        self.write('a/foo.js')
+        self.write('b/foo.js')
+        self.write('b/foo')
+        self.write('b/sub/bar.js')
+        self.index.set_paths(['/a', '/b'], ['', '.js'])
+        self.assertEqual(self.index.find('foo'), '/b/foo')
+        self.assertEqual(self.index.find('foo.js'), '/a/foo.js')
+        self.assertEqual(self.index.find('sub/bar'), '/b/sub/bar.js')
+
+    def test_misses_are_unknown(self):
+        self.write('a/foo.js')
+        self.write('a/sub/bar.js')
+        self.index.set_paths(['/a'], ['', '.js'])
+        self.assertTrue(self.index.find('nope') is resolver.UNKNOWN)
+        # A directory is never a module.
+        self.assertTrue(self.index.find('sub') is resolver.UNKNOWN)
+
+    def test_new_modules_are_found(self):
+        self.write('a/foo.js')
+        self.index.ttl = 60
+        self.index.set_paths(['/a'], ['.js'])
+        self.assertTrue(self.index.find('bar') is resolver.UNKNOWN)
+        # Written within the index's ttl and the directory's mtime
+        # resolution; the loader finds it itself.
+        self.write('a/bar.js')
+        self.assertTrue(self.index.find('bar') is resolver.UNKNOWN)
+        self.index.refresh()
+        self.assertEqual(self.index.find('bar'), '/a/bar.js')
+
+    def test_changes_are_seen_after_the_ttl(self):
+        self.write('a/foo.js')
+        self.write('b/foo.js')
+        self.age('a')
+        self.index.set_paths(['/a', '/b'], ['.js'])
+        self.assertEqual(self.index.find('foo'), '/a/foo.js')
+        os.remove(os.path.join(self.dir, 'a/foo.js'))
+        self.assertEqual(self.index.find('foo'), '/b/foo.js')
+
+    def test_only_looked_up_directories_are_listed(self):
+        self.write('a/foo.js')
+        self.write('a/x/y/z.js')
+        self.write('a/other/w.js')
+        self.index.set_paths(['/a'], ['.js'])
+        self.assertEqual(self.index.stats(),
+                         dict(paths=1, directories=0, files=0,
+                              search_paths=1))
+        self.assertEqual(self.index.find('x/y/z'), '/a/x/y/z.js')
+        self.assertEqual(self.index.stats(),
+                         dict(paths=1, directories=1, files=1,
+                              search_paths=1))
+
+    def test_search_paths_are_kept_apart(self):
+        self.write('a/foo.js')
+        self.write('b/foo.js')
+        first = self.index.set_paths(['/a', '/b'], ['.js'])
+        second = self.index.set_paths(['/b'], ['.js'])
+        self.assertEqual(self.index.find('foo', first), '/a/foo.js')
+        self.assertEqual(self.index.find('foo', second), '/b/foo.js')
+        # The last one set is used when none is given.
+        self.assertEqual(self.index.find('foo'), '/b/foo.js')
+        # Setting a search path again doesn't start it over.
+        self.assertEqual(self.index.set_paths(['/a', '/b'], ['.js']), first)
+        self.assertEqual(self.index.stats()['directories'], 1)
+        self.assertEqual(self.opened, ['/a', '/b'])
+
+    def test_changes_reach_every_search_path(self):
+        self.write('a/foo.js')
+        self.write('b/foo.js')
+        self.age('a')
+        first = self.index.set_paths(['/a', '/b'], ['.js'])
+        second = self.index.set_paths(['/a'], ['.js'])
+        self.assertEqual(self.index.find('foo', first), '/a/foo.js')
+        self.assertEqual(self.index.find('foo', second), '/a/foo.js')
+        os.remove(os.path.join(self.dir, 'a/foo.js'))
+        self.assertEqual(self.index.find('foo', first), '/b/foo.js')
+        self.assertTrue(self.index.find('foo', second) is resolver.UNKNOWN)
+
+    def test_directories_are_opened_once(self):
+        self.write('a/foo.js')
+        self.index.set_paths(['/a'], ['.js'])
+        self.index.set_paths(['/b', '/a'], ['.js'])
+        self.index.set_paths(['/a'], ['.js'])
+        self.assertEqual(self.opened, ['/a', '/b'])
+        self.assertEqual(self.index.find('foo'), '/a/foo.js')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import gc
+import unittest
+
+try:
+    import pydershell
+except ImportError:
+    pydershell = None
+
+@unittest.skipIf(pydershell is None, "pydermonkey isn't installed")
+class MarshallingTests(unittest.TestCase):
+    def setUp(self):
+        self.sandbox = pydershell.JsSandbox()
+
+    def tearDown(self):
+        self.sandbox.finish()
+
+    def evaluate(self, code, **names):
+        for name, value in names.iteritems():
+            self.sandbox.root[name] = value
+        return self.sandbox.evaluate(code)
+
+    def test_plain_data_round_trips(self):
+        value = {u'a': [1, 2.5, u'x', None, True], u'b': {}}
+        self.assertEqual(self.sandbox.to_py(self.sandbox.to_js(value)),
+                         value)
+
+    def test_to_js_preserves_shared_references(self):
+        shared = {u'a': 1}
+        jsvalue = self.sandbox.to_js([shared, shared])
+        self.assertTrue(self.evaluate('x[0] === x[1]', x = jsvalue))
+
+    def test_to_js_preserves_cycles(self):
+        value = []
+        value.append(value)
+        jsvalue = self.sandbox.to_js(value)
+        self.assertTrue(self.evaluate('x[0] === x', x = jsvalue))
+
+    def test_to_js_converts_longs(self):
+        jsvalue = self.sandbox.to_js([2 ** 70, self.sandbox.root])
+        self.assertTrue(self.evaluate('x[0] === Math.pow(2, 70)',
+                                      x = jsvalue))
+        self.assertEqual(self.sandbox.wrap_pyobject(2 ** 70),
+                         float(2 ** 70))
+
+    def test_to_py_preserves_cycles(self):
+        value = self.sandbox.to_py(self.evaluate(
+            'var x = {}; x.self = x; x'))
+        self.assertTrue(value[u'self'] is value)
+
+    def test_limits(self):
+        self.assertRaises(ValueError, self.sandbox.to_js, [[[1]]],
+                          max_depth = 2)
+        self.assertRaises(ValueError, self.sandbox.to_js, range(10),
+                          max_items = 5)
+
+@unittest.skipIf(pydershell is None, "pydermonkey isn't installed")
+class WrapperCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.sandbox = pydershell.JsSandbox()
+
+    def tearDown(self):
+        self.sandbox.finish()
+
+    def test_unreferenced_instances_are_evicted(self):
+        class Exposed(pydershell.JsExposedObject):
+            pass
+
+        before = self.sandbox.wrapper_stats()
+        value = Exposed()
+        jsobj = self.sandbox.wrap_pyobject(value)
+        self.assertTrue(self.sandbox.wrap_pyobject(value) is jsobj)
+        during = self.sandbox.wrapper_stats()
+        self.assertEqual(during['py_objects'], before['py_objects'] + 1)
+        # Instances' privates don't need clearing by finish().
+        self.assertEqual(during['py_privates'], before['py_privates'])
+
+        del jsobj
+        self.sandbox.collect_garbage()
+        gc.collect()
+        self.assertEqual(self.sandbox.wrapper_stats()['py_objects'],
+                         before['py_objects'])
+
+if __name__ == '__main__':
+    unittest.main()
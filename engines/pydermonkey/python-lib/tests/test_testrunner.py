@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+
+try:
+    import narwhal
+    import testrunner
+except ImportError:
+    testrunner = None
+
+class Sandbox(object):
+    """
+    Stands in for a JsSandbox whose values are all plain Python ones.
+    """
+
+    time_limit = None
+
+    @property
+    def root(self):
+        return self
+
+    def require(self, id):
+        raise AssertionError("unexpected require of %s" % id)
+
+    def to_js(self, value):
+        return value
+
+    def to_py(self, value):
+        return value
+
+class TestRunner(object):
+    """
+    Stands in for test/runner.js, running the tests of a module given
+    as a dict of functions that return a status.
+    """
+
+    def __init__(self):
+        self.aborted = []
+
+    def listTests(self, suite, path):
+        return [list(path) + [name] for name in sorted(suite)]
+
+    def runTest(self, suite, path, options):
+        return suite[path[-1]]()
+
+    def abortTest(self):
+        self.aborted.append(True)
+        if len(self.aborted) > 1:
+            raise testrunner.pydermonkey.error(None, u'teardown failed')
+
+class Runner(object):
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.sandbox = Sandbox()
+
+@unittest.skipIf(testrunner is None, "pydermonkey isn't installed")
+class ModuleShardTests(unittest.TestCase):
+    def setUp(self):
+        self.shard = testrunner.ModuleShard.__new__(testrunner.ModuleShard)
+        self.shard._capture = tempfile.TemporaryFile()
+        self.shard.runner = Runner(
+            narwhal.OutputStream(self.shard._capture.fileno(), 'block'))
+        self.shard._test_runner = TestRunner()
+        self.shard._suites = {}
+
+    def tearDown(self):
+        self.shard._capture.close()
+
+    def test_timed_out_tests_are_cleaned_up_after(self):
+        def spin():
+            raise testrunner.ScriptTimeoutError('time', 1)
+        self.shard._suites['suite'] = dict(
+            testA = spin,
+            testB = lambda: 'passed',
+            testC = spin
+            )
+        results = self.shard.run('suite', [], 1, {})
+        self.assertEqual(results['passed'], 1)
+        self.assertEqual(results['error'], 2)
+        self.assertEqual(len(self.shard._test_runner.aborted), 2)
+        self.assertTrue('Timeout in testA' in results['output'])
+        self.assertTrue('Exception after testC: teardown failed'
+                        in results['output'])
+        self.assertEqual(self.shard.runner.sandbox.time_limit, None)
+
+@unittest.skipIf(testrunner is None, "pydermonkey isn't installed")
+class ParallelTestRunnerTests(unittest.TestCase):
+    def test_output_goes_through_the_stream(self):
+        capture = tempfile.TemporaryFile()
+        try:
+            output = narwhal.OutputStream(capture.fileno(), 'block')
+            runner = testrunner.ParallelTestRunner('/', '/', output, jobs=1)
+            output.write(u'before\n')
+            runner._write(u'\u20ac\n')
+            output.write(u'after\n')
+            output.flush()
+            capture.seek(0)
+            self.assertEqual(capture.read(),
+                             'before\n\xe2\x82\xac\nafter\n')
+        finally:
+            capture.close()
+
+if __name__ == '__main__':
+    unittest.main()
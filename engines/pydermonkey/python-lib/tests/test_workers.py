@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+
+try:
+    import workers
+except ImportError:
+    workers = None
+
+# A stand-in for a worker process: it echoes messages back to its
+# parent, and reports that it's done once it's terminated, unless its
+# script is "spin", in which case it ignores its channel.
+STAND_IN = r'''
+import os, sys, time, socket
+sys.path.insert(0, %r)
+from workers import Channel
+
+channel = Channel(socket.fromfd(0, socket.AF_UNIX, socket.SOCK_STREAM))
+try:
+    while True:
+        frame = channel.receive()
+        if frame is None:
+            break
+        kind, payload = frame
+        if kind == 'S' and payload == 'spin':
+            while True:
+                time.sleep(1)
+        elif kind == 'S':
+            channel.send('M', 'max ' + os.environ['NARWHAL_PYDER_MAX_WORKERS'])
+        elif kind == 'M':
+            channel.send('M', payload)
+        elif kind == 'T':
+            channel.send('D')
+except socket.error:
+    # The pool was closed.
+    pass
+'''
+
+@unittest.skipIf(workers is None, "pydermonkey isn't installed")
+class ChannelTests(unittest.TestCase):
+    def test_frames_round_trip(self):
+        a, b = socket.socketpair()
+        sender, receiver = workers.Channel(a), workers.Channel(b)
+        sender.send('M', 'x' * 100000)
+        sender.send('D')
+        self.assertEqual(receiver.receive(), ('M', 'x' * 100000))
+        self.assertEqual(receiver.receive(), ('D', ''))
+        sender.close()
+        self.assertEqual(receiver.receive(), None)
+        receiver.close()
+
+@unittest.skipIf(workers is None, "pydermonkey isn't installed")
+class WorkerPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        program = os.path.join(self.dir, 'stand_in.py')
+        with open(program, 'w') as f:
+            f.write(STAND_IN % os.path.dirname(
+                os.path.abspath(workers.__file__)))
+        self.pool = workers.WorkerPool(self.dir, self.dir,
+                                       max_processes = 2,
+                                       program = program)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.dir)
+
+    def test_spawns_beyond_the_cap_are_queued(self):
+        first = self.pool.spawn(u'a')
+        second = self.pool.spawn(u'b')
+        third = self.pool.spawn(u'c')
+        self.pool.post(third, u'hello')
+        self.assertEqual(len(self.pool._processes), 2)
+        self.assertEqual(self.pool.wait()[2], u'max 1')
+        self.assertEqual(self.pool.wait()[2], u'max 1')
+
+        self.pool.terminate(first)
+        self.assertEqual(self.pool.wait(), (third, 'message', u'max 1'))
+        self.assertEqual(self.pool.wait(), (third, 'message', u'hello'))
+        self.assertEqual(sorted(self.pool._processes), [second, third])
+
+    def test_terminating_a_queued_worker_drops_it(self):
+        self.pool.spawn(u'a')
+        self.pool.spawn(u'b')
+        queued = self.pool.spawn(u'c')
+        self.pool.terminate(queued)
+        self.pool.post(queued, u'hello')
+        self.assertEqual(len(self.pool._queued), 0)
+
+    def test_close_kills_workers_that_ignore_it(self):
+        self.pool.spawn(u'spin')
+        process = self.pool._processes.values()[0].process
+        start = time.time()
+        self.pool.close(timeout = 0.2)
+        self.assertNotEqual(process.poll(), None)
+        self.assertTrue(time.time() - start < 5)
+
+if __name__ == '__main__':
+    unittest.main()
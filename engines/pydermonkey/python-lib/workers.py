@@ -0,0 +1,416 @@
+import os
+import sys
+import time
+import errno
+import select
+import socket
+import struct
+import subprocess
+import collections
+
+from pydershell import ScriptCache
+
+# The environment variable that caps the number of worker processes
+# a pool may run at once. Each pool passes half of its own cap on to
+# the pools of its workers, so nested workers can't fork without bound.
+MAX_PROCESSES_VAR = 'NARWHAL_PYDER_MAX_WORKERS'
+
+# Number of seconds that close() gives worker processes to exit before
+# killing them; a CPU-bound worker doesn't notice its channel closing.
+CLOSE_TIMEOUT = 1.0
+
+class WorkerTerminated(BaseException):
+    """
+    Raised inside a worker process to unwind its JS event loop when
+    the worker is terminated. Like InternalError, it's derived from
+    BaseException so that JS code can't catch it.
+    """
+
+    pass
+
+def _cpu_count():
+    try:
+        return os.sysconf('SC_NPROCESSORS_ONLN')
+    except (AttributeError, ValueError):
+        return 1
+
+def _default_max_processes():
+    try:
+        return max(1, int(os.environ[MAX_PROCESSES_VAR]))
+    except (KeyError, ValueError):
+        return _cpu_count()
+
+class Channel(object):
+    """
+    Sends and receives length-prefixed frames over a socket. Each
+    frame has a one-character kind and a byte string payload.
+
+    Kinds sent to workers are 'S' (start a script), 'M' (message) and
+    'T' (terminate); kinds sent back are 'M' (message), 'E' (error)
+    and 'D' (done, the worker has stopped).
+    """
+
+    HEADER = struct.Struct('>cI')
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, kind, payload=''):
+        self.sock.sendall(self.HEADER.pack(kind, len(payload)) + payload)
+
+    def _read_exactly(self, length):
+        chunks = []
+        while length:
+            try:
+                chunk = self.sock.recv(length)
+            except socket.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                if e.args[0] == errno.ECONNRESET:
+                    return None
+                raise
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            length -= len(chunk)
+        return ''.join(chunks)
+
+    def receive(self):
+        """
+        Returns the next (kind, payload) frame, or None if the other
+        end has gone away.
+        """
+
+        header = self._read_exactly(self.HEADER.size)
+        if header is None:
+            return None
+        kind, length = self.HEADER.unpack(header)
+        payload = self._read_exactly(length)
+        if payload is None:
+            return None
+        return kind, payload
+
+    def close(self):
+        self.sock.close()
+
+class WorkerProcess(object):
+    """
+    A child process that runs workers, one at a time, each in a new
+    JsSandbox. 'program' is the Python script that the child runs,
+    which is this one unless it's given, and 'max_processes' caps the
+    worker processes of the child's own pool.
+    """
+
+    def __init__(self, home_dir, engine_home_dir, program=None,
+                 max_processes=1):
+        parent_sock, child_sock = socket.socketpair()
+        if program is None:
+            program = os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), 'workers.py')
+        env = dict(os.environ)
+        env[MAX_PROCESSES_VAR] = str(max_processes)
+        self.process = subprocess.Popen([sys.executable, program,
+                                         home_dir, engine_home_dir],
+                                        stdin=child_sock.fileno(),
+                                        env=env,
+                                        close_fds=True)
+        child_sock.close()
+        self.channel = Channel(parent_sock)
+        self.worker_id = None
+        # One of 'idle', 'active', or 'draining', which means the
+        # worker was terminated and we're waiting for it to stop.
+        self.state = 'idle'
+
+    def close(self):
+        # The process exits once its end of the channel is closed.
+        self.channel.close()
+
+    def kill(self):
+        if self.process.poll() is None:
+            try:
+                self.process.kill()
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
+        self.process.wait()
+
+class WorkerPool(object):
+    """
+    Runs workers in at most 'max_processes' child processes at once,
+    reusing up to 'max_idle' of them once their workers have stopped,
+    and collects the messages they send back. Workers spawned while
+    every process is busy wait in a queue for one to become free.
+
+    If this process is itself a worker, 'parent' is the Channel to
+    its parent, and messages from it are collected too. 'program' is
+    passed on to WorkerProcess.
+    """
+
+    def __init__(self, home_dir, engine_home_dir, parent=None,
+                 max_idle=None, max_processes=None, program=None):
+        if max_processes is None:
+            max_processes = _default_max_processes()
+        if max_idle is None:
+            max_idle = max_processes
+        self.home_dir = home_dir
+        self.engine_home_dir = engine_home_dir
+        self.parent = parent
+        self.max_idle = max_idle
+        self.max_processes = max_processes
+        self.program = program
+        self._next_id = 1
+        self._idle = []
+        self._processes = {}
+        self._draining = []
+        # The script and the messages posted so far of each worker
+        # waiting for a process, by id, in the order they were spawned.
+        self._queued = collections.OrderedDict()
+        # Called with each event received when the pool is driven by
+        # a Reactor, rather than by wait().
+        self.on_event = None
+
+    def spawn(self, script):
+        """
+        Starts running the given script in a worker process, returning
+        the worker's id. If there are already 'max_processes' busy
+        processes, the worker is queued, along with any messages
+        posted to it, until one of them is free.
+        """
+
+        worker_id = self._next_id
+        self._next_id += 1
+        proc = self._take_process()
+        if proc is None:
+            self._queued[worker_id] = (script, [])
+        else:
+            self._start(proc, worker_id, script)
+        return worker_id
+
+    def _take_process(self):
+        if self._idle:
+            return self._idle.pop()
+        busy = len(self._processes) + len(self._draining)
+        if busy >= self.max_processes:
+            return None
+        return WorkerProcess(self.home_dir, self.engine_home_dir,
+                             self.program,
+                             max_processes = max(1, self.max_processes // 2))
+
+    def _start(self, proc, worker_id, script, messages=()):
+        proc.worker_id = worker_id
+        proc.state = 'active'
+        self._processes[worker_id] = proc
+        proc.channel.send('S', script.encode('utf-8'))
+        for data in messages:
+            proc.channel.send('M', data)
+
+    def _start_queued(self):
+        while self._queued:
+            proc = self._take_process()
+            if proc is None:
+                return
+            worker_id, (script, messages) = self._queued.popitem(last=False)
+            self._start(proc, worker_id, script, messages)
+
+    def post(self, worker_id, data):
+        proc = self._processes.get(worker_id)
+        if proc is not None:
+            proc.channel.send('M', data.encode('utf-8'))
+        elif worker_id in self._queued:
+            self._queued[worker_id][1].append(data.encode('utf-8'))
+
+    def terminate(self, worker_id):
+        if self._queued.pop(worker_id, None) is not None:
+            return
+        proc = self._processes.pop(worker_id, None)
+        if proc is not None:
+            proc.channel.send('T')
+            proc.state = 'draining'
+            self._draining.append(proc)
+
+    def _release(self, proc):
+        proc.worker_id = None
+        if len(self._idle) < self.max_idle:
+            proc.state = 'idle'
+            self._idle.append(proc)
+        else:
+            proc.close()
+        self._start_queued()
+
+    def _discard(self, proc):
+        proc.close()
+        self._start_queued()
+
+    def wait(self):
+        """
+        Blocks until a message arrives from the parent or from one of
+        the active workers, returning a (source, type, data) tuple;
+        'source' is None for the parent, or a worker id.
+
+        Returns None if there's nothing that could send a message.
+        """
+
+        while True:
+            channels = self._channels()
+            if not channels:
+                return None
+            try:
+                ready = select.select(channels, [], [])[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for channel in ready:
+                event = self._receive_from(channel)
+                if event is not None:
+                    return event
+
+    def _channels(self):
+        channels = [proc.channel for proc in self._processes.values()]
+        channels.extend([proc.channel for proc in self._draining])
+        if self.parent is not None:
+            channels.append(self.parent)
+        return channels
+
+    def filenos(self):
+        """
+        Returns the descriptors that messages may arrive on, so that
+        the pool can be added to a Reactor as a source.
+        """
+
+        return [channel.fileno() for channel in self._channels()]
+
+    def ready(self, fd):
+        for channel in self._channels():
+            if channel.fileno() == fd:
+                event = self._receive_from(channel)
+                if event is not None and self.on_event is not None:
+                    self.on_event(event)
+                return
+
+    def _receive_from(self, channel):
+        frame = channel.receive()
+        if channel is self.parent:
+            if frame is None or frame[0] == 'T':
+                raise WorkerTerminated()
+            if frame[0] == 'M':
+                return (None, 'message', frame[1].decode('utf-8'))
+            return None
+
+        proc = [proc for proc in (self._processes.values() + self._draining)
+                if proc.channel is channel][0]
+        if proc.state == 'draining':
+            # Discard anything sent before the worker stopped.
+            if frame is None:
+                self._draining.remove(proc)
+                self._discard(proc)
+            elif frame[0] == 'D':
+                self._draining.remove(proc)
+                self._release(proc)
+            return None
+
+        worker_id = proc.worker_id
+        if frame is None:
+            del self._processes[worker_id]
+            self._discard(proc)
+            return (worker_id, 'error', u'worker process exited')
+        kind, payload = frame
+        if kind == 'D':
+            # The worker closed itself.
+            del self._processes[worker_id]
+            self._release(proc)
+            return (worker_id, 'close', u'')
+        elif kind == 'E':
+            return (worker_id, 'error', payload.decode('utf-8'))
+        return (worker_id, 'message', payload.decode('utf-8'))
+
+    def close(self, timeout=None):
+        """
+        Stops every worker process, killing any that haven't exited
+        'timeout' seconds (CLOSE_TIMEOUT by default) after their
+        channels are closed. Queued workers never start.
+        """
+
+        if timeout is None:
+            timeout = CLOSE_TIMEOUT
+        procs = self._processes.values() + self._draining + self._idle
+        for proc in procs:
+            proc.close()
+        self._processes.clear()
+        self._draining = []
+        self._idle = []
+        self._queued.clear()
+
+        deadline = time.time() + timeout
+        for proc in procs:
+            while proc.process.poll() is None and time.time() < deadline:
+                time.sleep(0.01)
+            proc.kill()
+
+def _run_worker(channel, script, home_dir, engine_home_dir, runtime,
+                script_cache):
+    from narwhal import NarwhalRunner
+
+    runner = NarwhalRunner(argv = ['narwhal', '-e', ''],
+                           home_dir = home_dir,
+                           engine_home_dir = engine_home_dir,
+                           runtime = runtime,
+                           script_cache = script_cache)
+    runner.parent_channel = channel
+    try:
+        if runner.run() != 0:
+            channel.send('E', 'worker failed to bootstrap')
+            return
+        # Listen for messages from the parent.
+        runner.api.worker_pool()
+        run_worker = runner.sandbox.root.require('worker').runWorker
+        try:
+            run_worker(script)
+        except WorkerTerminated:
+            pass
+    finally:
+        runner.close()
+        runner.sandbox.finish()
+
+def main():
+    """
+    Entry point of a worker process. The channel to the parent is
+    passed in as stdin.
+    """
+
+    import pydermonkey
+
+    home_dir, engine_home_dir = sys.argv[1:3]
+    sock = socket.fromfd(0, socket.AF_UNIX, socket.SOCK_STREAM)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    channel = Channel(sock)
+
+    runtime = pydermonkey.Runtime()
+    script_cache = ScriptCache(
+        cache_dir = os.environ.get('NARWHAL_PYDER_CACHE_DIR')
+        )
+    while True:
+        frame = channel.receive()
+        if frame is None:
+            break
+        kind, payload = frame
+        if kind != 'S':
+            # It's left over from a worker that has already stopped.
+            continue
+        try:
+            _run_worker(channel, payload.decode('utf-8'), home_dir,
+                        engine_home_dir, runtime, script_cache)
+        except WorkerTerminated:
+            pass
+        try:
+            channel.send('D')
+        except socket.error:
+            break
+
+if __name__ == '__main__':
+    main()
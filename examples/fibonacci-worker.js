@@ -5,6 +5,9 @@ var Worker = require("worker").Worker;
 var results = [];
 
 function resultReceiver(event) {
+    // each worker answers once, so let its process be reused
+    if (typeof this.terminate === "function")
+        this.terminate();
     results.push(parseInt(event.data));
     if (results.length == 2) {
         postMessage(results[0] + results[1]);
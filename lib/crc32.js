@@ -49,6 +49,28 @@ exports.hash = function (bin, table) {
     return ~crc;
 };
 
+// engines with a native CRC-32, like pydermonkey, checksum byte strings
+// with the default table without the loop above
+var hashEngine;
+try {
+    hashEngine = require('hash-engine');
+} catch (exception) {
+    // only a missing engine module means there's no native hashing
+    if (!/couldn't find "hash-engine"/.test(String(exception)))
+        throw exception;
+}
+if (hashEngine) {
+    var jsHash = exports.hash;
+    exports.hash = function (bin, table) {
+        if (!util.no(table) && table !== exports.table)
+            return jsHash(bin, table);
+        // let the pure-JS hash throw for wide characters
+        if (typeof bin == "string" && /[^\x00-\xff]/.test(bin))
+            return jsHash(bin, table);
+        return hashEngine.crc32(bin);
+    };
+}
+
 /*
 
     References
@@ -27,6 +27,26 @@ exports.hash = function (s, _characterSize) {
     return struct.binl2bin(core_md4(struct.str2binl(s), s.length * _characterSize));
 };
 
+// engines with a native MD4, like pydermonkey, hash strings of
+// byte-sized characters without the pure-JS implementation above
+var hashEngine;
+try {
+    hashEngine = require('hash-engine');
+} catch (exception) {
+    // only a missing engine module means there's no native hashing
+    if (!/couldn't find "hash-engine"/.test(String(exception)))
+        throw exception;
+}
+if (hashEngine && hashEngine.supports('md4')) {
+    var jsHash = exports.hash;
+    exports.hash = function (s, _characterSize) {
+        if (util.no(_characterSize)) _characterSize = struct.characterSize;
+        if (_characterSize != 8)
+            return jsHash(s, _characterSize);
+        return hashEngine.hash('md4', s);
+    };
+}
+
 /*
     Calculate the MD4 of an array of little-endian words, and a bit length
 */
@@ -24,6 +24,26 @@ exports.hash = function (s, _characterSize) {
     return struct.binl2bin(core_md5(struct.str2binl(s), s.length * _characterSize));
 };
 
+// engines with a native MD5, like pydermonkey, hash strings of
+// byte-sized characters without the pure-JS implementation above
+var hashEngine;
+try {
+    hashEngine = require('hash-engine');
+} catch (exception) {
+    // only a missing engine module means there's no native hashing
+    if (!/couldn't find "hash-engine"/.test(String(exception)))
+        throw exception;
+}
+if (hashEngine && hashEngine.supports('md5')) {
+    var jsHash = exports.hash;
+    exports.hash = function (s, _characterSize) {
+        if (util.no(_characterSize)) _characterSize = struct.characterSize;
+        if (_characterSize != 8)
+            return jsHash(s, _characterSize);
+        return hashEngine.hash('md5', s);
+    };
+}
+
 /*
  * Calculate the MD5 of an array of little-endian words, and a bit length
  */
@@ -4,6 +4,36 @@
 
 var system = require("system");
 
+// engines that keep an index of the files on the search path, like
+// pydermonkey, provide system.moduleIndex, which finds a module with
+// a single lookup.  setPaths() tells it a search path and extensions,
+// returning a handle that resolve() finds modules on them with.  each
+// loader keeps its own handle, so loaders with different search paths
+// don't make the index start over.  resolve() returns the path of the
+// module, or undefined if it isn't in the index, in which case the
+// loader looks for it itself.
+var indexedFinder = function () {
+    var key, searchPath;
+    return function (topId, paths, extensions) {
+        var index = system.moduleIndex;
+        if (!index)
+            return undefined;
+        var newKey = paths.concat(extensions).join("\0");
+        if (newKey !== key) {
+            searchPath = index.setPaths(paths.map(String), extensions);
+            key = newKey;
+        }
+        return index.resolve(topId, searchPath);
+    };
+};
+
+// engines that can load modules from places the file API doesn't
+// show, like pydermonkey's zip archives, provide system.moduleFs with
+// the isFile, read and mtime functions the loader uses instead.
+var moduleFs = function () {
+    return system.moduleFs || system.fs;
+};
+
 exports.Loader = function (options) {
     var loader = {};
     var factories = options.factories || {};
@@ -11,6 +41,7 @@ exports.Loader = function (options) {
     var extensions = options.extensions || ["", ".js"];
     var timestamps = {};
     var debug = options.debug;
+    var findIndexed = indexedFinder();
 
     loader.resolve = exports.resolve;
 
@@ -18,12 +49,18 @@ exports.Loader = function (options) {
         // if it's absolute only search the "root" directory.
         // file.join() must collapse multiple "/" into a single "/"
         var searchPaths = system.fs.isAbsolute(topId) ? [""] : paths;
-        
+
+        if (searchPaths === paths) {
+            var indexed = findIndexed(topId, paths, extensions);
+            if (indexed)
+                return indexed;
+        }
+
         for (var j = 0; j < extensions.length; j++) {
             var extension = extensions[j];
             for (var i = 0; i < searchPaths.length; i++) {
                 var path = system.fs.join(searchPaths[i], topId + extension);
-                if (system.fs.isFile(path))
+                if (moduleFs().isFile(path))
                     return path;
             }
         }
@@ -33,11 +70,11 @@ exports.Loader = function (options) {
     loader.fetch = function (topId, path) {
         if (!path)
             path = loader.find(topId);
-        if (typeof system.fs.mtime === "function")
-            timestamps[path] = system.fs.mtime(path);
+        if (typeof moduleFs().mtime === "function")
+            timestamps[path] = moduleFs().mtime(path);
         if (debug)
             print('loader: fetching ' + topId);
-        var text = system.fs.read(path, {
+        var text = moduleFs().read(path, {
             'charset': 'utf-8'
         });
         // we leave the endline so the error line numbers align
@@ -59,7 +96,7 @@ exports.Loader = function (options) {
     loader.load = function (topId) {
         if (!Object.prototype.hasOwnProperty.call(factories, topId)) {
             loader.reload(topId);
-        } else if (typeof system.fs.mtime === "function") {
+        } else if (typeof moduleFs().mtime === "function") {
             var path = loader.find(topId);
             if (loader.hasChanged(topId, path))
                 loader.reload(topId);
@@ -80,7 +117,7 @@ exports.Loader = function (options) {
             path = loader.resolve(topId);
         return (
             !Object.prototype.hasOwnProperty.call(timestamps, path) ||
-            system.fs.mtime(path) > timestamps[path]
+            moduleFs().mtime(path) > timestamps[path]
         );
     };
 
@@ -95,6 +132,7 @@ exports.MultiLoader = function (options) {
     var factories = options.factories || {};
 
     var self = {};
+    var findIndexed = indexedFinder();
     self.paths = options.paths || [];
     self.loader = options.loader || exports.Loader(options);
     self.loaders = options.loaders || [
@@ -108,28 +146,38 @@ exports.MultiLoader = function (options) {
         // if it's absolute only search the "root" directory.
         // file.join() must collapse multiple "/" into a single "/"
         var searchPaths = system.fs.isAbsolute(topId) ? [""] :  self.paths;
-        
+
+        if (searchPaths === self.paths) {
+            var indexed = findIndexed(topId, self.paths, self.loaders.map(function (pair) {
+                return pair[0];
+            }));
+            if (indexed)
+                return [self.loaderFor(indexed), indexed];
+        }
+
         for (var j = 0; j < self.loaders.length; j++) {
             var extension = self.loaders[j][0];
-            var loader = self.loaders[j][1];
             for (var i = 0; i < searchPaths.length; i++) {
                 var path = system.fs.join(searchPaths[i], topId + extension);
-                if (system.fs.isFile(path)) {
-                    // now check each extension for a match.
-                    // handles case when extension is in the id, so it's matched by "",
-                    // but we want to use the loader corresponding to the actual extension
-                    for (var k = 0; k < self.loaders.length; k++) {
-                        var ext = self.loaders[k][0];
-                        if (path.lastIndexOf(ext) === path.length - ext.length)
-                            return [self.loaders[k][1], path];
-                    }
-                    throw "ERROR: shouldn't reach this point!"
-                }
+                if (moduleFs().isFile(path))
+                    return [self.loaderFor(path), path];
             }
         }
         throw "require error: couldn't find \"" + topId + '"';
     };
 
+    // now check each extension for a match.
+    // handles case when extension is in the id, so it's matched by "",
+    // but we want to use the loader corresponding to the actual extension
+    self.loaderFor = function (path) {
+        for (var k = 0; k < self.loaders.length; k++) {
+            var ext = self.loaders[k][0];
+            if (path.lastIndexOf(ext) === path.length - ext.length)
+                return self.loaders[k][1];
+        }
+        throw "ERROR: shouldn't reach this point!"
+    };
+
     self.load = function (topId, loader, path) {
         if (!loader || !path) {
             var pair = self.find(topId);
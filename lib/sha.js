@@ -18,6 +18,26 @@ exports.hash = function (s, _characterSize) {
     return struct.binb2bin(core_sha(struct.str2binb(s), s.length * _characterSize));
 };
 
+// engines with a native SHA-1, like pydermonkey, hash strings of
+// byte-sized characters without the pure-JS implementation above
+var hashEngine;
+try {
+    hashEngine = require('hash-engine');
+} catch (exception) {
+    // only a missing engine module means there's no native hashing
+    if (!/couldn't find "hash-engine"/.test(String(exception)))
+        throw exception;
+}
+if (hashEngine && hashEngine.supports('sha1')) {
+    var jsHash = exports.hash;
+    exports.hash = function (s, _characterSize) {
+        if (util.no(_characterSize)) _characterSize = struct.characterSize;
+        if (_characterSize != 8)
+            return jsHash(s, _characterSize);
+        return hashEngine.hash('sha1', s);
+    };
+}
+
 exports.hmac_sha = function (key, data, _characterSize) {
     return struct.binb2bin(core_hmac_sha(key, data, _characterSize));
 };
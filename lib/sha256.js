@@ -10,6 +10,26 @@ exports.hash = function (s, _characterSize) {
     return struct.binb2bin(core(struct.str2binb(s, _characterSize), s.length * _characterSize));
 };
 
+// engines with a native SHA-256, like pydermonkey, hash strings of
+// byte-sized characters without the pure-JS implementation above
+var hashEngine;
+try {
+    hashEngine = require('hash-engine');
+} catch (exception) {
+    // only a missing engine module means there's no native hashing
+    if (!/couldn't find "hash-engine"/.test(String(exception)))
+        throw exception;
+}
+if (hashEngine && hashEngine.supports('sha256')) {
+    var jsHash = exports.hash;
+    exports.hash = function (s, _characterSize) {
+        if (util.no(_characterSize)) _characterSize = struct.characterSize;
+        if (_characterSize != 8)
+            return jsHash(s, _characterSize);
+        return hashEngine.hash('sha256', s);
+    };
+}
+
 var S  = function (X, n) { return ( X >>> n ) | (X << (32 - n)); }
 var R  = function (X, n) { return ( X >>> n ); }
 var Ch = function (x, y, z) { return ((x & y) ^ ((~x) & z)); }
@@ -10,6 +10,12 @@ var parser = exports.parser = new args.Parser();
 parser.option('--no-color', 'color').def(true).set(false);
 parser.option('--loop', 'loop').def(false).set(true);
 parser.option('--stacktrace', 'showStacktraces').def(false).set(true);
+parser.option('-j', '--jobs', 'jobs').def(1).natural()
+    .help('run test modules in N processes, or one per CPU if 0, on engines that support it');
+parser.option('--timeout', 'timeout').def(60).number()
+    .help('stop each test after SECONDS when running in parallel');
+parser.option('--timings', 'timings').set()
+    .help('FILE recording how long each module takes, so the slowest run first');
 
 function getBacktrace(e) {
     if (!e) {
@@ -32,18 +38,210 @@ exports.run = function(objectOrModule) {
     var options = parser.parse([module.path].concat(system.args));
     if (options.color == false)
         stream.disable();
+    var id;
     if (!objectOrModule) {
-        var id = file.canonical(options.args.shift());
+        id = file.canonical(options.args.shift());
         objectOrModule = require(id);
+    } else if (require.main && require(require.main) === objectOrModule) {
+        id = require.main;
     }
-    
+
+    // test modules are only run in separate processes if the engine
+    // can, and they can be required again by id
+    var testEngine;
+    if (options.jobs !== 1 && id) {
+        try {
+            testEngine = require("test-engine");
+        } catch (exception) {
+            // only a missing engine module means there's no parallel runner
+            if (!/couldn't find "test-engine"/.test(String(exception)))
+                throw exception;
+        }
+    }
+
     do {
-        var result = _run(objectOrModule, options);
+        if (testEngine)
+            var result = testEngine.runParallel(id, exports.listModules(objectOrModule), options);
+        else
+            var result = _run(objectOrModule, options);
     } while (options.loop);
     
     return result;
 }
 
+var spacesFor = function (depth) {
+    for (var spaces=""; spaces.length < depth * 2; spaces += "  ");
+    return spaces;
+};
+
+// the test that runTest() is in the middle of, so that abortTest() can
+// clean up after it if the engine stops it
+var running;
+
+var checkGlobals = function (objectOrModule, globals) {
+    if (!objectOrModule.addsGlobals) {
+        for (var name in system.global) {
+            if (!globals[name]) {
+                delete system.global[name];
+                throw new assert.AssertionError("New global introduced: " + util.enquote(name));
+            }
+        }
+    }
+};
+
+var runTest = function (objectOrModule, property, options, localContext) {
+    if (typeof objectOrModule.setup === "function")
+        objectOrModule.setup();
+
+    var globals = {};
+    for (var name in system.global) {
+        globals[name] = true;
+    }
+    running = {object: objectOrModule, globals: globals};
+
+    try {
+        try {
+            objectOrModule[property]();
+        } finally {
+            running = undefined;
+            checkGlobals(objectOrModule, globals);
+        }
+
+        localContext.passed++;
+    } catch (e) {
+        if (e.name === "AssertionError") {
+            var backtrace = getBacktrace(e);
+            var message = "Assertion failed in "+property+":";
+            
+            stream.print("\0violet("+message+"\0)");
+            stream.print("\0yellow("+e+"\0)");
+            if (options.showStacktraces && backtrace)
+                stream.print("\0blue("+backtrace+"\0)");
+
+            localContext.failed++;
+        } else {    
+            var backtrace = getBacktrace(e);
+            var message = "Exception in "+property+":";
+            
+            stream.print("\0violet("+message+"\0)");
+            stream.print("\0red("+e+"\0)");
+            if (backtrace)
+                stream.print("\0blue("+backtrace+"\0)");
+            
+            localContext.error++;
+        }
+    } finally {
+        if (typeof objectOrModule.teardown === "function")
+            objectOrModule.teardown();
+    }
+};
+
+var hasTestFunctions = function (object) {
+    for (var property in object) {
+        if (property.match(/^test/) && typeof object[property] == "function")
+            return true;
+    }
+    return false;
+};
+
+/*** listModules
+    returns the paths of property names that lead from the given suite
+    to each test module in it, which are the objects with tests of
+    their own, as opposed to suites of further modules.  these are
+    the units that tests are run in parallel by.
+*/
+exports.listModules = function (objectOrModule, path) {
+    if (typeof objectOrModule === "string")
+        objectOrModule = require(objectOrModule);
+    path = path || [];
+    if (hasTestFunctions(objectOrModule))
+        return [path];
+    var modules = [];
+    for (var property in objectOrModule) {
+        if (property.match(/^test/))
+            modules.push.apply(modules, exports.listModules(
+                objectOrModule[property],
+                path.concat([property])
+            ));
+    }
+    return modules;
+};
+
+// follows the given path of property names from a suite, requiring
+// any module ids along the way
+var lookup = function (objectOrModule, path) {
+    for (var i = 0; i < path.length; i++) {
+        if (typeof objectOrModule === "string")
+            objectOrModule = require(objectOrModule);
+        objectOrModule = objectOrModule[path[i]];
+    }
+    if (typeof objectOrModule === "string")
+        objectOrModule = require(objectOrModule);
+    return objectOrModule;
+};
+
+var collectTests = function (objectOrModule, path, tests) {
+    if (typeof objectOrModule === "string")
+        objectOrModule = require(objectOrModule);
+    for (var property in objectOrModule) {
+        if (property.match(/^test/)) {
+            if (typeof objectOrModule[property] == "function")
+                tests.push(path.concat([property]));
+            else
+                collectTests(objectOrModule[property], path.concat([property]), tests);
+        }
+    }
+};
+
+/*** listTests
+    returns the paths of property names that lead from the given suite
+    to each test under the object at the given path, in the order that
+    run() runs them.
+*/
+exports.listTests = function (objectOrModule, path) {
+    path = path || [];
+    var tests = [];
+    collectTests(lookup(objectOrModule, path), path, tests);
+    return tests;
+};
+
+/*** abortTest
+    cleans up after a test that the engine stopped in the middle of
+    runTest(), such as for running too long, which skips its finally
+    blocks: checks it for new globals, which throws an AssertionError,
+    and calls its object's teardown() either way.
+*/
+exports.abortTest = function () {
+    var test = running;
+    running = undefined;
+    if (!test)
+        return;
+    try {
+        checkGlobals(test.object, test.globals);
+    } finally {
+        if (typeof test.object.teardown === "function")
+            test.object.teardown();
+    }
+};
+
+/*** runTest
+    runs the test at the end of the given path of property names from
+    the suite, printing its results like run() does, and returns
+    "passed", "failed" or "error".
+*/
+exports.runTest = function (objectOrModule, path, options) {
+    var object = lookup(objectOrModule, path.slice(0, -1));
+    var property = path[path.length - 1];
+    var localContext = { passed : 0, failed : 0, error : 0 };
+    print(spacesFor(path.length) + "+ Running "+property);
+    runTest(object, property, options || {}, localContext);
+    if (localContext.failed)
+        return "failed";
+    if (localContext.error)
+        return "error";
+    return "passed";
+};
+
 var _run = function(objectOrModule, options, context) {
 
     if (typeof objectOrModule === "string")
@@ -55,61 +253,13 @@ var _run = function(objectOrModule, options, context) {
     var localContext = context || { passed : 0, failed : 0, error : 0, depth : 0 };
     localContext.depth++;
     
-    for (var spaces=""; spaces.length < localContext.depth * 2; spaces += "  ");
+    var spaces = spacesFor(localContext.depth);
     
     for (var property in objectOrModule) {
         if (property.match(/^test/)) {
             print(spaces + "+ Running "+property);
             if (typeof objectOrModule[property] == "function") {
-                if (typeof objectOrModule.setup === "function")
-                    objectOrModule.setup();
-
-                var globals = {};
-                for (var name in system.global) {
-                    globals[name] = true;
-                }
-
-                try {
-                    try {
-                        objectOrModule[property]();
-                    } finally {
-                        if (!objectOrModule.addsGlobals) {
-                            for (var name in system.global) {
-                                if (!globals[name]) {
-                                    delete system.global[name];
-                                    throw new assert.AssertionError("New global introduced: " + util.enquote(name));
-                                }
-                            }
-                        }
-                    }
-
-                    localContext.passed++;
-                } catch (e) {
-                    if (e.name === "AssertionError") {
-                        var backtrace = getBacktrace(e);
-                        var message = "Assertion failed in "+property+":";
-                        
-                        stream.print("\0violet("+message+"\0)");
-                        stream.print("\0yellow("+e+"\0)");
-                        if (options.showStacktraces && backtrace)
-                            stream.print("\0blue("+backtrace+"\0)");
-
-                        localContext.failed++;
-                    } else {    
-                        var backtrace = getBacktrace(e);
-                        var message = "Exception in "+property+":";
-                        
-                        stream.print("\0violet("+message+"\0)");
-                        stream.print("\0red("+e+"\0)");
-                        if (backtrace)
-                            stream.print("\0blue("+backtrace+"\0)");
-                        
-                        localContext.error++;
-                    }
-                } finally {
-                    if (typeof objectOrModule.teardown === "function")
-                        objectOrModule.teardown();
-                }
+                runTest(objectOrModule, property, options, localContext);
             } else {
                 _run(objectOrModule[property], options, localContext);
             }